@@ -0,0 +1,47 @@
+"""ベンチマーク結果の比較
+
+2つの結果JSONのmin_secを比較し、閾値を超えて遅くなった処理があれば終了コード1を返す。
+
+    python benchmarks/compare.py base.json head.json --threshold 1.2
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=1.2, help="許容する倍率")
+    args = parser.parse_args()
+
+    base = json.loads(Path(args.base).read_text())
+    head = json.loads(Path(args.head).read_text())
+    for key in ("tweets", "ingest_tweets", "follower_ids", "seed"):
+        if base["metadata"].get(key) != head["metadata"].get(key):
+            print(f"warning: {key} differs between results", file=sys.stderr)
+
+    regressions = []
+    print(f"{'case':<40} {'base':>10} {'head':>10} {'ratio':>7}")
+    for name, result in head["results"].items():
+        if name not in base["results"]:
+            print(f"{name:<40} {'-':>10} {result['min_sec']:>10.4f} {'-':>7}")
+            continue
+        base_sec = base["results"][name]["min_sec"]
+        ratio = result["min_sec"] / base_sec if base_sec else float("inf")
+        mark = " !" if ratio > args.threshold else ""
+        print(
+            f"{name:<40} {base_sec:>10.4f} {result['min_sec']:>10.4f} {ratio:>7.2f}{mark}"
+        )
+        if ratio > args.threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""tweepy.APIの代わりに合成データを返すフェイク
+
+search（/search/tweets）、oauth.get（/followers/ids, /friends/ids, /users/lookup）、rate_limit_statusの
+レスポンスをTwitter APIと同じ形式（JSON → tweepy.models.Status）で返す。
+"""
+import json
+import time
+from email.utils import format_datetime
+
+import numpy
+import pandas
+from tweepy.models import Status
+from tweepy.parsers import ModelParser
+
+from twivis.constants import (
+    API_TYPES,
+    API_URLS,
+    FOLLOWER_IDS_API_PATH,
+    FRIEND_IDS_API_PATH,
+    USERS_LOOKUP_API_PATH,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode()
+
+
+class FakeOAuthSession:
+    def __init__(self, ids_by_url, profiles=None):
+        self._ids_by_url = ids_by_url
+        self._profiles = profiles or {}
+
+    def get(self, url, params):
+        if url == API_URLS[USERS_LOOKUP_API_PATH]:
+            return self._lookup(params)
+        ids = self._ids_by_url[url]
+        # cursor=-1は先頭、0は末尾（Twitter APIと同じ）
+        cursor = params["cursor"]
+        start = 0 if cursor == -1 else len(ids) if cursor == 0 else cursor
+        end = min(start + params["count"], len(ids))
+        body = {
+            "ids": ids[start:end].tolist(),
+            "next_cursor": end if end < len(ids) else 0,
+            "previous_cursor": start,
+        }
+        return FakeResponse(200, json.dumps(body).encode())
+
+    def _lookup(self, params):
+        # 存在しないユーザは返さず、1件も存在しない場合は404（Twitter APIと同じ）
+        user_ids = [int(i) for i in params["user_id"].split(",")]
+        users = [self._profiles[i] for i in user_ids if i in self._profiles]
+        if not users:
+            error = {"code": 17, "message": "No user matches for specified terms."}
+            body = {"errors": [error]}
+            return FakeResponse(404, json.dumps(body).encode())
+        return FakeResponse(200, json.dumps(users).encode())
+
+
+class FakeAuth:
+    consumer_key = "consumer_key"
+    consumer_secret = "consumer_secret"
+    access_token = "access_token"
+    access_token_secret = "access_token_secret"
+
+    def __init__(self, oauth: FakeOAuthSession):
+        self.oauth = oauth
+
+
+class FakeAPI:
+    """合成データを返すtweepy.API互換オブジェクト
+
+    :param tweet_df: synthetic.make_synthetic_tweet_dfで生成したDataFrame（新しい順）
+    :param follower_ids: /followers/idsで返すID
+    :param friend_ids: /friends/idsで返すID
+    :param profile_df: /users/lookupで返すプロフィール（synthetic.make_synthetic_profile_df）
+    """
+
+    def __init__(
+        self,
+        tweet_df: pandas.DataFrame = None,
+        follower_ids: numpy.ndarray = None,
+        friend_ids: numpy.ndarray = None,
+        profile_df: pandas.DataFrame = None,
+    ):
+        self.parser = ModelParser()
+        self._tweet_df = tweet_df
+        self._negated_ids = (
+            -tweet_df["tweet_id"].to_numpy() if tweet_df is not None else None
+        )
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        self.auth = FakeAuth(
+            FakeOAuthSession(
+                {
+                    API_URLS[FOLLOWER_IDS_API_PATH]: (
+                        empty if follower_ids is None else follower_ids
+                    ),
+                    API_URLS[FRIEND_IDS_API_PATH]: (
+                        empty if friend_ids is None else friend_ids
+                    ),
+                },
+                profiles=(
+                    None
+                    if profile_df is None
+                    else {
+                        int(row.user_id): _to_user_json(row)
+                        for row in profile_df.itertuples()
+                    }
+                ),
+            )
+        )
+
+    def search(self, q, tweet_mode=None, count=100, max_id=None, since_id=None):
+        start = 0
+        if max_id is not None:
+            start = numpy.searchsorted(self._negated_ids, -max_id, side="left")
+        end = start + count
+        if since_id is not None:
+            end = min(
+                end, numpy.searchsorted(self._negated_ids, -since_id, side="left")
+            )
+        page = self._tweet_df.iloc[start:end]
+        return [Status.parse(self, _to_status_json(row)) for row in page.itertuples()]
+
+    def rate_limit_status(self):
+        reset = int(time.time()) + 15 * 60
+        return {
+            "resources": {
+                api_type: {
+                    api_path: {
+                        "limit": 180,
+                        "remaining": 180,
+                        "reset": reset,
+                    }
+                }
+                for api_path, api_type in API_TYPES.items()
+            }
+        }
+
+
+def _to_user_json(row) -> dict:
+    return {
+        "id": int(row.user_id),
+        "id_str": str(row.user_id),
+        "screen_name": row.user_screen_name,
+        "name": row.user_name,
+        "profile_image_url_https": row.user_profile_image_url,
+        "followers_count": int(row.followers_count),
+        "friends_count": int(row.friends_count),
+        "statuses_count": int(row.statuses_count),
+        "protected": bool(row.protected),
+        "verified": bool(row.verified),
+        "created_at": row.user_created_at.strftime("%a %b %d %H:%M:%S +0000 %Y"),
+    }
+
+
+def _to_status_json(row) -> dict:
+    user = {
+        "id": int(row.user_id),
+        "screen_name": row.user_screen_name,
+        "name": row.user_name,
+        "profile_image_url_https": row.user_profile_image_url,
+        "followers_count": int(row.followers_count),
+        "friends_count": int(row.friends_count),
+        "following": bool(row.following),
+    }
+    status = {
+        "created_at": format_datetime(row.tweeted_dt.tz_convert("UTC")),
+        "id": int(row.tweet_id),
+        "full_text": row.full_text,
+        "lang": row.lang,
+        "source": row.source,
+        "favorite_count": int(row.favorite_count),
+        "retweet_count": int(row.retweet_count),
+        "entities": {
+            "hashtags": [{"text": h} for h in row.hashtags],
+            "user_mentions": [
+                {"id": int(i), "screen_name": s}
+                for i, s in zip(row.mention_user_ids, row.mention_screen_names)
+            ],
+        },
+        "in_reply_to_status_id": int(row.in_reply_to_tweet_id) or None,
+        "in_reply_to_user_id": int(row.in_reply_to_user_id) or None,
+        "is_quote_status": bool(row.quoted_user_id),
+        "user": user,
+    }
+    if row.retweeted_user_id:
+        status["retweeted_status"] = {
+            **status,
+            "id": int(row.retweeted_tweet_id),
+            "user": {**user, "id": int(row.retweeted_user_id)},
+        }
+    if row.quoted_user_id:
+        status["quoted_status_id"] = int(row.quoted_tweet_id)
+        status["quoted_status"] = {
+            **status,
+            "id": int(row.quoted_tweet_id),
+            "user": {**user, "id": int(row.quoted_user_id)},
+        }
+    return status
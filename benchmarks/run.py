@@ -0,0 +1,557 @@
+"""ベンチマークスイート
+
+合成データとフェイクAPIで、収集（ページング）・フォロワー付与・集計・ランキング・
+グラフ構築の各処理時間を計測し、コミット間で比較できるJSONを出力する。
+
+    python benchmarks/run.py --scale small --output results.json
+    python benchmarks/compare.py base.json results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy
+import pandas
+import pytz
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_api import FakeAPI  # noqa: E402
+from synthetic import (  # noqa: E402
+    make_synthetic_follower_ids,
+    make_synthetic_profile_df,
+    make_synthetic_tweet_df,
+)
+
+from twivis import metrics  # noqa: E402
+from twivis.aggregates import TweetAggregates  # noqa: E402
+from twivis.audiences import AudienceSet  # noqa: E402
+from twivis.filters import filter_sub_query, filter_user  # noqa: E402
+from twivis.hydration import ProfileCache, hydrate_users  # noqa: E402
+from twivis.ids import IdBuffer, parse_id_page  # noqa: E402
+from twivis.indexes import TweetIndex  # noqa: E402
+from twivis.interactions import (  # noqa: E402
+    build_interaction_graph,
+    compute_components,
+    compute_pagerank,
+)
+from twivis.processors import (  # noqa: E402
+    estimate_total,
+    make_count_tweeted_df,
+    make_count_tweeted_hour_df,
+    make_count_tweeted_weekday_df,
+    make_engagement_df,
+    make_tweet_user_weekday_max_hour_df,
+    make_tweeted_hour_label_range,
+    make_tweeted_weekday_hour_label_range,
+    make_tweeted_weekday_range,
+    make_user_df,
+)
+from twivis.rankings import make_user_ranking  # noqa: E402
+from twivis.sql import SQLStore  # noqa: E402
+from twivis.stores import TweetStore  # noqa: E402
+from twivis.transports import (  # noqa: E402
+    RecordingTransport,
+    ReplayTransport,
+    Transport,
+    set_transport,
+)
+from twivis.tweets import sample_tweets, search_tweets  # noqa: E402
+from twivis.users import get_follower_ids  # noqa: E402
+
+SCALES = {
+    # ツイート件数, 収集（ページング）のツイート件数, フォロワーID件数
+    "small": {"tweets": 10_000, "ingest_tweets": 2_000, "follower_ids": 1_000},
+    "medium": {"tweets": 1_000_000, "ingest_tweets": 20_000, "follower_ids": 1_000_000},
+    "large": {
+        "tweets": 10_000_000,
+        "ingest_tweets": 100_000,
+        "follower_ids": 50_000_000,
+    },
+}
+
+# フォロワーの重なりを比較するアカウント数
+N_AUDIENCES = 20
+
+# プロフィールを取得するフォロワー数の上限（users/lookupは1リクエスト100件）
+N_HYDRATE_IDS = 20_000
+
+# サンプリング取得のリクエスト数（直近7日間の1時間ごとに1リクエスト程度）
+N_SAMPLE_REQUESTS = 180
+
+# 定期再検索1回分の差分（新規ツイート・いいね数が変わった取得済みツイート）の割合
+REFRESH_RATIO = 0.01
+
+
+class Suite:
+    def __init__(self, repeat: int):
+        self._repeat = repeat
+        self.results = {}
+
+    def run(self, name: str, func, rows: int):
+        """処理をrepeat回実行し、最小・中央値の秒数を記録する"""
+        seconds = []
+        result = None
+        for _ in range(self._repeat):
+            start = time.perf_counter()
+            result = func()
+            seconds.append(time.perf_counter() - start)
+        self.results[name] = {
+            "min_sec": min(seconds),
+            "median_sec": float(numpy.median(seconds)),
+            "rows": rows,
+            "rows_per_sec": rows / min(seconds) if min(seconds) > 0 else None,
+        }
+        print(f"{name:<40} {min(seconds):>10.4f} sec", file=sys.stderr)
+        return result
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _match_recompute(store: TweetStore, timezone) -> bool:
+    """集計結果の全ての読み出しが、processorsで全件を集計した結果と一致するか"""
+    aggregates = store.get_aggregates()
+    tweets = store.tweets
+    weekdays = make_tweeted_weekday_range(timezone)
+    weekday_hours = make_tweeted_weekday_hour_label_range(timezone)
+    pairs = [
+        (aggregates.make_user_df(store.users), make_user_df(tweets, users=store.users)),
+        (
+            aggregates.make_count_df("tweeted_weekday", weekdays),
+            make_count_tweeted_weekday_df(tweets, timezone),
+        ),
+        (
+            aggregates.make_count_df("tweeted_wh", weekday_hours),
+            make_count_tweeted_df(tweets, timezone, group_col="tweeted_wh"),
+        ),
+        (
+            aggregates.make_count_df("tweeted_hour", make_tweeted_hour_label_range()),
+            make_count_tweeted_hour_df(tweets),
+        ),
+        (
+            aggregates.make_user_count_df(weekdays),
+            make_count_tweeted_weekday_df(
+                make_tweet_user_weekday_max_hour_df(tweets), timezone
+            ),
+        ),
+        *(
+            (
+                aggregates.make_engagement_df(group_col, labels),
+                make_engagement_df(tweets, group_col, labels),
+            )
+            for group_col, labels in (
+                ("tweeted_weekday", weekdays),
+                ("tweeted_wh", weekday_hours),
+            )
+        ),
+    ]
+    for actual, expected in pairs:
+        try:
+            pandas.testing.assert_frame_equal(
+                actual,
+                expected,
+                check_dtype=False,
+                check_index_type=False,
+                check_categorical=False,
+            )
+        except AssertionError:
+            return False
+    return True
+
+
+def run_benchmarks(
+    tweets: int, ingest_tweets: int, follower_ids: int, seed: int, repeat: int
+):
+    timezone = pytz.timezone("Asia/Tokyo")
+    now = datetime.now(timezone)
+    suite = Suite(repeat=repeat)
+
+    df = make_synthetic_tweet_df(tweets, seed=seed, timezone=timezone, now=now)
+    ids = make_synthetic_follower_ids(follower_ids, seed=seed, tweet_df=df)
+
+    # 収集：フェイクAPIのページングとレスポンスの変換（待機処理は行わない）
+    ingest_api = FakeAPI(
+        tweet_df=make_synthetic_tweet_df(
+            ingest_tweets, seed=seed, timezone=timezone, now=now
+        ),
+        follower_ids=ids,
+    )
+    archive_dir = tempfile.TemporaryDirectory()
+    set_transport(RecordingTransport(archive_dir.name, Transport(wait=False)))
+    search_tweets(ingest_api, search_query="word1", limit=None, timezone=timezone)
+    get_follower_ids(ingest_api, user_screen_name="account")
+
+    set_transport(Transport(wait=False))
+    metrics.reset_metrics()
+    metrics.enable_metrics()
+    suite.run(
+        "ingest.search_tweets",
+        lambda: search_tweets(
+            ingest_api, search_query="word1", limit=None, timezone=timezone
+        ),
+        rows=ingest_tweets,
+    )
+    follower_result = suite.run(
+        "ingest.get_follower_ids",
+        lambda: get_follower_ids(ingest_api, user_screen_name="account"),
+        rows=follower_ids,
+    )
+    metrics.disable_metrics()
+    stage_metrics = metrics.get_metrics()
+
+    # 記録済みページの再生
+    set_transport(ReplayTransport(archive_dir.name))
+    suite.run(
+        "replay.search_tweets",
+        lambda: search_tweets(
+            ingest_api, search_query="word1", limit=None, timezone=timezone
+        ),
+        rows=ingest_tweets,
+    )
+    suite.run(
+        "replay.get_follower_ids",
+        lambda: get_follower_ids(ingest_api, user_screen_name="account"),
+        rows=follower_ids,
+    )
+    set_transport(Transport())
+    archive_dir.cleanup()
+
+    # サンプリング取得：時間帯ごとにmax_idを指定して一部だけ取得し、件数を推定する
+    set_transport(Transport(wait=False))
+    sampled = sample_tweets(
+        ingest_api,
+        search_query="word1",
+        max_requests=N_SAMPLE_REQUESTS,
+        timezone=timezone,
+    )
+    suite.run(
+        "ingest.sample_tweets",
+        lambda: sample_tweets(
+            ingest_api,
+            search_query="word1",
+            max_requests=N_SAMPLE_REQUESTS,
+            timezone=timezone,
+        ),
+        rows=len(sampled),
+    )
+    sample_estimate, sample_error = estimate_total(pandas.DataFrame(sampled))
+    set_transport(Transport())
+
+    # IDページの変換：json.loadsでlistに展開する方法と、int64バッファに直接読み取る方法
+    pages = [
+        json.dumps(
+            {"ids": ids[i : i + 5000].tolist(), "next_cursor": i + 5000}
+        ).encode()
+        for i in range(0, len(ids), 5000)
+    ]
+
+    def _decode_json():
+        _ids = []
+        for page in pages:
+            _ids.extend(json.loads(page)["ids"])
+        return _ids
+
+    def _decode_buffer():
+        buffer = IdBuffer()
+        for page in pages:
+            parse_id_page(page, buffer)
+        return buffer.to_array()
+
+    suite.run("ids.json_decode_baseline", _decode_json, rows=follower_ids)
+    suite.run("ids.buffer_decode", _decode_buffer, rows=follower_ids)
+    ids_peak_bytes = {}
+    for name, decode in (("json", _decode_json), ("buffer", _decode_buffer)):
+        tracemalloc.start()
+        decoded = decode()
+        ids_peak_bytes[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del decoded
+
+    # 非正規化のDataFrameを使うケース向けにフォロワーを付与しておく（計測はストアで行う）
+    df["follower"] = df["user_id"].isin(follower_result)
+
+    # 複数アカウントのフォロワーの重なり（各アカウントはフォロワーIDの一部を持つ）
+    rng = numpy.random.default_rng(seed)
+    audiences = AudienceSet()
+    for i in range(N_AUDIENCES):
+        audiences.add(f"account{i}", ids[rng.random(len(ids)) < 0.25])
+    audience_ids = sum(len(audiences.get(a)) for a in audiences.accounts)
+    suite.run("audiences.exact_overlap", audiences.make_overlap_df, rows=audience_ids)
+    suite.run(
+        "audiences.minhash_overlap", audiences.estimate_overlap_df, rows=audience_ids
+    )
+    suite.run(
+        "audiences.followed_by",
+        lambda: audiences.count_followed_by(df["user_id"].unique()),
+        rows=tweets,
+    )
+
+    # フォロワーIDからプロフィールを取得する（フェイクAPI、キャッシュなし・キャッシュ済み）
+    hydrate_ids = ids[:N_HYDRATE_IDS]
+    set_transport(Transport(wait=False))
+    lookup_api = FakeAPI(profile_df=make_synthetic_profile_df(hydrate_ids, seed=seed))
+    suite.run(
+        "hydration.lookup",
+        lambda: hydrate_users(lookup_api, hydrate_ids, cache=ProfileCache()),
+        rows=len(hydrate_ids),
+    )
+    profile_cache = ProfileCache()
+    hydrate_users(lookup_api, hydrate_ids, cache=profile_cache)
+    suite.run(
+        "hydration.cached",
+        lambda: hydrate_users(lookup_api, hydrate_ids, cache=profile_cache),
+        rows=len(hydrate_ids),
+    )
+    profile_cache.close()
+    set_transport(Transport())
+
+    # 集計
+    suite.run("aggregation.make_user_df", lambda: make_user_df(df), rows=tweets)
+    suite.run(
+        "aggregation.count_weekday",
+        lambda: make_count_tweeted_weekday_df(df, timezone=timezone),
+        rows=tweets,
+    )
+    suite.run(
+        "aggregation.count_weekday_hour",
+        lambda: make_count_tweeted_df(df, timezone=timezone, group_col="tweeted_wh"),
+        rows=tweets,
+    )
+    suite.run(
+        "aggregation.weekday_max_hour",
+        lambda: make_tweet_user_weekday_max_hour_df(df),
+        rows=tweets,
+    )
+    suite.run(
+        "aggregation.engagement_weekday",
+        lambda: make_engagement_df(
+            df,
+            group_col="tweeted_weekday",
+            labels=make_tweeted_weekday_range(timezone=timezone),
+        ),
+        rows=tweets,
+    )
+
+    # ツイートテーブル＋ユーザテーブル
+    store = suite.run("store.build", lambda: TweetStore.from_df(df), rows=tweets)
+    # フォロワー付与（TwiVisAPI.set_followersと同じくユーザテーブルのフラグを更新する）
+    suite.run(
+        "tagging.set_followers",
+        lambda: store.set_user_flag("follower", follower_result),
+        rows=tweets,
+    )
+    suite.run(
+        "store.make_user_df",
+        lambda: make_user_df(store.tweets, users=store.users),
+        rows=tweets,
+    )
+    # 省メモリな型（カテゴリ型など）での集計
+    suite.run(
+        "store.count_weekday_hour",
+        lambda: make_count_tweeted_df(
+            store.tweets, timezone=timezone, group_col="tweeted_wh"
+        ),
+        rows=tweets,
+    )
+    suite.run(
+        "store.weekday_max_hour",
+        lambda: make_tweet_user_weekday_max_hour_df(store.tweets),
+        rows=tweets,
+    )
+    suite.run(
+        "store.engagement_weekday",
+        lambda: make_engagement_df(
+            store.tweets,
+            group_col="tweeted_weekday",
+            labels=make_tweeted_weekday_range(timezone=timezone),
+        ),
+        rows=tweets,
+    )
+    suite.run(
+        "store.filter_user",
+        lambda: filter_user(
+            store.tweets, users=store.users, min_followers_count=1000, follower=True
+        ),
+        rows=tweets,
+    )
+
+    # 集計結果の差分更新：新規ツイートと、いいね数が変わった取得済みツイートを追加する
+    n_refresh = max(1, int(tweets * REFRESH_RATIO))
+    refreshed = df.iloc[n_refresh : n_refresh * 2].copy()
+    refreshed["favorite_count"] += 1
+    refresh_df = pandas.concat([df.iloc[:n_refresh], refreshed])
+    base_store = TweetStore.from_df(df.iloc[n_refresh:])
+    suite.run(
+        "aggregates.build",
+        lambda: TweetAggregates.from_df(base_store.tweets),
+        rows=len(base_store.tweets),
+    )
+    base_store.get_aggregates()
+    suite.run(
+        "aggregates.refresh",
+        lambda: base_store.upsert(refresh_df).get_aggregates(),
+        rows=len(refresh_df),
+    )
+    plain_store = TweetStore(tweets=base_store.tweets, users=base_store.users)
+    suite.run(
+        "aggregates.refresh_recompute",
+        lambda: TweetAggregates.from_df(plain_store.upsert(refresh_df).tweets),
+        rows=len(refresh_df),
+    )
+    # 差分更新した集計結果が全件を集計し直した結果と一致するか
+    aggregates_match = _match_recompute(base_store.upsert(refresh_df), timezone)
+
+    # 組み込みSQLエンジンへの押し下げ：ユーザ軸の絞り込みと集計・並べ替えをSQLで行う
+    sql = SQLStore()
+    suite.run("sql.load", lambda: sql.load_store(store), rows=tweets)
+    suite.run(
+        "sql.count_weekday_hour_filtered",
+        lambda: sql.where(min_followers_count=1000, follower=True).make_count_df(
+            "tweeted_wh", labels=make_tweeted_weekday_hour_label_range(timezone)
+        ),
+        rows=tweets,
+    )
+    suite.run(
+        "store.count_weekday_hour_filtered",
+        lambda: make_count_tweeted_df(
+            filter_user(
+                store.tweets, users=store.users, min_followers_count=1000, follower=True
+            ),
+            timezone=timezone,
+            group_col="tweeted_wh",
+        ),
+        rows=tweets,
+    )
+    suite.run(
+        "sql.user_ranking",
+        lambda: make_user_ranking(
+            store.tweets, col="tweets_count", ascending=False, sql=sql, follower=True
+        ),
+        rows=tweets,
+    )
+    suite.run(
+        "store.user_ranking",
+        lambda: make_user_ranking(
+            store.tweets,
+            col="tweets_count",
+            ascending=False,
+            users=store.users,
+            follower=True,
+        ),
+        rows=tweets,
+    )
+    sql.close()
+
+    # フィルタ・ランキング
+    suite.run(
+        "filters.filter_user",
+        lambda: filter_user(df, min_followers_count=1000, follower=True),
+        rows=tweets,
+    )
+    suite.run(
+        "rankings.make_user_ranking",
+        lambda: make_user_ranking(df, col="tweets_count", ascending=False),
+        rows=tweets,
+    )
+
+    # グラフ構築・インデックス
+    graph = suite.run(
+        "graphs.build_interaction_graph",
+        lambda: build_interaction_graph(df),
+        rows=tweets,
+    )
+    suite.run("graphs.pagerank", lambda: compute_pagerank(graph), rows=graph.n_edges)
+    suite.run(
+        "graphs.components", lambda: compute_components(graph), rows=graph.n_edges
+    )
+    index = suite.run("index.build", lambda: TweetIndex.from_df(df), rows=tweets)
+    suite.run(
+        "index.sub_query",
+        lambda: filter_sub_query(df, index, "word1 word2 -word3"),
+        rows=tweets,
+    )
+    suite.run(
+        "index.pandas_scan_baseline",
+        lambda: df[
+            df["full_text"].str.contains(r"\bword1\b")
+            & df["full_text"].str.contains(r"\bword2\b")
+            & ~df["full_text"].str.contains(r"\bword3\b")
+        ],
+        rows=tweets,
+    )
+    suite.run("index.top_hashtags", lambda: index.count_hashtags(), rows=tweets)
+    suite.run("index.co_hashtags", lambda: index.count_co_hashtags("tag1"), rows=tweets)
+
+    return {
+        "metadata": {
+            "git_revision": _git_revision(),
+            "timestamp": datetime.now(pytz.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "pandas": pandas.__version__,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+            "tweets": tweets,
+            "ingest_tweets": ingest_tweets,
+            "follower_ids": follower_ids,
+            "tweet_df_bytes": int(df.memory_usage(deep=True).sum()),
+            "store_bytes": store.memory_usage(),
+            "ids_decode_peak_bytes": ids_peak_bytes,
+            "aggregates_match": aggregates_match,
+            "sample_estimate": {
+                "sampled": len(sampled),
+                "estimate": sample_estimate,
+                "error": sample_error,
+                "actual": ingest_tweets,
+            },
+        },
+        "results": suite.results,
+        "ingest_metrics": stage_metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--tweets", type=int, help="scaleの値を上書きする")
+    parser.add_argument("--ingest-tweets", type=int, help="scaleの値を上書きする")
+    parser.add_argument("--follower-ids", type=int, help="scaleの値を上書きする")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="結果JSONの出力先、未指定の場合は標準出力")
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    result = run_benchmarks(seed=args.seed, repeat=args.repeat, **sizes)
+    result["metadata"]["scale"] = args.scale
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""ベンチマーク用の合成データ生成
+
+ユーザの投稿数はZipf分布、投稿時刻は直近7日間の日内変動（昼〜夜に多い）に従う。
+ツイートIDは投稿時刻から生成したsnowflake IDなので、IDの降順＝新しい順になる。
+"""
+from datetime import datetime, timedelta
+
+import numpy
+import pandas
+import pytz
+
+from twivis.processors import make_weekday, make_weekday_hour
+
+TWITTER_EPOCH_MS = 1288834974657
+
+N_WORDS = 20000
+N_HASHTAGS = 2000
+
+# 時間帯別の投稿比率（0時〜23時、昼と21時前後に山がある）
+HOURLY_WEIGHTS = numpy.array(
+    [3, 2, 1, 1, 1, 1, 2, 3, 4, 4, 4, 5, 7, 6, 5, 5, 5, 6, 7, 8, 9, 10, 8, 5],
+    dtype=numpy.float64,
+)
+
+
+def make_snowflake_ids(timestamps_ms: numpy.ndarray, seq: numpy.ndarray):
+    return ((timestamps_ms - TWITTER_EPOCH_MS) << 22) + seq
+
+
+def make_synthetic_tweet_df(
+    n_tweets: int, seed: int = 0, timezone=pytz.timezone("UTC"), now: datetime = None
+) -> pandas.DataFrame:
+    """search_tweetsの戻り値から作るDataFrameと同じ形の合成データを生成する
+
+    :param n_tweets: ツイート件数
+    :param seed: 乱数シード
+    :param timezone: timezoneオブジェクト
+    :param now: 基準日時、未指定の場合は現在時刻
+    :return 新しい順に並んだツイートのDataFrame
+    """
+    rng = numpy.random.default_rng(seed)
+    now = now or datetime.now(timezone)
+    n_users = max(1000, n_tweets // 10)
+
+    # ユーザ
+    user_ids = numpy.unique(rng.integers(10 ** 6, 2 * 10 ** 18, n_users + 100))
+    user_ids = rng.permutation(user_ids)[:n_users]
+    followers = rng.lognormal(5, 2, n_users).astype(numpy.int64)
+    friends = rng.lognormal(5, 1.5, n_users).astype(numpy.int64)
+    following = rng.random(n_users) < 0.05
+    user_idx = (rng.zipf(1.4, n_tweets) - 1) % n_users
+
+    # 投稿時刻（直近7日間、時間帯の比率に従う）
+    start = (now - timedelta(days=7)).replace(minute=0, second=0, microsecond=0)
+    days = rng.integers(0, 7, n_tweets)
+    hours = rng.choice(24, n_tweets, p=HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum())
+    seconds = days * 86400 + ((hours - start.hour) % 24) * 3600
+    seconds += rng.integers(0, 3600, n_tweets)
+    seconds = numpy.minimum(seconds, int((now - start).total_seconds()) - 1)
+    order = numpy.argsort(-seconds, kind="stable")
+    seconds = seconds[order]
+    user_idx = user_idx[order]
+    start_ms = int(start.timestamp() * 1000)
+    timestamps_ms = start_ms + seconds * 1000 + rng.integers(0, 1000, n_tweets)
+    tweet_ids = make_snowflake_ids(timestamps_ms, numpy.arange(n_tweets) % 4096)
+
+    dts = pandas.to_datetime(timestamps_ms, unit="ms", utc=True).tz_convert(
+        timezone.zone
+    )
+    dates = dts.normalize()
+    weekday_labels = {
+        d: make_weekday(d.to_pydatetime(), timezone=timezone) for d in dates.unique()
+    }
+    tweeted_weekday = dates.map(weekday_labels).to_numpy()
+    tweeted_hour = dts.strftime("%H").to_numpy()
+
+    # やり取り（リツイート30%、返信10%、引用5%、メンション20%）
+    def _targets(ratio):
+        mask = rng.random(n_tweets) < ratio
+        targets = user_ids[(rng.zipf(1.3, n_tweets) - 1) % n_users]
+        return numpy.where(mask, targets, 0)
+
+    retweeted_user_ids = _targets(0.3)
+    in_reply_to_user_ids = numpy.where(retweeted_user_ids == 0, _targets(0.1), 0)
+    quoted_user_ids = numpy.where(retweeted_user_ids == 0, _targets(0.05), 0)
+    mention_user_ids = _targets(0.2)
+
+    # 本文・ハッシュタグ
+    words = numpy.array([f"word{i}" for i in range(N_WORDS)], dtype=object)
+    tags = numpy.array([f"tag{i}" for i in range(N_HASHTAGS)], dtype=object)
+    word_ids = (rng.zipf(1.3, (n_tweets, 12)) - 1) % N_WORDS
+    tag_ids = (rng.zipf(1.5, (n_tweets, 3)) - 1) % N_HASHTAGS
+    tag_counts = rng.integers(0, 4, n_tweets)
+    texts = [" ".join(w) for w in words[word_ids]]
+    hashtags = [tuple(dict.fromkeys(t[:c])) for t, c in zip(tags[tag_ids], tag_counts)]
+
+    uid = user_ids[user_idx]
+    return pandas.DataFrame(
+        {
+            "tweeted_dt": dts,
+            "tweeted_date": dates.date,
+            "tweeted_weekday": tweeted_weekday,
+            "tweeted_hour": tweeted_hour,
+            "tweeted_wh": [
+                make_weekday_hour(weekday=w, hour=h)
+                for w, h in zip(tweeted_weekday, tweeted_hour)
+            ],
+            "tweet_id": tweet_ids,
+            "favorite_count": rng.zipf(1.8, n_tweets) - 1,
+            "retweet_count": rng.zipf(2.0, n_tweets) - 1,
+            "source": rng.choice(
+                ["Twitter for iPhone", "Twitter for Android", "Twitter Web App"],
+                n_tweets,
+                p=[0.5, 0.3, 0.2],
+            ),
+            "full_text": texts,
+            "lang": "en",
+            "hashtags": hashtags,
+            "mention_user_ids": [(m,) if m else () for m in mention_user_ids],
+            "mention_screen_names": [
+                (f"user{m}",) if m else () for m in mention_user_ids
+            ],
+            "in_reply_to_tweet_id": numpy.where(
+                in_reply_to_user_ids != 0, tweet_ids - 1, 0
+            ),
+            "in_reply_to_user_id": in_reply_to_user_ids,
+            "retweeted_tweet_id": numpy.where(
+                retweeted_user_ids != 0, tweet_ids - 2, 0
+            ),
+            "retweeted_user_id": retweeted_user_ids,
+            "quoted_tweet_id": numpy.where(quoted_user_ids != 0, tweet_ids - 3, 0),
+            "quoted_user_id": quoted_user_ids,
+            "user_id": uid,
+            "user_screen_name": [f"user{i}" for i in user_idx],
+            "user_name": [f"User {i}" for i in user_idx],
+            "user_profile_image_url": [
+                f"https://pbs.twimg.com/profile_images/{i}/normal.jpg" for i in uid
+            ],
+            "followers_count": followers[user_idx],
+            "friends_count": friends[user_idx],
+            "following": following[user_idx],
+            "follower": False,
+        }
+    )
+
+
+def make_synthetic_follower_ids(
+    n_ids: int, seed: int = 0, tweet_df: pandas.DataFrame = None, ratio: float = 0.2
+) -> numpy.ndarray:
+    """フォロワーID一覧（APIの返却順＝順不同）を生成する
+
+    :param n_ids: ID件数
+    :param seed: 乱数シード
+    :param tweet_df: 指定した場合は、ツイートしたユーザのratio分をフォロワーに含める
+    :param ratio: フォロワーに含めるツイートユーザの比率
+    :return ユニークなユーザIDの配列
+    """
+    rng = numpy.random.default_rng(seed)
+    ids = numpy.unique(rng.integers(10 ** 6, 2 * 10 ** 18, int(n_ids * 1.01) + 10))
+    if tweet_df is not None:
+        users = tweet_df["user_id"].unique()
+        users = users[rng.random(len(users)) < ratio]
+        ids = numpy.union1d(users, ids)
+    return rng.permutation(ids)[:n_ids]
+
+
+def make_synthetic_profile_df(
+    user_ids: numpy.ndarray, seed: int = 0, missing_ratio: float = 0.01
+) -> pandas.DataFrame:
+    """users/lookupで返すプロフィールを生成する
+
+    :param user_ids: ユーザIDの配列（make_synthetic_follower_idsの戻り値など）
+    :param seed: 乱数シード
+    :param missing_ratio: 凍結・削除済みとして返さないユーザの比率
+    :return hydration.PROFILE_COLSのDataFrame
+    """
+    rng = numpy.random.default_rng(seed)
+    user_ids = numpy.asarray(user_ids, dtype=numpy.int64)
+    user_ids = user_ids[rng.random(len(user_ids)) >= missing_ratio]
+    n_users = len(user_ids)
+    created_at = datetime(2010, 1, 1, tzinfo=pytz.utc) + pandas.to_timedelta(
+        rng.integers(0, 12 * 365 * 86400, n_users), unit="s"
+    )
+    return pandas.DataFrame(
+        {
+            "user_id": user_ids,
+            "user_screen_name": [f"user{i}" for i in user_ids],
+            "user_name": [f"User {i}" for i in user_ids],
+            "user_profile_image_url": [
+                f"https://pbs.twimg.com/profile_images/{i}/normal.jpg" for i in user_ids
+            ],
+            "followers_count": rng.lognormal(5, 2, n_users).astype(numpy.int64),
+            "friends_count": rng.lognormal(5, 1.5, n_users).astype(numpy.int64),
+            "statuses_count": rng.lognormal(6, 2, n_users).astype(numpy.int64),
+            "protected": rng.random(n_users) < 0.05,
+            "verified": rng.random(n_users) < 0.01,
+            "user_created_at": created_at,
+        }
+    )
@@ -21,5 +21,8 @@ setuptools.setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=_requires_from_file('requirements.txt'),
+    entry_points={
+        "console_scripts": ["twivis-collector=twivis.collector:main"],
+    },
     python_requires='>=3.7',
 )
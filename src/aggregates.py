@@ -0,0 +1,472 @@
+from typing import Dict, List, Tuple
+
+import numpy
+import pandas
+
+from .constants import ENGAGEMENT_AGGREGATIONS, ENGAGEMENT_COLS
+from .metrics import timed
+
+# 追加・削除の差分を足し引きするだけで更新できる集計（件数・合計）
+_SUM_AGGREGATIONS = {
+    "tweets_count": ("tweet_id", "count"),
+    **{k: v for k, v in ENGAGEMENT_AGGREGATIONS.items() if v[1] == "sum"},
+}
+_SUM_COLS = [v[0] for v in _SUM_AGGREGATIONS.values() if v[0] != "tweet_id"]
+
+# 差分だけでは更新できない集計（最大値・95パーセンタイル）、値の出現回数（ヒストグラム）から求める
+_ORDER_COLS = ["favorite_count", "retweet_count"]
+
+_STATS_COLS = ["tweets_count", *ENGAGEMENT_AGGREGATIONS, "favorite_p95", "retweet_p95"]
+
+# 最大値・95パーセンタイルも集計する集計単位
+_GROUPS = ["user_idx", "tweeted_weekday", "tweeted_wh", "tweeted_hour"]
+
+
+class ValueHistogram:
+    """グループ（コード）ごとの値の出現回数を、コード・値の昇順に並べた配列で保持するクラス
+
+    最大値・パーセンタイルは出現回数の累積から求めるため、ツイートを保持し直さずに差分で更新できる。
+    更新は差分に含まれるコードの分だけ並べ替え、残りの配列には挿入するだけとする。
+
+    :param codes: コードの配列
+    :param values: 値の配列（コード内で昇順）
+    :param counts: 出現回数の配列（0は含まない）
+    """
+
+    def __init__(
+        self,
+        codes: numpy.ndarray = None,
+        values: numpy.ndarray = None,
+        counts: numpy.ndarray = None,
+    ):
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        self.codes = empty if codes is None else codes
+        self.values = empty if values is None else values
+        self.counts = empty if counts is None else counts
+
+    def __len__(self):
+        return len(self.codes)
+
+    def update(
+        self, codes: numpy.ndarray, values: numpy.ndarray, counts: numpy.ndarray
+    ) -> Tuple["ValueHistogram", "ValueHistogram"]:
+        """値の出現回数の差分を反映する
+
+        :param codes: 差分のコード
+        :param values: 差分の値
+        :param counts: 差分の出現回数（削除は負数）
+        :return (更新後のヒストグラム, 差分に含まれるコードだけの更新後のヒストグラム)
+        """
+        n_codes = max(int(codes.max()), int(self.codes.max(initial=-1))) + 1
+        touched = numpy.zeros(n_codes, dtype=bool)
+        touched[codes] = True
+        in_touched = touched[self.codes]
+
+        _codes = numpy.concatenate([self.codes[in_touched], codes])
+        _values = numpy.concatenate([self.values[in_touched], values])
+        _counts = numpy.concatenate([self.counts[in_touched], counts])
+        order = numpy.lexsort((_values, _codes))
+        _codes, _values, _counts = _codes[order], _values[order], _counts[order]
+        starts = numpy.flatnonzero(
+            numpy.r_[True, (_codes[1:] != _codes[:-1]) | (_values[1:] != _values[:-1])]
+        )
+        _counts = numpy.add.reduceat(_counts, starts)
+        nonzero = _counts != 0
+        changed = ValueHistogram(
+            _codes[starts][nonzero], _values[starts][nonzero], _counts[nonzero]
+        )
+
+        # 差分に含まれないコードは昇順のまま残し、差分に含まれるコードをコード順の位置に挿入する
+        kept = ~in_touched
+        kept_codes = self.codes[kept]
+        positions = numpy.searchsorted(kept_codes, changed.codes)
+        hist = ValueHistogram(
+            numpy.insert(kept_codes, positions, changed.codes),
+            numpy.insert(self.values[kept], positions, changed.values),
+            numpy.insert(self.counts[kept], positions, changed.counts),
+        )
+        return hist, changed
+
+    def segments(self) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """コードごとの範囲
+
+        :return (コード, 開始位置, 終了位置)
+        """
+        if len(self) == 0:
+            return self.codes, self.codes, self.codes
+        starts = numpy.flatnonzero(numpy.r_[True, self.codes[1:] != self.codes[:-1]])
+        ends = numpy.r_[starts[1:], len(self.codes)].astype(numpy.int64)
+        return self.codes[starts], starts, ends
+
+    def order_stats(
+        self, q: float = 0.95
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """コードごとの最大値とパーセンタイル（pandasのquantileと同じ線形補間）
+
+        :param q: パーセンタイル（0〜1）
+        :return (コード, 最大値, パーセンタイル)
+        """
+        if len(self) == 0:
+            return self.codes, self.values, self.values.astype(numpy.float64)
+        codes, starts, ends = self.segments()
+        cum = numpy.cumsum(self.counts)
+        base = numpy.r_[0, cum[ends[:-1] - 1]]
+        n = cum[ends - 1] - base
+        position = q * (n - 1)
+        lower = numpy.floor(position).astype(numpy.int64)
+        upper = numpy.minimum(lower + 1, n - 1)
+        # 累積出現回数が順位を超える最初の値が、その順位の値
+        v_lower = self.values[numpy.searchsorted(cum, base + lower, side="right")]
+        v_upper = self.values[numpy.searchsorted(cum, base + upper, side="right")]
+        return (
+            codes,
+            self.values[ends - 1],
+            v_lower + (v_upper - v_lower) * (position - lower),
+        )
+
+
+class LabelCodes:
+    """集計キーの値と、集計結果の配列の位置（コード）を対応付けるクラス
+
+    user_idxのような0以上の整数のキーは値をそのままコードとし、
+    日付・時間などのラベルは出現順にコードを割り当てる。
+
+    :param labels: コード順のラベル、Noneの場合は値をそのままコードとする
+    """
+
+    def __init__(self, labels: pandas.Index = None):
+        self.labels = labels
+
+    def encode(self, values: pandas.Series) -> Tuple["LabelCodes", numpy.ndarray]:
+        """値をコードに変換する（新しいラベルにはコードを追加する）
+
+        :param values: 集計キーの値
+        :return (コードを追加した対応, コードの配列)
+        """
+        if self.labels is None:
+            return self, values.to_numpy(dtype=numpy.int64)
+        # カテゴリ型はストアの更新のたびにカテゴリが変わるため、値で対応付ける
+        _values = values.to_numpy(dtype=object)
+        codes = self.labels.get_indexer(_values)
+        if (codes < 0).any():
+            new = pandas.unique(_values[codes < 0])
+            encoder = LabelCodes(self.labels.append(pandas.Index(new, dtype=object)))
+            return encoder, encoder.labels.get_indexer(_values)
+        return self, codes
+
+    def decode(self, codes: numpy.ndarray) -> pandas.Index:
+        if self.labels is None:
+            return pandas.Index(codes)
+        return self.labels.take(codes)
+
+
+class GroupAggregate:
+    """1つの集計キーの集計結果を保持し、追加・更新されたツイートの差分で更新するクラス
+
+    件数・合計はコードを位置とする配列に差分を足し込む。
+    最大値・95パーセンタイルは値のヒストグラムを差分で更新し、差分に含まれるコードだけ求め直す。
+    更新にかかる時間は差分の件数と、差分に含まれるコードのヒストグラムの大きさに比例する。
+
+    :param key: 集計キーのカラム
+    """
+
+    def __init__(
+        self,
+        key: str,
+        encoder: LabelCodes = None,
+        sums: numpy.ndarray = None,
+        maxes: numpy.ndarray = None,
+        p95s: numpy.ndarray = None,
+        hists: Tuple[ValueHistogram, ...] = None,
+    ):
+        self.key = key
+        self._encoder = encoder or LabelCodes(
+            None if key == "user_idx" else pandas.Index([], dtype=object)
+        )
+        self._sums = _zeros(sums, (0, len(_SUM_AGGREGATIONS)), numpy.int64)
+        self._maxes = _zeros(maxes, (0, len(_ORDER_COLS)), numpy.int64)
+        self._p95s = _zeros(p95s, (0, len(_ORDER_COLS)), numpy.float64)
+        self._hists = hists or tuple(ValueHistogram() for _ in _ORDER_COLS)
+        self._df = None
+
+    def update(
+        self, removed: pandas.DataFrame, added: pandas.DataFrame
+    ) -> "GroupAggregate":
+        """差分を反映した集計結果を生成する
+
+        :param removed: 置き換え前のツイート（更新されたツイートの更新前の行）
+        :param added: 追加・更新後のツイート
+        :return 更新後の集計結果
+        """
+        if removed.empty and added.empty:
+            return self
+        encoder, codes = self._encoder.encode(
+            pandas.concat([removed[self.key], added[self.key]], ignore_index=True)
+        )
+        signs = numpy.r_[
+            numpy.full(len(removed), -1, dtype=numpy.int64),
+            numpy.ones(len(added), dtype=numpy.int64),
+        ]
+        values = {
+            col: numpy.r_[
+                removed[col].to_numpy(dtype=numpy.int64),
+                added[col].to_numpy(dtype=numpy.int64),
+            ]
+            for col in _ORDER_COLS
+        }
+
+        n_codes = max(len(self._sums), int(codes.max()) + 1)
+        sums = _resize(self._sums, n_codes)
+        sums[:, 0] += _weighted_bincount(codes, signs, n_codes)
+        for i, col in enumerate(_SUM_COLS, start=1):
+            sums[:, i] += _weighted_bincount(codes, signs * values[col], n_codes)
+
+        maxes = _resize(self._maxes, n_codes)
+        p95s = _resize(self._p95s, n_codes)
+        # 差分に含まれるがツイートがなくなったコードは0に戻す
+        touched = numpy.unique(codes)
+        hists = []
+        for i, col in enumerate(_ORDER_COLS):
+            hist, changed = self._hists[i].update(codes, values[col], signs)
+            hists.append(hist)
+            maxes[touched, i] = 0
+            p95s[touched, i] = 0.0
+            _codes, _maxes, _p95s = changed.order_stats(0.95)
+            maxes[_codes, i] = _maxes
+            p95s[_codes, i] = _p95s
+        return GroupAggregate(self.key, encoder, sums, maxes, p95s, tuple(hists))
+
+    @property
+    def df(self) -> pandas.DataFrame:
+        """集計キーをインデックスとする集計結果（ツイートがあるキーだけ）"""
+        if self._df is None:
+            self._df = self._make_df()
+        return self._df
+
+    def _make_df(self) -> pandas.DataFrame:
+        codes = numpy.flatnonzero(self._sums[:, 0] > 0)
+        _df = pandas.DataFrame(
+            {
+                **dict(zip(_SUM_AGGREGATIONS, self._sums[codes].T)),
+                **{
+                    f"{col.split('_')[0]}_max": self._maxes[codes, i]
+                    for i, col in enumerate(_ORDER_COLS)
+                },
+                **{
+                    f"{col.split('_')[0]}_p95": self._p95s[codes, i]
+                    for i, col in enumerate(_ORDER_COLS)
+                },
+            },
+            index=self._encoder.decode(codes).rename(self.key),
+        )
+        return _df[_STATS_COLS]
+
+
+class UserDayAggregate:
+    """日別のツイート人数（1日複数回ツイートしたユーザを1人とする）を差分で更新するクラス
+
+    日付をコード、user_idxを値とするヒストグラムで、日付・ユーザごとのツイート数を保持する。
+    """
+
+    def __init__(self, encoder: LabelCodes = None, hist: ValueHistogram = None):
+        self._encoder = encoder or LabelCodes(pandas.Index([], dtype=object))
+        self._hist = hist or ValueHistogram()
+
+    def update(
+        self, removed: pandas.DataFrame, added: pandas.DataFrame
+    ) -> "UserDayAggregate":
+        if removed.empty and added.empty:
+            return self
+        encoder, codes = self._encoder.encode(
+            pandas.concat(
+                [removed["tweeted_weekday"], added["tweeted_weekday"]],
+                ignore_index=True,
+            )
+        )
+        user_idx = numpy.r_[
+            removed["user_idx"].to_numpy(dtype=numpy.int64),
+            added["user_idx"].to_numpy(dtype=numpy.int64),
+        ]
+        signs = numpy.r_[
+            numpy.full(len(removed), -1, dtype=numpy.int64),
+            numpy.ones(len(added), dtype=numpy.int64),
+        ]
+        hist, _ = self._hist.update(codes, user_idx, signs)
+        return UserDayAggregate(encoder, hist)
+
+    def count_users(self) -> pandas.Series:
+        """日付ごとのツイート人数"""
+        codes, starts, ends = self._hist.segments()
+        return pandas.Series(
+            ends - starts,
+            index=self._encoder.decode(codes).rename("tweeted_weekday"),
+            name="count",
+        )
+
+
+class TweetAggregates:
+    """ツイートテーブルのユーザ別・日付別・時間別の集計結果を保持するクラス
+
+    ツイートを追加・更新した場合は差分だけで更新するため、更新にかかる時間は差分の件数に比例する。
+    フォロワーかどうかなどのユーザのフラグは集計に含めず、読み出し時にユーザテーブルから結合する。
+
+    :param groups: 集計単位ごとの集計結果
+    """
+
+    def __init__(self, groups: Dict = None):
+        self.groups = groups or {
+            **{key: GroupAggregate(key) for key in _GROUPS},
+            "user_weekday": UserDayAggregate(),
+        }
+
+    @classmethod
+    @timed("build_tweet_aggregates")
+    def from_df(cls, tweets: pandas.DataFrame) -> "TweetAggregates":
+        """ツイートテーブル全体を集計する
+
+        :param tweets: ツイートテーブル
+        :return 集計結果
+        """
+        return cls().update(removed=tweets.iloc[:0], added=tweets)
+
+    @timed("update_tweet_aggregates")
+    def update(
+        self, removed: pandas.DataFrame, added: pandas.DataFrame
+    ) -> "TweetAggregates":
+        """追加・更新されたツイートの差分を反映した集計結果を生成する
+
+        再検索で取得した、集計に使う値（いいね数・リツイート数、集計キー）が変わっていないツイートは差分から除く。
+
+        :param removed: 置き換え前のツイート（更新されたツイートの更新前の行）
+        :param added: 追加・更新後のツイート（tweet_idは重複なし）
+        :return 更新後の集計結果
+        """
+        if not removed.empty:
+            # カテゴリ型と検索結果のobject型を値で比較するため、object型にそろえる
+            cols = [*_ORDER_COLS, *_GROUPS, "tweeted_weekday"]
+            _before = removed.set_index("tweet_id")[cols].astype(object)
+            _after = added.set_index("tweet_id")[cols].astype(object)
+            _after = _after.reindex(_before.index)
+            unchanged = _before.index[(_before == _after).all(axis=1).to_numpy()]
+            removed = removed[~removed["tweet_id"].isin(unchanged)]
+            added = added[~added["tweet_id"].isin(unchanged)]
+        return TweetAggregates(
+            {
+                name: group.update(removed=removed, added=added)
+                for name, group in self.groups.items()
+            }
+        )
+
+    def make_user_df(self, users: pandas.DataFrame) -> pandas.DataFrame:
+        """processors.make_user_dfと同じ形式のユーザ別の集計結果を生成する"""
+        return join_user_df(users, self.groups["user_idx"].df)
+
+    def make_count_df(self, group_col: str, labels: List[str]) -> pandas.DataFrame:
+        """processors.make_count_tweeted_dfなどと同じ形式のツイート数を生成する"""
+        _df = self.groups[group_col].df[["tweets_count"]]
+        return fill_labels(
+            _df.rename(columns={"tweets_count": "count"}),
+            group_col=group_col,
+            labels=labels,
+        )
+
+    def make_user_count_df(self, labels: List[str]) -> pandas.DataFrame:
+        """日別のツイート人数（1日複数回ツイートしたユーザを1人とする）を生成する"""
+        _df = self.groups["user_weekday"].count_users().to_frame()
+        return fill_labels(_df, group_col="tweeted_weekday", labels=labels)
+
+    def make_engagement_df(self, group_col: str, labels: List[str]) -> pandas.DataFrame:
+        """processors.make_engagement_dfと同じ形式のエンゲージメントを生成する"""
+        _df = self.groups[group_col].df[_STATS_COLS[1:]]
+        return fill_labels(_df, group_col=group_col, labels=labels)
+
+    def count_users(self) -> int:
+        """ツイートしたユーザ数"""
+        return len(self.groups["user_idx"].df)
+
+    def sum(self, col: str) -> int:
+        """ツイート全体の件数・合計（tweets_count, favorite_sum, retweet_sum）"""
+        return int(self.groups["user_idx"].df[col].sum())
+
+
+def _weighted_bincount(
+    codes: numpy.ndarray, weights: numpy.ndarray, n_codes: int
+) -> numpy.ndarray:
+    # bincountの重みはfloat64になるため、2**53を超える合計は扱わない前提で整数に戻す
+    return numpy.rint(numpy.bincount(codes, weights=weights, minlength=n_codes)).astype(
+        numpy.int64
+    )
+
+
+def _zeros(array: numpy.ndarray, shape, dtype) -> numpy.ndarray:
+    return numpy.zeros(shape, dtype=dtype) if array is None else array
+
+
+def _resize(array: numpy.ndarray, n_codes: int) -> numpy.ndarray:
+    # 更新前の集計結果を書き換えないよう、常にコピーしてから足し込む
+    resized = numpy.zeros((n_codes, array.shape[1]), dtype=array.dtype)
+    resized[: len(array)] = array
+    return resized
+
+
+def join_user_df(users: pandas.DataFrame, user_stats_df: pandas.DataFrame):
+    """ユーザテーブルにuser_idx別の集計結果を結合し、FF比などを計算する
+
+    :param users: ユーザテーブル
+    :param user_stats_df: user_idxをインデックスとする集計結果（tweets_count, ENGAGEMENT_COLS）
+    :return ユーザをユニークにしたDataFrame
+    """
+    _df = users.join(user_stats_df, how="inner").reset_index(drop=True)
+
+    # フォロー数、フォロワー数どちらかが0は計算ができないので、1に変換して計算する
+    _df["_friends_count"] = _df["friends_count"].clip(lower=1)
+    _df["_followers_count"] = _df["followers_count"].clip(lower=1)
+    _df["ff_ratio"] = _df["_followers_count"] / _df["_friends_count"]
+    _df["ff_ratio_close_to_one"] = (1.0 - _df["ff_ratio"]).abs()
+    cols = [
+        "user_id",
+        "user_screen_name",
+        "user_name",
+        "tweets_count",
+        "followers_count",
+        "friends_count",
+        "ff_ratio",
+        "ff_ratio_close_to_one",
+        "following",
+        "follower",
+        *ENGAGEMENT_COLS,
+    ]
+    # 追跡中のアカウントのフォロワー集合を設定済みの場合は、何アカウントからフォローされているかも含める
+    if "followed_by" in _df.columns:
+        cols.append("followed_by")
+    return _df[cols]
+
+
+def fill_labels(
+    df: pandas.DataFrame, group_col: str, labels: List[str]
+) -> pandas.DataFrame:
+    """集計結果にないラベルを0件として追加し、ラベル順に並べる
+
+    :param df: group_colをインデックスとする集計結果
+    :param group_col: 集計単位のカラム
+    :param labels: 集計結果に必ず含めるラベル
+    :return group_colをカラムに戻したDataFrame
+    """
+    _df = df.copy()
+    # カテゴリ型のインデックスにはカテゴリ外のラベルを追加できないため、object型にする
+    _df.index = _df.index.astype(object)
+    _df = _df.reindex(_df.index.union(labels), fill_value=0)
+    _df.index.name = group_col
+    return _df.sort_index().reset_index()
+
+
+def make_engagement_p95_df(grouped) -> pandas.DataFrame:
+    """エンゲージメントの95パーセンタイルを集計する
+
+    :param grouped: 集計済みのグループ（グループ化を再計算しないために使い回す）
+    :return 95パーセンタイルのDataFrame
+    """
+    _df = grouped[["favorite_count", "retweet_count"]].quantile(0.95)
+    return _df.rename(
+        columns={"favorite_count": "favorite_p95", "retweet_count": "retweet_p95"}
+    )
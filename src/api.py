@@ -3,17 +3,43 @@ import logging
 import pandas
 import pytz
 
+from .audiences import AudienceSet
 from .auth import TwitterAuthKeys, auth_twitter_api
-
-from .filters import filter_user
+from .constants import PROFILE_CACHE_TTL
+from .dtypes import make_dtype_report
+from .errors import ParameterError, TweetNotFoundError
+from .filters import filter_sub_query, filter_user
 from .graphs import (
+    make_daily_engagement_graph,
     make_daily_tweet_users_graph,
     make_daily_tweets_graph,
+    make_followers_count_graph,
+    make_hourly_engagement_graph,
     make_hourly_tweets_graph,
 )
+from .hydration import ProfileCache, hydrate_users
+from .indexes import TweetIndex
+from .interactions import INTERACTION_KINDS, make_interaction_user_df
 from .loggers import get_logger, set_logger_timezone
-from .rankings import make_user_ranking, print_user_rankings
-from .tweets import search_tweets
+from .metrics import (
+    disable_metrics,
+    enable_metrics,
+    get_metrics,
+    get_prometheus_metrics,
+    reset_metrics,
+)
+from .processors import is_sampled
+from .rankings import (
+    make_co_hashtag_ranking,
+    make_hashtag_ranking,
+    make_user_ranking,
+    print_hashtag_rankings,
+    print_user_rankings,
+)
+from .sql import SQLStore
+from .stores import LocalStore, TweetStore
+from .transports import Transport, use_transport
+from .tweets import sample_tweets, search_tweets
 from .users import get_follower_ids, get_following_ids
 from .validates import validate_tweet_exists
 
@@ -22,118 +48,403 @@ logger = get_logger(__name__, loglevel=logging.INFO)
 
 class TwiVisAPI:
     def __init__(
-        self, api_key, api_secret, access_token, access_token_secret, timezone="UTC"
+        self,
+        api_key,
+        api_secret,
+        access_token,
+        access_token_secret,
+        timezone="UTC",
+        transport: Transport = None,
     ):
+        """TwiVis APIクライアント
+
+        :param timezone: 集計・表示に使用するタイムゾーン
+        :param transport: 通信方法、RecordingTransportで記録・ReplayTransportで再生する
+            （このインスタンスの通信にだけ使用する、未指定の場合は実際に通信する）
+        """
         self._auth_keys = TwitterAuthKeys(
             api_key=api_key,
             api_secret=api_secret,
             access_token=access_token,
             access_token_secret=access_token_secret,
         )
-        self._df = None
+        self._store = None
+        self._index = None
+        self._audiences = AudienceSet()
+        self._sql = None
+        self._sql_store = None
+        self._profile_cache = None
+        self._profiles = {}
         self._search_word = None
         self._search_query = None
         self._timezone = pytz.timezone(timezone)
         set_logger_timezone(timezone)
+        self._transport = transport or Transport()
+
+    def search_tweets(
+        self,
+        search_word: str,
+        advanced_query: str,
+        limit: int = None,
+        append: bool = False,
+        sample_requests: int = None,
+    ):
+        """ツイートを検索する
+
+        append=Trueの場合は取得済みのツイートにtweet_idをキーに追加・更新する（最新のいいね数等を残す）
+        sample_requestsを指定した場合は、そのリクエスト数を直近7日間の時間帯ごとに割り振って抽出する。
+        日別・時間別のグラフは抽出分から推定した件数・合計を95%信頼区間付きで表示する。
+        """
+        if append and (sample_requests is not None or is_sampled(self._df)):
+            raise ParameterError("サンプリング取得したツイートには追加・更新できません")
 
-    def search_tweets(self, search_word: str, advanced_query: str, limit: int = None):
         logger.info("=== search_tweets Start")
         search_query = search_word + " " + advanced_query
-        tweets = search_tweets(
-            api=auth_twitter_api(auth_keys=self._auth_keys),
-            search_query=search_query,
-            limit=limit,
-            timezone=self._timezone,
-        )
+        with use_transport(self._transport):
+            if sample_requests is not None:
+                tweets = sample_tweets(
+                    api=auth_twitter_api(auth_keys=self._auth_keys),
+                    search_query=search_query,
+                    max_requests=sample_requests,
+                    timezone=self._timezone,
+                )
+            else:
+                tweets = search_tweets(
+                    api=auth_twitter_api(auth_keys=self._auth_keys),
+                    search_query=search_query,
+                    limit=limit,
+                    timezone=self._timezone,
+                )
         self._search_word = search_word
         self._search_query = search_query
-        self._df = pandas.DataFrame(tweets)
+        if append and self._store is not None:
+            synced = self._sql is not None and self._sql_store is self._store
+            self._store = self._store.upsert(pandas.DataFrame(tweets))
+            if synced:
+                # SQL側にも追加・更新したツイートだけを書き込む
+                self._sql.load_store(
+                    self._store, tweet_ids=[t["tweet_id"] for t in tweets]
+                )
+                self._sql_store = self._store
+        else:
+            self._store = TweetStore.from_tweets(tweets)
+        self._index = None
+        self._set_followed_by()
         logger.info(f"=== search_tweets End（合計{'{:,}'.format(len(tweets))}）")
 
+    def load_collected_tweets(self, store_dir: str, name: str):
+        """常駐の収集処理（twivis-collector）が保存したツイートを読み込む
+
+        :param store_dir: 設定ファイルのstore_dir
+        :param name: 設定ファイルのクエリ名
+        """
+        store, meta = LocalStore(store_dir).load_tweets(name)
+        if store is None:
+            raise TweetNotFoundError(f"{name}の収集結果がありません")
+        self._store = store
+        self._search_word = meta.get("search_word")
+        self._search_query = meta.get("search_query")
+        self._index = None
+        self._set_followed_by()
+        logger.info(f"{name}: {'{:,}'.format(len(store.tweets))} 件読み込み")
+
     def set_followers(self, user_screen_name):
         logger.info("=== set_followers Start")
-        follower_ids = get_follower_ids(
-            api=auth_twitter_api(auth_keys=self._auth_keys),
-            user_screen_name=user_screen_name,
-        )
-        self._df["follower"] = self._df.apply(
-            lambda x: x.user_id in follower_ids, axis=1
-        )
+        with use_transport(self._transport):
+            follower_ids = get_follower_ids(
+                api=auth_twitter_api(auth_keys=self._auth_keys),
+                user_screen_name=user_screen_name,
+            )
+        self._store.set_user_flag("follower", follower_ids)
+        self._sql_store = None
         logger.info(f"=== set_followers End（合計{'{:,}'.format(len(follower_ids))}）")
 
     def set_following(self, user_screen_name):
         logger.info("=== set_following Start")
-        following_ids = get_following_ids(
-            api=auth_twitter_api(auth_keys=self._auth_keys),
-            user_screen_name=user_screen_name,
+        with use_transport(self._transport):
+            following_ids = get_following_ids(
+                api=auth_twitter_api(auth_keys=self._auth_keys),
+                user_screen_name=user_screen_name,
+            )
+        self._store.set_user_flag("following", following_ids)
+        self._sql_store = None
+        logger.info(f"=== set_following End（合計{'{:,}'.format(len(following_ids))}）")
+
+    def add_audience(self, user_screen_name: str, store_dir: str = None):
+        """フォロワーの重なりを比較するアカウントを追加する
+
+        ユーザテーブルには、追加済みのアカウントのうち何アカウントからフォローされているか（followed_by）を付与する。
+
+        :param user_screen_name: 対象アカウント名
+        :param store_dir: 指定した場合はtwivis-collectorが保存したフォロワーIDを使用する（保存済みの場合）
+        """
+        logger.info(f"=== add_audience Start（@{user_screen_name}）")
+        follower_ids = None
+        if store_dir is not None:
+            follower_ids = LocalStore(store_dir).load_ids(user_screen_name, "followers")
+        if follower_ids is None:
+            with use_transport(self._transport):
+                follower_ids = get_follower_ids(
+                    api=auth_twitter_api(auth_keys=self._auth_keys),
+                    user_screen_name=user_screen_name,
+                )
+        self._audiences.add(user_screen_name, follower_ids)
+        if self._sql is not None and self._sql_store is self._store:
+            self._sql.load_audiences(self._audiences)
+        self._set_followed_by()
+        logger.info(f"=== add_audience End（合計{'{:,}'.format(len(follower_ids))}）")
+
+    def print_audience_overlap(self, exact: bool = False, top: int = 20):
+        """追加済みのアカウントの全ペアについて、フォロワーの重なり（Jaccard係数）を表示する
+
+        :param exact: Trueの場合は正確な値、Falseの場合はMinHashによる推定値
+        :param top: 重なりが大きい順に表示する件数
+        """
+        if exact:
+            _df = self._audiences.make_overlap_df()
+        else:
+            _df = self._audiences.estimate_overlap_df()
+        print("▼▼▼▼▼ audience_overlap ▼▼▼▼▼")
+        print(_df.head(top).to_string(index=False))
+        print("▲▲▲▲▲ audience_overlap ▲▲▲▲▲")
+
+    def print_audience_reach(self):
+        """追加済みのアカウントの重複を除いたリーチと、アカウントごとの独自のフォロワー数を表示する"""
+        print("▼▼▼▼▼ audience_reach ▼▼▼▼▼")
+        print(self._audiences.make_reach_df().to_string(index=False))
+        print(f"reach: {'{:,}'.format(self._audiences.count_reach())}")
+        print("▲▲▲▲▲ audience_reach ▲▲▲▲▲")
+
+    def set_profile_cache(self, path: str = ":memory:", ttl: int = PROFILE_CACHE_TTL):
+        """hydrate_audienceで取得したプロフィールのキャッシュを設定する
+
+        :param path: キャッシュファイル、指定した場合は次回以降の実行でも使い回す
+        :param ttl: 有効期限（秒）、期限が過ぎたプロフィールは再取得する
+        """
+        if self._profile_cache is not None:
+            self._profile_cache.close()
+        self._profile_cache = ProfileCache(path, ttl=ttl)
+
+    def hydrate_audience(
+        self,
+        user_screen_name: str,
+        kind: str = "followers",
+        store_dir: str = None,
+        max_requests: int = None,
+    ):
+        """アカウントのフォロワー（kind="following"の場合はフォロー中ユーザ）のプロフィールを取得する
+
+        キャッシュ済みで有効期限内のユーザは取得しない（set_profile_cacheで設定、未設定の場合はメモリ上）。
+
+        :param user_screen_name: 対象アカウント名
+        :param kind: followers or following
+        :param store_dir: 指定した場合はtwivis-collectorが保存したユーザIDを使用する（保存済みの場合）
+        :param max_requests: users/lookupのリクエスト数の上限（1リクエスト100件）
+        """
+        if kind not in ("followers", "following"):
+            raise ParameterError(f"kindはfollowersまたはfollowingを指定してください: {kind}")
+        logger.info(f"=== hydrate_audience Start（@{user_screen_name} {kind}）")
+        ids = None
+        if store_dir is not None:
+            ids = LocalStore(store_dir).load_ids(user_screen_name, kind)
+        # add_audienceで取得済みのフォロワーIDは使い回す
+        if ids is None and kind == "followers":
+            if user_screen_name in self._audiences.accounts:
+                ids = self._audiences.get(user_screen_name)
+        if ids is None:
+            get_ids = get_follower_ids if kind == "followers" else get_following_ids
+            with use_transport(self._transport):
+                ids = get_ids(
+                    api=auth_twitter_api(auth_keys=self._auth_keys),
+                    user_screen_name=user_screen_name,
+                )
+        if self._profile_cache is None:
+            self.set_profile_cache()
+        with use_transport(self._transport):
+            profiles = hydrate_users(
+                api=auth_twitter_api(auth_keys=self._auth_keys),
+                user_ids=ids,
+                cache=self._profile_cache,
+                max_requests=max_requests,
+            )
+        self._profiles[(user_screen_name, kind)] = profiles
+        logger.info(f"=== hydrate_audience End（合計{'{:,}'.format(len(profiles))}）")
+
+    def make_audience_user_ranking(
+        self,
+        user_screen_name: str,
+        col: str = "followers_count",
+        kind: str = "followers",
+        ascending: bool = False,
+        **kwargs,
+    ):
+        """hydrate_audienceで取得したユーザのランキング（followers_count, statuses_countなど）"""
+        rankings = make_user_ranking(
+            None,
+            user_df=self._get_profiles(user_screen_name, kind),
+            col=col,
+            ascending=ascending,
+            **kwargs,
         )
-        self._df["following"] = self._df.apply(
-            lambda x: x.user_id in following_ids, axis=1
+        print_user_rankings(
+            rankings, ranking_name=f"{kind}_{col}_ranking(@{user_screen_name})"
         )
-        logger.info(f"=== set_following End（合計{'{:,}'.format(len(following_ids))}）")
 
-    def make_daily_tweets_graph(self, **kwargs):
+    def make_audience_followers_count_graph(
+        self, user_screen_name: str, kind: str = "followers"
+    ):
+        """hydrate_audienceで取得したユーザのフォロワー数の分布"""
+        figure = make_followers_count_graph(
+            self._get_profiles(user_screen_name, kind),
+            account=f"@{user_screen_name} {kind}",
+        )
+        figure.show()
+
+    def use_sql(self, path: str = ":memory:"):
+        """グラフ・ランキングの集計を組み込みSQLエンジン（sqlite3）で行う
+
+        ツイート・ユーザ・フォロワー集合は初回の集計時にSQL側に書き込み、以降は差分だけを書き込む。
+        サブクエリを指定した集計は転置インデックスを使用するため、これまで通りpandasで行う。
+
+        :param path: データベースファイル、未指定の場合はメモリ上に作成する
+        """
+        if self._sql is not None:
+            self._sql.close()
+        self._sql = SQLStore(path)
+        self._sql_store = None
+
+    def query(self, sql: str, params=()) -> pandas.DataFrame:
+        """取得済みのツイートにSQLで問い合わせる
+
+        テーブルはtweets, users, follower_sets（add_audienceで追加したアカウントのフォロワー）。
+
+            api.query(
+                "SELECT t.tweeted_hour, COUNT(*) AS count FROM tweets t "
+                "JOIN users u ON u.user_id = t.user_id "
+                "WHERE u.followers_count > ? AND u.follower = 1 GROUP BY 1",
+                [10000],
+            )
+
+        :param sql: SELECT文
+        :param params: プレースホルダの値
+        :return 問い合わせ結果
+        """
         validate_tweet_exists(self._df)
-        _df = filter_user(self._df, **kwargs)
+        if self._sql is None:
+            self.use_sql()
+        return self._get_sql().query(sql, params)
+
+    def make_daily_tweets_graph(self, sub_query: str = None, **kwargs):
+        validate_tweet_exists(self._df)
+        aggregates = self._get_aggregates(sub_query, **kwargs)
         figure = make_daily_tweets_graph(
-            _df, search_word=self._search_word, timezone=self._timezone
+            self._get_filtered_df(sub_query, aggregates=aggregates, **kwargs),
+            search_word=self._search_word,
+            timezone=self._timezone,
+            aggregates=aggregates,
         )
         figure.show()
 
-    def make_daily_tweet_users_graph(self, **kwargs):
+    def make_daily_tweet_users_graph(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
-        _df = filter_user(self._df, **kwargs)
+        aggregates = self._get_aggregates(sub_query, **kwargs)
         figure = make_daily_tweet_users_graph(
-            _df, search_word=self._search_word, timezone=self._timezone
+            self._get_filtered_df(sub_query, aggregates=aggregates, **kwargs),
+            search_word=self._search_word,
+            timezone=self._timezone,
+            aggregates=aggregates,
         )
         figure.show()
 
-    def make_hourly_tweets_graph(self, **kwargs):
+    def make_hourly_tweets_graph(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
-        _df = filter_user(self._df, **kwargs)
+        aggregates = self._get_aggregates(sub_query, **kwargs)
         figure = make_hourly_tweets_graph(
-            _df, search_word=self._search_word, timezone=self._timezone
+            self._get_filtered_df(sub_query, aggregates=aggregates, **kwargs),
+            search_word=self._search_word,
+            timezone=self._timezone,
+            aggregates=aggregates,
+        )
+        figure.show()
+
+    def make_daily_engagement_graph(
+        self, col: str = "favorite_sum", sub_query: str = None, **kwargs
+    ):
+        validate_tweet_exists(self._df)
+        aggregates = self._get_aggregates(sub_query, **kwargs)
+        figure = make_daily_engagement_graph(
+            self._get_filtered_df(sub_query, aggregates=aggregates, **kwargs),
+            search_word=self._search_word,
+            timezone=self._timezone,
+            col=col,
+            aggregates=aggregates,
         )
         figure.show()
 
-    def make_tweets_user_ranking(self, **kwargs):
+    def make_hourly_engagement_graph(
+        self, col: str = "favorite_sum", sub_query: str = None, **kwargs
+    ):
+        validate_tweet_exists(self._df)
+        aggregates = self._get_aggregates(sub_query, **kwargs)
+        figure = make_hourly_engagement_graph(
+            self._get_filtered_df(sub_query, aggregates=aggregates, **kwargs),
+            search_word=self._search_word,
+            timezone=self._timezone,
+            col=col,
+            aggregates=aggregates,
+        )
+        figure.show()
+
+    def make_tweets_user_ranking(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
         rankings = make_user_ranking(
-            self._df,
+            self._get_df(sub_query),
             search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
             col="tweets_count",
             ascending=False,
             **kwargs,
         )
         print_user_rankings(rankings, ranking_name="tweets_user_ranking")
 
-    def make_followers_user_ranking(self, **kwargs):
+    def make_followers_user_ranking(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
         rankings = make_user_ranking(
-            self._df,
+            self._get_df(sub_query),
             search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
             col="followers_count",
             ascending=False,
             **kwargs,
         )
         print_user_rankings(rankings, ranking_name="followers_user_ranking")
 
-    def make_friends_user_ranking(self, **kwargs):
+    def make_friends_user_ranking(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
         rankings = make_user_ranking(
-            self._df,
+            self._get_df(sub_query),
             search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
             col="friends_count",
             ascending=False,
             **kwargs,
         )
         print_user_rankings(rankings, ranking_name="friends_user_ranking")
 
-    def make_ff_ratio_user_ranking(self, **kwargs):
+    def make_ff_ratio_user_ranking(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
         rankings = make_user_ranking(
-            self._df,
+            self._get_df(sub_query),
             search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
             col="ff_ratio",
             **kwargs,
         )
@@ -141,11 +452,14 @@ class TwiVisAPI:
             rankings, value_fmt="{:.4f}", ranking_name="ff_ratio_user_ranking"
         )
 
-    def make_ff_ratio_close_to_one_user_ranking(self, **kwargs):
+    def make_ff_ratio_close_to_one_user_ranking(self, sub_query: str = None, **kwargs):
         validate_tweet_exists(self._df)
         rankings = make_user_ranking(
-            self._df,
+            self._get_df(sub_query),
             search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
             col="ff_ratio_close_to_one",
             ascending=True,
             **kwargs,
@@ -156,7 +470,215 @@ class TwiVisAPI:
             ranking_name="ff_ratio_close_to_one_user_ranking",
         )
 
+    def make_engagement_user_ranking(
+        self, col: str = "favorite_sum", sub_query: str = None, **kwargs
+    ):
+        validate_tweet_exists(self._df)
+        rankings = make_user_ranking(
+            self._get_df(sub_query),
+            search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
+            col=col,
+            ascending=False,
+            **kwargs,
+        )
+        print_user_rankings(
+            rankings, value_fmt="{:,.0f}", ranking_name=f"{col}_user_ranking"
+        )
+
+    def make_followed_by_user_ranking(self, sub_query: str = None, **kwargs):
+        """追加済みのアカウントのうち、多くのアカウントからフォローされているユーザのランキング"""
+        validate_tweet_exists(self._df)
+        if len(self._audiences) == 0:
+            raise ParameterError("add_audienceで比較するアカウントを追加してください")
+        rankings = make_user_ranking(
+            self._get_df(sub_query),
+            search_query=self._search_query,
+            users=self._users,
+            user_df=self._get_user_df(sub_query),
+            sql=self._get_sql(sub_query),
+            col="followed_by",
+            ascending=False,
+            **kwargs,
+        )
+        print_user_rankings(rankings, ranking_name="followed_by_user_ranking")
+
+    def make_influence_user_ranking(
+        self, sub_query: str = None, kinds=INTERACTION_KINDS, **kwargs
+    ):
+        validate_tweet_exists(self._df)
+        _df = self._get_df(sub_query)
+        rankings = make_user_ranking(
+            _df,
+            search_query=self._search_query,
+            users=self._users,
+            col="influence",
+            ascending=False,
+            user_df=make_interaction_user_df(_df, users=self._users, kinds=kinds),
+            **kwargs,
+        )
+        print_user_rankings(
+            rankings, value_fmt="{:.6f}", ranking_name="influence_user_ranking"
+        )
+
+    def make_amplified_user_ranking(
+        self, sub_query: str = None, kinds=INTERACTION_KINDS, **kwargs
+    ):
+        validate_tweet_exists(self._df)
+        _df = self._get_df(sub_query)
+        rankings = make_user_ranking(
+            _df,
+            search_query=self._search_query,
+            users=self._users,
+            col="amplified_count",
+            ascending=False,
+            user_df=make_interaction_user_df(_df, users=self._users, kinds=kinds),
+            **kwargs,
+        )
+        print_user_rankings(rankings, ranking_name="amplified_user_ranking")
+
+    def make_hashtag_ranking(self, top: int = 10, sub_query: str = None, **kwargs):
+        validate_tweet_exists(self._df)
+        rankings = make_hashtag_ranking(
+            self._get_index(),
+            rows=self._get_rows(sub_query, **kwargs),
+            top=top,
+            search_query=self._search_query,
+        )
+        print_hashtag_rankings(rankings, ranking_name="hashtag_ranking")
+
+    def make_co_hashtag_ranking(
+        self, hashtag: str, top: int = 10, sub_query: str = None, **kwargs
+    ):
+        validate_tweet_exists(self._df)
+        rankings = make_co_hashtag_ranking(
+            self._get_index(),
+            hashtag=hashtag,
+            rows=self._get_rows(sub_query, **kwargs),
+            top=top,
+            search_query=self._search_query,
+        )
+        print_hashtag_rankings(rankings, ranking_name=f"co_hashtag_ranking(#{hashtag})")
+
+    def enable_metrics(self, reset: bool = True):
+        """処理時間・件数の計測を開始する"""
+        if reset:
+            reset_metrics()
+        enable_metrics()
+
+    def disable_metrics(self):
+        disable_metrics()
+
+    def get_metrics(self, prometheus: bool = False):
+        """計測結果を取得する（prometheus=TrueでPrometheusテキスト形式）"""
+        return get_prometheus_metrics() if prometheus else get_metrics()
+
+    def print_memory_usage(self):
+        """ツイート・ユーザテーブルの使用メモリと、ツイートごとにプロフィールを持つ場合を比較表示する"""
+        validate_tweet_exists(self._df)
+        usage = self._store.memory_usage()
+        for name, size in usage.items():
+            print(f"{name}: {'{:,}'.format(size)} bytes")
+        print(f"ratio: {usage['store'] / usage['denormalized']:.2%}")
+
+    def print_dtype_report(self):
+        """ツイート・ユーザテーブルのカラムごとの型と、既定の型からの使用メモリの削減量を表示する"""
+        validate_tweet_exists(self._df)
+        for name, df in (("tweets", self._df), ("users", self._users)):
+            report = make_dtype_report(df)
+            before = report["before_bytes"].sum()
+            after = report["after_bytes"].sum()
+            print(f"▼▼▼▼▼ {name} ▼▼▼▼▼")
+            print(report.to_string(index=False))
+            print(
+                f"{'{:,}'.format(before)} → {'{:,}'.format(after)} bytes"
+                f"（{after / before:.2%}）"
+            )
+
     def print_last_tweeted_time(self):
         print(
             f"last tweeted time: {self._df.tweeted_dt.max().strftime('%Y/%-m/%-d %-H:%M:%S')}"
         )
+
+    @property
+    def _df(self) -> pandas.DataFrame:
+        return self._store.tweets if self._store is not None else None
+
+    @property
+    def _users(self) -> pandas.DataFrame:
+        return self._store.users if self._store is not None else None
+
+    def _set_followed_by(self):
+        if self._store is None or len(self._audiences) == 0:
+            return
+        followed_by = self._audiences.count_followed_by(
+            self._users["user_id"].to_numpy()
+        )
+        changed = self._users["followed_by"].to_numpy() != followed_by
+        self._store.users["followed_by"] = followed_by
+        # SQL側が最新の場合は、値が変わったユーザのfollowed_byだけを書き込む
+        if self._sql is not None and self._sql_store is self._store and changed.any():
+            self._sql.update_users(self._users[changed], ["followed_by"])
+
+    def _get_aggregates(self, sub_query: str = None, **kwargs):
+        # サンプリング取得した場合は重み付きで推定するため、集計結果を使わずにツイートから集計する
+        if is_sampled(self._df):
+            return None
+        # SQLを使用する場合はユーザ軸の絞り込みも含めてSQLで集計する
+        sql = self._get_sql(sub_query)
+        if sql is not None:
+            return sql.where(**kwargs)
+        # サブクエリ・ユーザ軸の絞り込みがない場合は、差分で更新している集計結果を使い回す
+        if sub_query or any(v is not None for v in kwargs.values()):
+            return None
+        return self._store.get_aggregates()
+
+    def _get_filtered_df(self, sub_query: str = None, aggregates=None, **kwargs):
+        # 集計済みの結果を使う場合、ツイートテーブルはグラフの集計に使用しないので絞り込まない
+        if aggregates is not None:
+            return self._df
+        return filter_user(self._get_df(sub_query), users=self._users, **kwargs)
+
+    def _get_user_df(self, sub_query: str = None) -> pandas.DataFrame:
+        # SQLを使用する場合はランキングの上位だけをSQLで集計するため不要
+        if self._get_sql(sub_query) is not None:
+            return None
+        # ユーザ軸の絞り込みはユーザ別の集計後に行うため、サブクエリがなければ集計結果を使い回せる
+        aggregates = self._get_aggregates(sub_query)
+        return aggregates.make_user_df(self._users) if aggregates is not None else None
+
+    def _get_sql(self, sub_query: str = None) -> SQLStore:
+        # use_sqlを呼んでいない場合・サブクエリを指定した場合はSQLを使用しない
+        if self._sql is None or sub_query:
+            return None
+        # ストアを置き換えた・フラグを変更した場合は全件を書き込み直す
+        if self._sql_store is not self._store:
+            self._sql.load_store(self._store)
+            self._sql.load_audiences(self._audiences)
+            self._sql_store = self._store
+        return self._sql
+
+    def _get_profiles(self, user_screen_name: str, kind: str) -> pandas.DataFrame:
+        # 取得していない場合はここで取得する
+        if (user_screen_name, kind) not in self._profiles:
+            self.hydrate_audience(user_screen_name, kind=kind)
+        return self._profiles[(user_screen_name, kind)]
+
+    def _get_index(self) -> TweetIndex:
+        # 転置インデックスは初回利用時に構築し、ツイートを再取得するまで使い回す
+        if self._index is None:
+            self._index = TweetIndex.from_df(self._df)
+        return self._index
+
+    def _get_df(self, sub_query: str = None) -> pandas.DataFrame:
+        if not sub_query:
+            return self._df
+        return filter_sub_query(self._df, self._get_index(), sub_query)
+
+    def _get_rows(self, sub_query: str = None, **kwargs):
+        if not sub_query and not kwargs:
+            return None
+        _df = filter_user(self._get_df(sub_query), users=self._users, **kwargs)
+        return self._df.index.get_indexer(_df.index)
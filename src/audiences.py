@@ -0,0 +1,218 @@
+from itertools import combinations
+from typing import Dict, Iterable, List
+
+import numpy
+import pandas
+
+from .metrics import timed
+
+# MinHashシグネチャで、IDが1件も振り分けられなかった区間を表す値
+_EMPTY = numpy.iinfo(numpy.uint64).max
+
+
+class AudienceSet:
+    """複数アカウントのフォロワーIDの集合を保持するクラス
+
+    集合はアカウントごとにソート済み・重複なしのint64配列で持ち、
+    積集合はsearchsortedによるマージ、全ペアの類似度はMinHashで求める。
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def accounts(self) -> List[str]:
+        return list(self._ids)
+
+    def add(self, screen_name: str, ids: Iterable[int]):
+        """アカウントのフォロワーIDを追加する（同じアカウントは置き換える）
+
+        :param screen_name: アカウント名
+        :param ids: フォロワーのユーザIDの配列
+        """
+        self._ids[screen_name] = numpy.unique(numpy.asarray(ids, dtype=numpy.int64))
+
+    def get(self, screen_name: str) -> numpy.ndarray:
+        return self._ids[screen_name]
+
+    def intersection_count(self, a: str, b: str) -> int:
+        """2アカウントの共通フォロワー数を求める
+
+        :param a: アカウント名
+        :param b: アカウント名
+        :return 共通フォロワー数
+        """
+        return len(_intersect_sorted(self._ids[a], self._ids[b]))
+
+    @timed("make_audience_overlap_df")
+    def make_overlap_df(self) -> pandas.DataFrame:
+        """全ペアの共通フォロワー数とJaccard係数を求める（正確な値）
+
+        :return account_a, account_b, intersection, jaccardのDataFrame
+        """
+        rows = []
+        for a, b in combinations(self._ids, 2):
+            intersection = self.intersection_count(a, b)
+            union = len(self._ids[a]) + len(self._ids[b]) - intersection
+            rows.append(
+                {
+                    "account_a": a,
+                    "account_b": b,
+                    "intersection": intersection,
+                    "jaccard": intersection / union if union else 0.0,
+                }
+            )
+        return _make_pair_df(
+            rows, ["account_a", "account_b", "intersection", "jaccard"]
+        )
+
+    @timed("estimate_audience_overlap_df")
+    def estimate_overlap_df(
+        self, num_bins: int = 256, seed: int = 0
+    ) -> pandas.DataFrame:
+        """全ペアのJaccard係数をMinHashで推定する
+
+        アカウント数・フォロワー数が多い場合に、正確な値を求める前の絞り込みに使用する。
+        推定誤差の標準偏差はおおよそ 1 / sqrt(num_bins)。
+
+        :param num_bins: シグネチャの長さ
+        :param seed: ハッシュ関数のシード
+        :return account_a, account_b, jaccard_estimateのDataFrame
+        """
+        signatures = self.make_signatures(num_bins=num_bins, seed=seed)
+        # 全ペアについて、どちらかにIDがある区間のうち最小値が一致した区間の割合を一度に求める
+        _a = signatures[:, None, :]
+        _b = signatures[None, :, :]
+        matched = ((_a == _b) & (_a != _EMPTY)).sum(axis=2)
+        filled = ((_a != _EMPTY) | (_b != _EMPTY)).sum(axis=2)
+        similarity = matched / numpy.maximum(filled, 1)
+        accounts = self.accounts
+        rows = [
+            {
+                "account_a": accounts[i],
+                "account_b": accounts[j],
+                "jaccard_estimate": similarity[i, j],
+            }
+            for i, j in combinations(range(len(accounts)), 2)
+        ]
+        return _make_pair_df(rows, ["account_a", "account_b", "jaccard_estimate"])
+
+    def make_signatures(self, num_bins: int = 256, seed: int = 0) -> numpy.ndarray:
+        """アカウントごとのMinHashシグネチャを求める
+
+        ハッシュ関数をnum_bins個用意する代わりに、1回のハッシュ値をnum_bins個の区間に振り分けて
+        区間ごとの最小値を取る（one permutation hashing）。計算量はフォロワー数に比例する。
+
+        :param num_bins: シグネチャの長さ
+        :param seed: ハッシュ関数のシード
+        :return (アカウント数, num_bins)のuint64配列、IDが1件もない区間は_EMPTY
+        """
+        _bins = numpy.uint64(num_bins)
+        signatures = numpy.full((len(self._ids), num_bins), _EMPTY, numpy.uint64)
+        for i, ids in enumerate(self._ids.values()):
+            hashed = _hash64(ids, seed=seed)
+            numpy.minimum.at(signatures[i], hashed % _bins, hashed // _bins)
+        return signatures
+
+    @timed("make_audience_reach_df")
+    def make_reach_df(self) -> pandas.DataFrame:
+        """アカウントごとのフォロワー数と、他のアカウントにはない独自のフォロワー数を求める
+
+        :return account, followers_count, unique_count, unique_ratioのDataFrame
+        """
+        values, counts = numpy.unique(
+            numpy.concatenate(list(self._ids.values())), return_counts=True
+        )
+        # どれか1アカウントだけにフォローされているユーザ
+        only_one = values[counts == 1]
+        rows = []
+        for account, ids in self._ids.items():
+            unique_count = len(_intersect_sorted(ids, only_one))
+            rows.append(
+                {
+                    "account": account,
+                    "followers_count": len(ids),
+                    "unique_count": unique_count,
+                    "unique_ratio": unique_count / len(ids) if len(ids) else 0.0,
+                }
+            )
+        _df = pandas.DataFrame(
+            rows, columns=["account", "followers_count", "unique_count", "unique_ratio"]
+        )
+        return _df.sort_values("unique_count", ascending=False).reset_index(drop=True)
+
+    def count_reach(self, accounts: Iterable[str] = None) -> int:
+        """指定アカウントのフォロワーの和集合の人数（重複を除いたリーチ）を求める
+
+        :param accounts: 対象アカウント、未指定の場合は全アカウント
+        :return 和集合の人数
+        """
+        _accounts = self.accounts if accounts is None else list(accounts)
+        if not _accounts:
+            return 0
+        return len(numpy.unique(numpy.concatenate([self._ids[a] for a in _accounts])))
+
+    @timed("count_followed_by")
+    def count_followed_by(self, user_ids: numpy.ndarray) -> numpy.ndarray:
+        """ユーザごとに、何アカウントからフォローされているか（何アカウントのフォロワーか）を数える
+
+        :param user_ids: ユーザIDの配列（ユーザテーブルのuser_idなど）
+        :return user_idsと同じ並びの件数の配列
+        """
+        user_ids = numpy.asarray(user_ids, dtype=numpy.int64)
+        counts = numpy.zeros(len(user_ids), dtype=numpy.int16)
+        if len(user_ids) == 0:
+            return counts
+        for ids in self._ids.values():
+            counts += _isin_sorted(user_ids, ids)
+        return counts
+
+
+def make_audience_set(ids_by_account: Dict[str, Iterable[int]]) -> AudienceSet:
+    """アカウント名とフォロワーIDの辞書からAudienceSetを生成する"""
+    audiences = AudienceSet()
+    for screen_name, ids in ids_by_account.items():
+        audiences.add(screen_name, ids)
+    return audiences
+
+
+def _isin_sorted(values: numpy.ndarray, sorted_ids: numpy.ndarray) -> numpy.ndarray:
+    """valuesの各要素がソート済み配列sorted_idsに含まれるかを判定する"""
+    if len(sorted_ids) == 0:
+        return numpy.zeros(len(values), dtype=bool)
+    positions = numpy.searchsorted(sorted_ids, values)
+    positions[positions == len(sorted_ids)] = 0
+    return sorted_ids[positions] == values
+
+
+def _intersect_sorted(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    """ソート済み・重複なしの配列の積集合を求める
+
+    小さい方の配列の各要素を大きい方の配列から二分探索するため、
+    件数が大きく異なる集合同士でも小さい方の件数×log(大きい方の件数)で済む。
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    return a[_isin_sorted(a, b)]
+
+
+def _hash64(ids: numpy.ndarray, seed: int = 0) -> numpy.ndarray:
+    """ユーザIDを64bitのハッシュ値に変換する（splitmix64の混合関数）
+
+    連番に近いIDでもハッシュ値が偏らないようにする。
+    """
+    with numpy.errstate(over="ignore"):
+        x = ids.astype(numpy.uint64) + numpy.uint64(seed) * numpy.uint64(
+            0x9E3779B97F4A7C15
+        )
+        x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+        return x ^ (x >> numpy.uint64(31))
+
+
+def _make_pair_df(rows: List[Dict], columns: List[str]) -> pandas.DataFrame:
+    _df = pandas.DataFrame(rows, columns=columns)
+    return _df.sort_values(columns[-1], ascending=False).reset_index(drop=True)
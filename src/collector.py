@@ -0,0 +1,369 @@
+"""常駐して複数のクエリ・アカウントを定期的に収集するコレクタ
+
+設定ファイル（JSON）のクエリ・アカウントごとに更新ジョブを作り、
+古さ（前回実行からの経過時間÷更新間隔）とリクエスト上限に対するコストで優先度を決めて順に実行する。
+認証済みのクライアントと取得済みのストアはプロセス内で使い回し、結果はLocalStoreに保存する。
+
+    twivis-collector --config collector.json
+    python -m twivis.collector --config collector.json --once
+
+設定ファイルの例::
+
+    {
+      "store_dir": "./twivis-store",
+      "timezone": "Asia/Tokyo",
+      "auth": {"api_key": "...", "api_secret": "...",
+               "access_token": "...", "access_token_secret": "..."},
+      "queries": [
+        {"name": "python", "search_word": "python", "advanced_query": "-filter:retweets",
+         "interval": 3600, "limit": null, "followers_of": "account"}
+      ],
+      "accounts": [
+        {"screen_name": "account", "followers": true, "following": false, "interval": 86400}
+      ]
+    }
+
+authを省略した場合は環境変数TWIVIS_API_KEY, TWIVIS_API_SECRET, TWIVIS_ACCESS_TOKEN,
+TWIVIS_ACCESS_TOKEN_SECRETを使用する。
+"""
+import argparse
+import heapq
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pandas
+import pytz
+
+from .auth import TwitterAuthKeys, auth_twitter_api
+from .constants import (
+    API_COUNTS,
+    API_RATE_LIMITS,
+    FOLLOWER_IDS_API_PATH,
+    FRIEND_IDS_API_PATH,
+    SEARCH_API_PATH,
+)
+from .errors import ParameterError
+from .limits import get_rate_limit
+from .loggers import get_logger, set_logger_timezone
+from .metrics import increment
+from .stores import LocalStore, TweetStore
+from .tweets import search_tweets
+from .users import get_follower_ids, get_following_ids
+
+logger = get_logger(__name__, loglevel=logging.INFO)
+
+SEARCH_JOB = "search"
+FOLLOWERS_JOB = "followers"
+FOLLOWING_JOB = "following"
+JOB_API_PATHS = {
+    SEARCH_JOB: SEARCH_API_PATH,
+    FOLLOWERS_JOB: FOLLOWER_IDS_API_PATH,
+    FOLLOWING_JOB: FRIEND_IDS_API_PATH,
+}
+
+# ジョブが失敗した場合に再実行するまでの待機秒数
+RETRY_DELAY = 5 * 60
+
+_AUTH_ENVIRONS = {
+    "api_key": "TWIVIS_API_KEY",
+    "api_secret": "TWIVIS_API_SECRET",
+    "access_token": "TWIVIS_ACCESS_TOKEN",
+    "access_token_secret": "TWIVIS_ACCESS_TOKEN_SECRET",
+}
+
+
+@dataclass
+class Job:
+    """更新ジョブ
+
+    :param kind: search, followers, followingのいずれか
+    :param name: クエリ名またはアカウント名
+    :param interval: 更新間隔（秒）
+    :param params: ジョブごとの設定
+    :param last_run: 前回の実行完了時刻（UNIX時間）
+    :param pages: 前回実行時のページ数（次回のコストの見積もりに使用する）
+    :param not_before: この時刻まで実行しない（リクエスト上限・失敗時の待機）
+    """
+
+    kind: str
+    name: str
+    interval: float
+    params: Dict = field(default_factory=dict)
+    last_run: float = 0.0
+    pages: int = 1
+    not_before: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.name}"
+
+    @property
+    def api_path(self) -> str:
+        return JOB_API_PATHS[self.kind]
+
+    def staleness(self, now: float) -> float:
+        """前回実行からの経過時間を更新間隔で割った値（1以上で更新時期）"""
+        return (now - self.last_run) / self.interval
+
+    def cost(self) -> float:
+        """1回の実行で使うリクエスト数の、15分あたりの上限に対する割合"""
+        return max(self.pages, 1) / API_RATE_LIMITS[self.api_path]
+
+    def priority(self, now: float) -> float:
+        return self.staleness(now) / self.cost()
+
+    def is_due(self, now: float) -> bool:
+        return self.staleness(now) >= 1 and now >= self.not_before
+
+
+def make_jobs(config: Dict) -> List[Job]:
+    """設定からジョブを生成する
+
+    :param config: 設定ファイルの内容
+    :return ジョブのリスト
+    """
+    jobs = []
+    for query in config.get("queries", []):
+        if "name" not in query or "search_word" not in query:
+            raise ParameterError("queriesにはname, search_wordを指定してください")
+        jobs.append(
+            Job(
+                kind=SEARCH_JOB,
+                name=query["name"],
+                interval=query.get("interval", 3600),
+                params=query,
+            )
+        )
+    for account in config.get("accounts", []):
+        if "screen_name" not in account:
+            raise ParameterError("accountsにはscreen_nameを指定してください")
+        for kind in (FOLLOWERS_JOB, FOLLOWING_JOB):
+            if account.get(kind, kind == FOLLOWERS_JOB):
+                jobs.append(
+                    Job(
+                        kind=kind,
+                        name=account["screen_name"],
+                        interval=account.get("interval", 24 * 3600),
+                        params=account,
+                    )
+                )
+    if len({job.key for job in jobs}) < len(jobs):
+        raise ParameterError("クエリ名・アカウント名が重複しています")
+    return jobs
+
+
+def load_auth_keys(config: Dict) -> TwitterAuthKeys:
+    """設定ファイルまたは環境変数から認証情報を取得する"""
+    auth = config.get("auth", {})
+    keys = {k: auth.get(k) or os.environ.get(env) for k, env in _AUTH_ENVIRONS.items()}
+    missing = [k for k, v in keys.items() if not v]
+    if missing:
+        raise ParameterError(f"認証情報が指定されていません: {', '.join(missing)}")
+    return TwitterAuthKeys(**keys)
+
+
+class Collector:
+    """ジョブを優先度順に実行し続けるコレクタ
+
+    :param config: 設定ファイルの内容
+    :param auth_keys: 認証情報（省略時はconfig・環境変数から取得する）
+    """
+
+    def __init__(self, config: Dict, auth_keys: TwitterAuthKeys = None):
+        self._jobs = make_jobs(config)
+        self._local_store = LocalStore(config.get("store_dir", "twivis-store"))
+        self._timezone = pytz.timezone(config.get("timezone", "UTC"))
+        set_logger_timezone(config.get("timezone", "UTC"))
+        self._api = auth_twitter_api(auth_keys=auth_keys or load_auth_keys(config))
+        self._poll_interval = config.get("poll_interval", 60)
+        # 取得済みのストアはメモリに保持し、実行のたびにファイルから読み込み直さない
+        self._stores = {}
+        self._stop = threading.Event()
+        self._restore_state()
+
+    def stop(self, *args):
+        """実行中のジョブが終わった時点で停止する（シグナルハンドラとしても使用する）"""
+        logger.info("停止します")
+        self._stop.set()
+
+    def run(self, once: bool = False):
+        """ジョブを実行し続ける
+
+        :param once: Trueの場合は更新時期のジョブを一巡したら終了する（cronからの起動用）
+        """
+        logger.info(f"=== collector Start（{len(self._jobs)} ジョブ）")
+        while not self._stop.is_set():
+            job = self._next_job(time.time())
+            if job is None:
+                if once:
+                    break
+                self._stop.wait(self._seconds_until_due(time.time()))
+                continue
+            self._run_job(job)
+        logger.info("=== collector End")
+
+    def _next_job(self, now: float) -> Optional[Job]:
+        # 古さ・コストは時間とともに変わるため、取り出すたびに優先度を計算し直す
+        queue = [
+            (-job.priority(now), i, job)
+            for i, job in enumerate(self._jobs)
+            if job.is_due(now)
+        ]
+        heapq.heapify(queue)
+        while queue:
+            _, _, job = heapq.heappop(queue)
+            if self._has_rate_limit(job):
+                return job
+        return None
+
+    def _has_rate_limit(self, job: Job) -> bool:
+        """前回と同程度のリクエストができるだけの残り回数があるか確認し、なければリセットまで延期する
+
+        1回で上限を超える大きなジョブは、ページングの中でリセットを待つため延期しない。
+        """
+        rate_limit = get_rate_limit(self._api, api_path=job.api_path)
+        needed = min(job.pages, API_RATE_LIMITS[job.api_path])
+        if rate_limit["remaining"] >= needed:
+            return True
+        job.not_before = rate_limit["reset"]
+        increment("collector_deferred_jobs")
+        logger.info(f"{job.key}: リクエスト上限のためリセットまで延期")
+        return False
+
+    def _seconds_until_due(self, now: float) -> float:
+        due_times = [
+            max(job.last_run + job.interval, job.not_before) for job in self._jobs
+        ]
+        return min([max(t - now, 0) for t in due_times] + [self._poll_interval])
+
+    def _run_job(self, job: Job):
+        logger.info(f"{job.key}: 更新開始")
+        try:
+            if job.kind == SEARCH_JOB:
+                job.pages = self._run_search_job(job)
+            else:
+                job.pages = self._run_ids_job(job)
+        except Exception:
+            logger.exception(f"{job.key}: 更新失敗、{RETRY_DELAY}秒後に再実行します")
+            increment("collector_failed_jobs")
+            job.not_before = time.time() + RETRY_DELAY
+            return
+        job.last_run = time.time()
+        increment("collector_jobs")
+        self._save_state()
+        logger.info(f"{job.key}: 更新完了")
+
+    def _run_search_job(self, job: Job) -> int:
+        """ツイートを検索して取得済みのストアに追加し、保存する
+
+        2回目以降は取得済みの最新のツイートより新しいツイートだけを検索し、
+        7日間分のページを取得し直さない（取得済みのツイートのいいね数などは更新しない）。
+
+        :return 使用したページ数
+        """
+        store = self._get_store(job.name)
+        since_id = None
+        if store is not None and len(store.tweets) > 0:
+            since_id = int(store.tweets["tweet_id"].max())
+        tweets = search_tweets(
+            api=self._api,
+            search_query=_make_search_query(job),
+            limit=job.params.get("limit"),
+            timezone=self._timezone,
+            since_id=since_id,
+        )
+        if store is None:
+            store = TweetStore.from_tweets(tweets)
+        else:
+            store = store.upsert(pandas.DataFrame(tweets))
+
+        followers_of = job.params.get("followers_of")
+        if followers_of:
+            follower_ids = self._local_store.load_ids(followers_of, FOLLOWERS_JOB)
+            if follower_ids is not None:
+                store.set_user_flag("follower", follower_ids)
+
+        self._stores[job.name] = store
+        self._save_tweets(job, store)
+        return len(tweets) // API_COUNTS[SEARCH_API_PATH] + 1
+
+    def _run_ids_job(self, job: Job) -> int:
+        """フォロワー・フォロー中ユーザのIDを取得して保存する
+
+        :return 使用したページ数
+        """
+        if job.kind == FOLLOWERS_JOB:
+            ids = get_follower_ids(self._api, user_screen_name=job.name)
+        else:
+            ids = get_following_ids(self._api, user_screen_name=job.name)
+        self._local_store.save_ids(job.name, job.kind, ids)
+
+        # このアカウントのフォロワーを付与するクエリは、検索を待たずにフラグを更新する
+        if job.kind == FOLLOWERS_JOB:
+            for search_job in self._jobs:
+                if search_job.params.get("followers_of") != job.name:
+                    continue
+                store = self._get_store(search_job.name)
+                if store is not None:
+                    self._save_tweets(search_job, store.set_user_flag("follower", ids))
+        return len(ids) // API_COUNTS[job.api_path] + 1
+
+    def _save_tweets(self, job: Job, store: TweetStore):
+        self._local_store.save_tweets(
+            job.name,
+            store,
+            meta={
+                "search_word": job.params["search_word"],
+                "search_query": _make_search_query(job),
+                "updated_at": time.time(),
+            },
+        )
+
+    def _get_store(self, name: str) -> Optional[TweetStore]:
+        if name not in self._stores:
+            self._stores[name], _ = self._local_store.load_tweets(name)
+        return self._stores[name]
+
+    def _save_state(self):
+        self._local_store.save_state(
+            {
+                job.key: {"last_run": job.last_run, "pages": job.pages}
+                for job in self._jobs
+            }
+        )
+
+    def _restore_state(self):
+        # 再起動時に全ジョブを一斉に実行しないよう、前回の実行時刻を引き継ぐ
+        state = self._local_store.load_state()
+        for job in self._jobs:
+            if job.key in state:
+                job.last_run = state[job.key]["last_run"]
+                job.pages = state[job.key]["pages"]
+
+
+def _make_search_query(job: Job) -> str:
+    return job.params["search_word"] + " " + job.params.get("advanced_query", "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="設定ファイルのクエリ・アカウントを定期的に収集する")
+    parser.add_argument("--config", required=True, help="設定ファイル（JSON）のパス")
+    parser.add_argument("--once", action="store_true", help="更新時期のジョブを一巡したら終了する")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    collector = Collector(config)
+    signal.signal(signal.SIGTERM, collector.stop)
+    signal.signal(signal.SIGINT, collector.stop)
+    collector.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,30 @@ FULL_TEXT_TWEET_MODE = "extended"
 # 当日のツイートを除外したい場合はTrueとする（時間帯分析時は24時間分取得できない当日は除外した方がよさそう）
 TODAY_EXCLUDED = False
 
+# いいね数・リツイート数の集計方法（pandasのNamed Aggregation形式）
+ENGAGEMENT_AGGREGATIONS = {
+    "favorite_sum": ("favorite_count", "sum"),
+    "favorite_max": ("favorite_count", "max"),
+    "retweet_sum": ("retweet_count", "sum"),
+    "retweet_max": ("retweet_count", "max"),
+}
+ENGAGEMENT_COLS = [
+    "favorite_sum",
+    "favorite_max",
+    "favorite_p95",
+    "retweet_sum",
+    "retweet_max",
+    "retweet_p95",
+]
+ENGAGEMENT_LABELS = {
+    "favorite_sum": "いいね数合計",
+    "favorite_max": "いいね数最大",
+    "favorite_p95": "いいね数95パーセンタイル",
+    "retweet_sum": "リツイート数合計",
+    "retweet_max": "リツイート数最大",
+    "retweet_p95": "リツイート数95パーセンタイル",
+}
+
 
 class FfRatioOrderModes(Enum):
     HIGH = "high"
@@ -18,19 +42,43 @@ class FfRatioOrderModes(Enum):
 SEARCH_API_PATH = "/search/tweets"
 FOLLOWER_IDS_API_PATH = "/followers/ids"
 FRIEND_IDS_API_PATH = "/friends/ids"
+USERS_LOOKUP_API_PATH = "/users/lookup"
 API_TYPES = {
     SEARCH_API_PATH: "search",
     FOLLOWER_IDS_API_PATH: "followers",
     FRIEND_IDS_API_PATH: "friends",
+    USERS_LOOKUP_API_PATH: "users",
 }
 API_COUNTS = {
     SEARCH_API_PATH: 100,
     FOLLOWER_IDS_API_PATH: 5000,
     FRIEND_IDS_API_PATH: 5000,
+    USERS_LOOKUP_API_PATH: 100,
+}
+# 15分あたりのリクエスト上限（ユーザ認証）
+API_RATE_LIMITS = {
+    SEARCH_API_PATH: 180,
+    FOLLOWER_IDS_API_PATH: 15,
+    FRIEND_IDS_API_PATH: 15,
+    USERS_LOOKUP_API_PATH: 900,
 }
 API_URLS = {
     FOLLOWER_IDS_API_PATH: "https://api.twitter.com/1.1/followers/ids.json",
     FRIEND_IDS_API_PATH: "https://api.twitter.com/1.1/friends/ids.json",
+    USERS_LOOKUP_API_PATH: "https://api.twitter.com/1.1/users/lookup.json",
 }
 
+# 取得済みのプロフィールを再取得せずに使い回す期間（秒）
+PROFILE_CACHE_TTL = 24 * 60 * 60
+
+# snowflake形式のツイートIDの基準時刻（2010-11-04 01:42:54.657 UTC、ミリ秒）
+TWITTER_EPOCH_MS = 1288834974657
+
+# サンプリング取得（sample_tweets）したツイートの重み（1件が表すツイート数の推定値）のカラム
+SAMPLE_WEIGHT_COL = "sample_weight"
+# サンプリング取得した層の時間幅（時間）のカラム、1時間より広い場合は信頼区間を求めない
+SAMPLE_STRATUM_HOURS_COL = "sample_stratum_hours"
+# サンプリング取得したツイートから求めた推定値に付ける信頼区間（95%）の係数
+CONFIDENCE_Z = 1.96
+
 RETRY_COUNT = 10
@@ -0,0 +1,165 @@
+from typing import Dict
+
+import numpy
+import pandas
+
+from .metrics import timed
+
+# ユニーク件数が行数のこの割合以下の文字列カラムをカテゴリ型にする
+CATEGORY_MAX_RATIO = 0.5
+
+# 件数が少なくても集計単位にならない自由記述のカラムはカテゴリ型にしない
+_FREE_TEXT_COLS = ["full_text"]
+
+
+def plan_dtypes(df: pandas.DataFrame) -> Dict[str, str]:
+    """カラムごとに省メモリな型を決める
+
+    - 件数のカラム（〜_count）は値が収まる最小の整数型にする（IDはint64のまま）
+    - 曜日・時間・投稿元などの種類が少ない文字列はカテゴリ型にする（大小比較できるよう順序付き）
+    - Noneを含むフラグ（following）はobject型ではなくnullableなboolean型にする
+
+    :param df: 対象のDataFrame
+    :return カラム名と型の辞書（変更しないカラムは含まない）
+    """
+    plan = {}
+    for col in df.columns:
+        series = df[col]
+        if pandas.api.types.is_integer_dtype(series.dtype):
+            if col.endswith("_count") and len(series) > 0:
+                dtype = _min_int_dtype(series)
+                if dtype != series.dtype:
+                    plan[col] = dtype.name
+        elif series.dtype == object:
+            values = series.dropna()
+            if len(values) == 0:
+                continue
+            if values.map(type).isin([bool, numpy.bool_]).all():
+                plan[col] = "boolean"
+            elif (
+                col not in _FREE_TEXT_COLS
+                and not values.map(type).isin([tuple, list]).any()
+                and values.nunique() <= len(series) * CATEGORY_MAX_RATIO
+            ):
+                plan[col] = "category"
+    return plan
+
+
+@timed("optimize_dtypes")
+def optimize_dtypes(df: pandas.DataFrame) -> pandas.DataFrame:
+    """plan_dtypesで決めた型に変換したDataFrameを生成する
+
+    :param df: 対象のDataFrame
+    :return 変換後のDataFrame
+    """
+    plan = plan_dtypes(df)
+    if not plan:
+        return df
+    _df = df.copy()
+    for col, dtype in plan.items():
+        if dtype == "category":
+            _df[col] = _to_ordered_category(_df[col])
+        else:
+            _df[col] = _df[col].astype(dtype)
+    return _df
+
+
+@timed("concat_optimized")
+def concat_optimized(
+    base: pandas.DataFrame, df: pandas.DataFrame, ignore_index: bool = True
+) -> pandas.DataFrame:
+    """optimize_dtypesで変換済みのbaseにdfを連結する
+
+    連結のたびに全体の型を決め直さないよう、dfをbaseの型に合わせてから連結する。
+    カテゴリ型は新しいラベルをカテゴリに追加し、整数型は値が収まらない場合だけ広げる。
+    baseが空の場合（列だけの初期状態）はdfをoptimize_dtypesで変換する。
+
+    :param base: 変換済みのDataFrame
+    :param df: 追加するDataFrame
+    :param ignore_index: Trueの場合は連結後のインデックスを振り直す
+    :return 連結後のDataFrame
+    """
+    if base.empty:
+        return optimize_dtypes(df.reset_index(drop=True) if ignore_index else df)
+
+    _base = base.copy(deep=False)
+    _df = df.copy(deep=False)
+    for col in base.columns.intersection(df.columns):
+        dtype = base[col].dtype
+        if isinstance(dtype, pandas.CategoricalDtype):
+            new_labels = pandas.Index(_df[col].dropna().unique()).difference(
+                dtype.categories
+            )
+            if len(new_labels) > 0:
+                dtype = _union_category_dtype(dtype, new_labels)
+                _base[col] = _base[col].astype(dtype)
+            _df[col] = _df[col].astype(dtype)
+        elif dtype.name == "boolean":
+            _df[col] = _df[col].astype("boolean")
+        elif col.endswith("_count") and pandas.api.types.is_integer_dtype(dtype):
+            if len(_df) > 0:
+                dtype = max(dtype, _min_int_dtype(_df[col]), key=lambda t: t.itemsize)
+            _base[col] = _base[col].astype(dtype, copy=False)
+            _df[col] = _df[col].astype(dtype)
+    return pandas.concat([_base, _df], ignore_index=ignore_index)
+
+
+def make_dtype_report(df: pandas.DataFrame) -> pandas.DataFrame:
+    """変換前（pandasの既定の型）と変換後の使用メモリをカラムごとに比較する
+
+    :param df: optimize_dtypesで変換したDataFrame
+    :return column, before_dtype, after_dtype, before_bytes, after_bytesのDataFrame
+    """
+    before = _to_default_dtypes(df)
+    _df = pandas.DataFrame(
+        {
+            "column": df.columns,
+            "before_dtype": [str(t) for t in before.dtypes],
+            "after_dtype": [str(t) for t in df.dtypes],
+            "before_bytes": before.memory_usage(index=False, deep=True).to_numpy(),
+            "after_bytes": df.memory_usage(index=False, deep=True).to_numpy(),
+        }
+    )
+    return _df.sort_values("before_bytes", ascending=False).reset_index(drop=True)
+
+
+def _min_int_dtype(series: pandas.Series) -> numpy.dtype:
+    for dtype in (numpy.int8, numpy.int16, numpy.int32):
+        info = numpy.iinfo(dtype)
+        if info.min <= series.min() and series.max() <= info.max:
+            return numpy.dtype(dtype)
+    return numpy.dtype(numpy.int64)
+
+
+def _to_ordered_category(series: pandas.Series) -> pandas.Series:
+    categories = series.dropna().unique()
+    try:
+        categories = sorted(categories)
+    except TypeError:
+        # 大小比較できない値が混在する場合は順序なしにする
+        return series.astype("category")
+    return series.astype(pandas.CategoricalDtype(categories, ordered=True))
+
+
+def _union_category_dtype(
+    dtype: pandas.CategoricalDtype, labels: pandas.Index
+) -> pandas.CategoricalDtype:
+    categories = dtype.categories.append(labels)
+    if dtype.ordered:
+        try:
+            return pandas.CategoricalDtype(sorted(categories), ordered=True)
+        except TypeError:
+            pass
+    return pandas.CategoricalDtype(categories, ordered=False)
+
+
+def _to_default_dtypes(df: pandas.DataFrame) -> pandas.DataFrame:
+    """pandas.DataFrame(list of dict)で生成した場合の型に戻す"""
+    _df = df.copy()
+    for col in _df.columns:
+        dtype = _df[col].dtype
+        if isinstance(dtype, pandas.CategoricalDtype) or dtype.name == "boolean":
+            _df[col] = _df[col].astype(object)
+        elif pandas.api.types.is_integer_dtype(dtype):
+            _df[col] = _df[col].astype(numpy.int64)
+    return _df
@@ -20,3 +20,15 @@ class TwitterApiError(Exception):
     """TwitterAPIからの応答エラーを知らせる例外クラス"""
 
     pass
+
+
+class NotFoundError(TwitterApiError):
+    """指定したユーザなどが存在しないこと（HTTP 404）を知らせる例外クラス"""
+
+    pass
+
+
+class ReplayNotFoundError(Exception):
+    """再生対象のページが記録されていないことを知らせる例外クラス"""
+
+    pass
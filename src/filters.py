@@ -1,5 +1,8 @@
+import numpy
 import pandas
 
+from .indexes import TweetIndex
+
 
 def filter_user(
     df: pandas.DataFrame,
@@ -7,16 +10,44 @@ def filter_user(
     max_followers_count: int = None,
     following: bool = None,
     follower: bool = None,
+    min_followed_by: int = None,
+    users: pandas.DataFrame = None,
 ) -> pandas.DataFrame:
     """ユーザ軸の項目でフィルタリング
 
+    usersを指定した場合はユーザテーブルで判定し、ツイートテーブルのuser_idxで絞り込む。
+
     :param df: 計算対象のDataFrame
     :param min_followers_count: フォロワー数の下限値、指定した値よりフォロワー数が多いユーザを対象とする
     :param max_followers_count: フォロワー数の上限値、指定した値よりフォロワー数が少ないユーザを対象とする
     :param following: フォロー済みのユーザを対象とする
     :param follower: フォロワーを対象とする
+    :param min_followed_by: 追跡中のアカウントのうち、指定した数以上からフォローされているユーザを対象とする
+    :param users: ユーザテーブル、dfがツイートテーブルの場合に指定する
     :return 計算後のDataFrame
     """
+    if users is not None:
+        conditions = (
+            min_followers_count,
+            max_followers_count,
+            following,
+            follower,
+            min_followed_by,
+        )
+        if all(c is None for c in conditions):
+            return df
+        _users = filter_user(
+            users,
+            min_followers_count=min_followers_count,
+            max_followers_count=max_followers_count,
+            following=following,
+            follower=follower,
+            min_followed_by=min_followed_by,
+        )
+        mask = numpy.zeros(len(users), dtype=bool)
+        mask[_users.index] = True
+        return df[mask[df["user_idx"].to_numpy()]]
+
     _df = df
     if min_followers_count:
         _df = _df[_df["followers_count"] >= min_followers_count]
@@ -24,10 +55,27 @@ def filter_user(
     if max_followers_count:
         _df = _df[_df["followers_count"] <= max_followers_count]
 
+    # nullableなboolean型の欠損（取得できなかったフラグ）は条件に一致しないものとする
     if following is not None:
-        _df = _df[_df["following"] == following]
+        _df = _df[(_df["following"] == following).fillna(False).astype(bool)]
 
     if follower is not None:
-        _df = _df[_df["follower"] == follower]
+        _df = _df[(_df["follower"] == follower).fillna(False).astype(bool)]
+
+    if min_followed_by:
+        _df = _df[_df["followed_by"] >= min_followed_by]
 
     return _df
+
+
+def filter_sub_query(
+    df: pandas.DataFrame, index: TweetIndex, sub_query: str
+) -> pandas.DataFrame:
+    """転置インデックスを使用してサブクエリに一致するツイートでフィルタリング
+
+    :param df: インデックス構築に使用したDataFrame
+    :param index: dfから構築した転置インデックス
+    :param sub_query: サブクエリ（空白区切りでAND条件、-から始まる語は除外）
+    :return 計算後のDataFrame
+    """
+    return df.iloc[index.search(sub_query)]
@@ -1,22 +1,53 @@
 import pandas
 import plotly.express
 
+from .aggregates import TweetAggregates
+from .constants import ENGAGEMENT_LABELS
+from .metrics import timed
 from .processors import (
+    estimate_total,
+    is_sampled,
     make_count_tweeted_df,
     make_count_tweeted_weekday_df,
+    make_engagement_df,
+    make_estimated_df,
+    make_followers_count_bucket_df,
     make_title,
     make_tweet_user_weekday_max_hour_df,
+    make_tweeted_weekday_hour_label_range,
+    make_tweeted_weekday_range,
 )
 
 
-def make_daily_tweets_graph(df: pandas.DataFrame, search_word: str, timezone):
+@timed("make_daily_tweets_graph")
+def make_daily_tweets_graph(
+    df: pandas.DataFrame,
+    search_word: str,
+    timezone,
+    aggregates: TweetAggregates = None,
+):
     """日付別のツイート数を折れ線グラフで出力する
 
     :param df: 集計対象のDataFrame
     :param search_word: タイトルに表示する検索ワード
     :param timezone: timezoneオブジェクト
+    :param aggregates: dfの集計済みの結果、指定した場合はdfを集計し直さない
     """
-    _df = make_count_tweeted_weekday_df(df, timezone=timezone)
+    if is_sampled(df):
+        return _plot_estimated_count(
+            df,
+            group_col="tweeted_weekday",
+            labels=make_tweeted_weekday_range(timezone=timezone),
+            x_label="ツイート日付",
+            main_title="日別ツイート数",
+            search_word=search_word,
+        )
+    if aggregates is None:
+        _df = make_count_tweeted_weekday_df(df, timezone=timezone)
+    else:
+        _df = aggregates.make_count_df(
+            "tweeted_weekday", labels=make_tweeted_weekday_range(timezone=timezone)
+        )
     _total_count = _df.sum()["count"]
     fig = plot_line(
         _df,
@@ -25,21 +56,37 @@ def make_daily_tweets_graph(df: pandas.DataFrame, search_word: str, timezone):
         y_col="count",
         y_label="ツイート数",
         title=make_title(
-            df, main_title="日別ツイート数", count=_total_count, search_word=search_word
+            df,
+            main_title="日別ツイート数",
+            count=_total_count,
+            search_word=search_word,
+            users_count=_count_users(aggregates),
         ),
     )
     return fig
 
 
-def make_daily_tweet_users_graph(df: pandas.DataFrame, search_word: str, timezone):
+@timed("make_daily_tweet_users_graph")
+def make_daily_tweet_users_graph(
+    df: pandas.DataFrame,
+    search_word: str,
+    timezone,
+    aggregates: TweetAggregates = None,
+):
     """日付別のツイート人数を折れ線グラフで出力する
 
     :param df: 集計対象のDataFrame
     :param search_word: タイトルに表示する検索ワード
     :param timezone: timezoneオブジェクト
+    :param aggregates: dfの集計済みの結果、指定した場合はdfを集計し直さない
     """
-    _df = make_tweet_user_weekday_max_hour_df(df)
-    _df = make_count_tweeted_weekday_df(_df, timezone=timezone)
+    if aggregates is None:
+        _df = make_tweet_user_weekday_max_hour_df(df)
+        _df = make_count_tweeted_weekday_df(_df, timezone=timezone)
+    else:
+        _df = aggregates.make_user_count_df(
+            labels=make_tweeted_weekday_range(timezone=timezone)
+        )
     _total_count = _df.sum()["count"]
     fig = plot_line(
         _df,
@@ -48,20 +95,49 @@ def make_daily_tweet_users_graph(df: pandas.DataFrame, search_word: str, timezon
         y_col="count",
         y_label="ツイート人数",
         title=make_title(
-            df, main_title="日別ツイート人数", count=_total_count, search_word=search_word
+            df,
+            # 人数は重複を除くため推定値に拡大できない、サンプリング取得した場合は抽出分の人数を表示する
+            main_title="日別ツイート人数" + ("（抽出分）" if is_sampled(df) else ""),
+            count=_total_count,
+            search_word=search_word,
+            users_count=_count_users(aggregates),
         ),
     )
     return fig
 
 
-def make_hourly_tweets_graph(df: pandas.DataFrame, search_word: str, timezone):
+@timed("make_hourly_tweets_graph")
+def make_hourly_tweets_graph(
+    df: pandas.DataFrame,
+    search_word: str,
+    timezone,
+    aggregates: TweetAggregates = None,
+):
     """時間別のツイート数を折れ線グラフで出力する
 
     :param df: 集計対象のDataFrame
     :param search_word: タイトルに表示する検索ワード
     :param timezone: timezoneオブジェクト
+    :param aggregates: dfの集計済みの結果、指定した場合はdfを集計し直さない
     """
-    _df = make_count_tweeted_df(df, timezone=timezone, group_col="tweeted_wh")
+    if is_sampled(df):
+        fig = _plot_estimated_count(
+            df,
+            group_col="tweeted_wh",
+            labels=make_tweeted_weekday_hour_label_range(timezone=timezone),
+            x_label="ツイート時間",
+            main_title="時間別ツイート数",
+            search_word=search_word,
+        )
+        fig.update_xaxes(tickangle=-90)
+        return fig
+    if aggregates is None:
+        _df = make_count_tweeted_df(df, timezone=timezone, group_col="tweeted_wh")
+    else:
+        _df = aggregates.make_count_df(
+            "tweeted_wh",
+            labels=make_tweeted_weekday_hour_label_range(timezone=timezone),
+        )
     _total_count = _df.sum()["count"]
     fig = plot_line(
         _df,
@@ -70,15 +146,197 @@ def make_hourly_tweets_graph(df: pandas.DataFrame, search_word: str, timezone):
         y_col="count",
         y_label="ツイート数",
         title=make_title(
-            df, main_title="時間別ツイート数", count=_total_count, search_word=search_word
+            df,
+            main_title="時間別ツイート数",
+            count=_total_count,
+            search_word=search_word,
+            users_count=_count_users(aggregates),
         ),
     )
     fig.update_xaxes(tickangle=-90)
     return fig
 
 
+@timed("make_daily_engagement_graph")
+def make_daily_engagement_graph(
+    df: pandas.DataFrame,
+    search_word: str,
+    timezone,
+    col: str = "favorite_sum",
+    aggregates: TweetAggregates = None,
+):
+    """日付別のエンゲージメントを折れ線グラフで出力する
+
+    :param df: 集計対象のDataFrame
+    :param search_word: タイトルに表示する検索ワード
+    :param timezone: timezoneオブジェクト
+    :param col: 描画するエンゲージメントの集計項目（favorite_sum, retweet_p95など）
+    :param aggregates: dfの集計済みの結果、指定した場合はdfを集計し直さない
+    """
+    _labels = make_tweeted_weekday_range(timezone=timezone)
+    # サンプリング取得した場合、最大・95パーセンタイルは件数に比例しないため抽出分から求める
+    if is_sampled(df) and col.endswith("_sum"):
+        return _plot_estimated_count(
+            df,
+            group_col="tweeted_weekday",
+            labels=_labels,
+            x_label="ツイート日付",
+            main_title=f"日別{ENGAGEMENT_LABELS[col]}",
+            search_word=search_word,
+            value_col=col.replace("_sum", "_count"),
+            name=col,
+            y_label=ENGAGEMENT_LABELS[col],
+        )
+    if aggregates is None:
+        _df = make_engagement_df(df, group_col="tweeted_weekday", labels=_labels)
+    else:
+        _df = aggregates.make_engagement_df("tweeted_weekday", labels=_labels)
+    fig = plot_line(
+        _df,
+        x_col="tweeted_weekday",
+        x_label="ツイート日付",
+        y_col=col,
+        y_label=ENGAGEMENT_LABELS[col],
+        title=make_title(
+            df,
+            main_title=f"日別{ENGAGEMENT_LABELS[col]}",
+            count=_sum_engagement(df, col=col, aggregates=aggregates),
+            search_word=search_word,
+            users_count=_count_users(aggregates),
+        ),
+    )
+    return fig
+
+
+@timed("make_hourly_engagement_graph")
+def make_hourly_engagement_graph(
+    df: pandas.DataFrame,
+    search_word: str,
+    timezone,
+    col: str = "favorite_sum",
+    aggregates: TweetAggregates = None,
+):
+    """時間別のエンゲージメントを折れ線グラフで出力する
+
+    :param df: 集計対象のDataFrame
+    :param search_word: タイトルに表示する検索ワード
+    :param timezone: timezoneオブジェクト
+    :param col: 描画するエンゲージメントの集計項目（favorite_sum, retweet_p95など）
+    :param aggregates: dfの集計済みの結果、指定した場合はdfを集計し直さない
+    """
+    _labels = make_tweeted_weekday_hour_label_range(timezone=timezone)
+    # サンプリング取得した場合、最大・95パーセンタイルは件数に比例しないため抽出分から求める
+    if is_sampled(df) and col.endswith("_sum"):
+        fig = _plot_estimated_count(
+            df,
+            group_col="tweeted_wh",
+            labels=_labels,
+            x_label="ツイート時間",
+            main_title=f"時間別{ENGAGEMENT_LABELS[col]}",
+            search_word=search_word,
+            value_col=col.replace("_sum", "_count"),
+            name=col,
+            y_label=ENGAGEMENT_LABELS[col],
+        )
+        fig.update_xaxes(tickangle=-90)
+        return fig
+    if aggregates is None:
+        _df = make_engagement_df(df, group_col="tweeted_wh", labels=_labels)
+    else:
+        _df = aggregates.make_engagement_df("tweeted_wh", labels=_labels)
+    fig = plot_line(
+        _df,
+        x_col="tweeted_wh",
+        x_label="ツイート時間",
+        y_col=col,
+        y_label=ENGAGEMENT_LABELS[col],
+        title=make_title(
+            df,
+            main_title=f"時間別{ENGAGEMENT_LABELS[col]}",
+            count=_sum_engagement(df, col=col, aggregates=aggregates),
+            search_word=search_word,
+            users_count=_count_users(aggregates),
+        ),
+    )
+    fig.update_xaxes(tickangle=-90)
+    return fig
+
+
+@timed("make_followers_count_graph")
+def make_followers_count_graph(df: pandas.DataFrame, account: str):
+    """アカウントのフォロワー（フォロー中ユーザ）のフォロワー数の分布を折れ線グラフで出力する
+
+    :param df: プロフィールのDataFrame（hydration.hydrate_usersの戻り値）
+    :param account: タイトルに表示するアカウント名
+    """
+    _df = make_followers_count_bucket_df(df)
+    return plot_line(
+        _df,
+        x_col="followers_bucket",
+        x_label="フォロワー数",
+        y_col="count",
+        y_label="ユーザ数",
+        title=f"フォロワー数の分布 【アカウント:{account}】 【ユーザ数: {'{:,}'.format(len(df))}名】",
+    )
+
+
+def _plot_estimated_count(
+    df: pandas.DataFrame,
+    group_col: str,
+    labels,
+    x_label: str,
+    main_title: str,
+    search_word: str,
+    value_col: str = None,
+    name: str = "count",
+    y_label: str = "ツイート数",
+):
+    # サンプリング取得したツイートは、重み付きの推定値を95%信頼区間のエラーバー付きで描画する
+    _df = make_estimated_df(
+        df, group_col=group_col, labels=labels, value_col=value_col, name=name
+    )
+    _total, _error = estimate_total(df, value_col=value_col)
+    return plot_line(
+        _df,
+        x_col=group_col,
+        x_label=x_label,
+        y_col=name,
+        y_label=y_label,
+        title=make_title(
+            df,
+            main_title=f"{main_title}（推定）",
+            count=_total,
+            search_word=search_word,
+            count_error=_error,
+        ),
+        error_y_col=f"{name}_error",
+    )
+
+
+def _count_users(aggregates: TweetAggregates = None):
+    return aggregates.count_users() if aggregates is not None else None
+
+
+def _sum_engagement(
+    df: pandas.DataFrame, col: str, aggregates: TweetAggregates = None
+) -> int:
+    # favorite_max, retweet_p95なども、タイトルには合計（favorite_sum, retweet_sum）を表示する
+    name = col.split("_")[0]
+    if is_sampled(df):
+        return estimate_total(df, value_col=f"{name}_count")[0]
+    if aggregates is not None:
+        return aggregates.sum(f"{name}_sum")
+    return df[f"{name}_count"].sum()
+
+
 def plot_line(
-    df: pandas.DataFrame, x_col: str, y_col: str, x_label: str, y_label: str, title: str
+    df: pandas.DataFrame,
+    x_col: str,
+    y_col: str,
+    x_label: str,
+    y_label: str,
+    title: str,
+    error_y_col: str = None,
 ):
     """折れ線グラフを描画する
 
@@ -88,12 +346,14 @@ def plot_line(
     :param y_col: y軸に使用するDataFrameカラム名
     :param y_label: グラフのy軸に表示するラベル
     :param title: グラフに表示するタイトル
+    :param error_y_col: エラーバー（信頼区間の幅）に使用するDataFrameカラム名
     :return グラフオブジェクト
     """
     return plotly.express.line(
         df,
         x=x_col,
         y=y_col,
+        error_y=error_y_col,
         title=title,
         labels={
             y_col: y_label,
@@ -0,0 +1,247 @@
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy
+import pandas
+import tweepy
+
+from .constants import API_COUNTS, API_URLS, PROFILE_CACHE_TTL, USERS_LOOKUP_API_PATH
+from .errors import NotFoundError, RateLimitError
+from .limits import get_rate_limit
+from .loggers import ProgressReporter, get_logger
+from .metrics import increment, measure, timed
+from .transports import get_transport
+from .twitters import execute_get_method
+
+logger = get_logger(__name__, loglevel=logging.INFO)
+
+# users/lookupから取得するプロフィールの項目（ユーザテーブルと同じカラム名にそろえる）
+PROFILE_COLS = [
+    "user_id",
+    "user_screen_name",
+    "user_name",
+    "user_profile_image_url",
+    "followers_count",
+    "friends_count",
+    "statuses_count",
+    "protected",
+    "verified",
+    "user_created_at",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id INTEGER PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    found INTEGER NOT NULL,
+    user_screen_name TEXT,
+    user_name TEXT,
+    user_profile_image_url TEXT,
+    followers_count INTEGER,
+    friends_count INTEGER,
+    statuses_count INTEGER,
+    protected INTEGER,
+    verified INTEGER,
+    user_created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS profiles_fetched_at ON profiles (fetched_at);
+"""
+
+
+class ProfileCache:
+    """users/lookupで取得したプロフィールを保持するキャッシュ（sqlite3）
+
+    取得から有効期限（ttl秒）が過ぎたプロフィールは再取得の対象とし、evictで削除する。
+    凍結・削除などで取得できなかったユーザも、有効期限までは再取得しないよう記録する。
+
+    :param path: キャッシュファイル、未指定の場合はメモリ上に作成する
+    :param ttl: 有効期限（秒）
+    """
+
+    def __init__(self, path: str = ":memory:", ttl: int = PROFILE_CACHE_TTL):
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+        self.evict()
+
+    def close(self):
+        self._conn.close()
+
+    @timed("profile_cache_get")
+    def get(self, user_ids: numpy.ndarray) -> Tuple[pandas.DataFrame, numpy.ndarray]:
+        """有効期限内のプロフィールと、取得が必要なユーザIDに分ける
+
+        :param user_ids: 重複のないユーザIDの配列
+        :return (キャッシュ済みのプロフィール, 未取得・期限切れのユーザID)
+        """
+        with self._conn:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_ids (user_id)")
+            self._conn.execute("DELETE FROM lookup_ids")
+            self._conn.executemany(
+                "INSERT INTO lookup_ids VALUES (?)", ((i,) for i in user_ids.tolist())
+            )
+            cached = pandas.read_sql_query(
+                f"SELECT p.found, p.{', p.'.join(PROFILE_COLS)} "
+                "FROM lookup_ids l JOIN profiles p ON p.user_id = l.user_id "
+                "WHERE p.fetched_at >= ?",
+                self._conn,
+                params=[time.time() - self.ttl],
+            )
+        hit_ids = cached["user_id"].to_numpy(dtype=numpy.int64)
+        increment("profile_cache_hits", len(hit_ids))
+        profiles = cached[cached["found"] == 1][PROFILE_COLS]
+        return profiles, numpy.setdiff1d(user_ids, hit_ids)
+
+    def put(self, profiles: List[Dict], missing_ids: numpy.ndarray = ()):
+        """取得したプロフィールと、取得できなかったユーザIDを記録する
+
+        :param profiles: _to_profileで変換したプロフィールのリスト
+        :param missing_ids: 指定したが返却されなかったユーザID
+        """
+        fetched_at = time.time()
+        cols = ["user_id", "fetched_at", "found", *PROFILE_COLS[1:]]
+        rows = [
+            (p["user_id"], fetched_at, 1, *(p[c] for c in PROFILE_COLS[1:]))
+            for p in profiles
+        ]
+        rows += [
+            (int(i), fetched_at, 0, *([None] * (len(PROFILE_COLS) - 1)))
+            for i in missing_ids
+        ]
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO profiles ({', '.join(cols)}) "
+                f"VALUES ({', '.join('?' * len(cols))})",
+                rows,
+            )
+
+    def evict(self) -> int:
+        """有効期限が過ぎたプロフィールを削除する
+
+        :return 削除した件数
+        """
+        with self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM profiles WHERE fetched_at < ?", [time.time() - self.ttl]
+            )
+        return cursor.rowcount
+
+
+@timed("hydrate_users")
+def hydrate_users(
+    api: tweepy.API,
+    user_ids,
+    cache: ProfileCache = None,
+    max_requests: int = None,
+) -> pandas.DataFrame:
+    """ユーザIDの配列からプロフィールを取得する（users/lookupを100件ずつ）
+
+    キャッシュを指定した場合は、有効期限内のプロフィールがあるユーザは取得しない。
+    リクエスト上限に達した場合はリセットまで待機する。
+
+    :param api: tweepy.API
+    :param user_ids: ユーザIDの配列（get_follower_idsの戻り値など）
+    :param cache: プロフィールのキャッシュ
+    :param max_requests: リクエスト数の上限、超える分のユーザは取得しない
+    :return PROFILE_COLSのDataFrame（凍結・削除などで取得できなかったユーザは含まない）
+    """
+    user_ids = numpy.unique(numpy.asarray(user_ids, dtype=numpy.int64))
+    if cache is not None:
+        cached, user_ids = cache.get(user_ids)
+    else:
+        cached = pandas.DataFrame(columns=PROFILE_COLS)
+
+    count = API_COUNTS[USERS_LOOKUP_API_PATH]
+    batches = [user_ids[i : i + count] for i in range(0, len(user_ids), count)]
+    if max_requests is not None and len(batches) > max_requests:
+        logger.info(
+            f"リクエスト数の上限のため {'{:,}'.format(len(user_ids) - max_requests * count)} "
+            "件は取得しません"
+        )
+        batches = batches[:max_requests]
+
+    profiles = []
+    progress = ProgressReporter(
+        logger, label=USERS_LOOKUP_API_PATH, total=sum(len(b) for b in batches)
+    )
+    rate_limit = None
+    i = 0
+    while i < len(batches):
+        # 残り回数は取得後に手元で数え、使い切った場合だけ問い合わせ直す
+        if rate_limit is None or rate_limit["remaining"] == 0:
+            with measure("rate_limit_check"):
+                rate_limit = get_rate_limit(api, api_path=USERS_LOOKUP_API_PATH)
+            if rate_limit["remaining"] == 0:
+                reset_time = rate_limit["reset"] - int(time.time())
+                logger.info(f"アクセス上限のため処理休止中({reset_time}秒)..")
+                get_transport().sleep(reset_time)
+                rate_limit = None
+                continue
+
+        batch = batches[i]
+        try:
+            users = _lookup_users(api, batch)
+        except RateLimitError:
+            logger.info("アクセス上限のため処理休止中(15分)..")
+            increment("users_lookup_retries")
+            get_transport().sleep(15 * 60)
+            rate_limit = None
+            continue
+
+        rate_limit["remaining"] -= 1
+        _profiles = [_to_profile(u) for u in users]
+        if cache is not None:
+            found = numpy.array([p["user_id"] for p in _profiles], dtype=numpy.int64)
+            cache.put(_profiles, missing_ids=numpy.setdiff1d(batch, found))
+        profiles.extend(_profiles)
+        increment("users_lookup_pages")
+        increment("users_lookup", len(_profiles))
+        progress.update(
+            len(batch), remaining=rate_limit["remaining"], reset_at=rate_limit["reset"]
+        )
+        i += 1
+        if i < len(batches):
+            get_transport().sleep(1)
+
+    logger.info(
+        f"{'{:,}'.format(len(profiles))} 件取得（キャッシュ {'{:,}'.format(len(cached))} 件）"
+    )
+    fetched = pandas.DataFrame(profiles, columns=PROFILE_COLS)
+    _df = pandas.concat([cached, fetched], ignore_index=True)
+    _df = _df.astype({c: numpy.int64 for c in PROFILE_COLS if c.endswith("_count")})
+    _df = _df.astype({"user_id": numpy.int64, "protected": bool, "verified": bool})
+    _df["user_created_at"] = pandas.to_datetime(_df["user_created_at"], utc=True)
+    return _df.sort_values("user_id").reset_index(drop=True)
+
+
+def _lookup_users(api: tweepy.API, user_ids: numpy.ndarray) -> List[Dict]:
+    params = {
+        "user_id": ",".join(str(i) for i in user_ids.tolist()),
+        "include_entities": "false",
+    }
+    try:
+        return execute_get_method(
+            url=API_URLS[USERS_LOOKUP_API_PATH], params=params, oauth=api.auth.oauth
+        )
+    except NotFoundError:
+        # 指定したユーザが全員凍結・削除されている場合は404が返る
+        return []
+
+
+def _to_profile(user: Dict) -> Dict:
+    created_at = datetime.strptime(user["created_at"], "%a %b %d %H:%M:%S %z %Y")
+    return {
+        "user_id": user["id"],
+        "user_screen_name": user["screen_name"],
+        "user_name": user["name"],
+        "user_profile_image_url": user["profile_image_url_https"],
+        "followers_count": user["followers_count"],
+        "friends_count": user["friends_count"],
+        "statuses_count": user["statuses_count"],
+        "protected": user["protected"],
+        "verified": user["verified"],
+        "user_created_at": created_at.isoformat(),
+    }
@@ -0,0 +1,61 @@
+import re
+
+import numpy
+
+_IDS_KEY = b'"ids"'
+_NEXT_CURSOR_PATTERN = re.compile(rb'"next_cursor"\s*:\s*(-?\d+)')
+
+
+class IdBuffer:
+    """ユーザIDを格納する伸長可能なint64配列
+
+    IDごとにPythonのintオブジェクトを作らずに、連続したメモリ領域へ追記する。
+
+    :param capacity: 初期確保する件数
+    """
+
+    def __init__(self, capacity: int = 5000):
+        self._data = numpy.empty(max(capacity, 1), dtype=numpy.int64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, ids: numpy.ndarray):
+        end = self._size + len(ids)
+        if end > len(self._data):
+            # 追記のたびに確保し直さないよう、容量は倍々で増やす
+            data = numpy.empty(max(end, len(self._data) * 2), dtype=numpy.int64)
+            data[: self._size] = self._data[: self._size]
+            self._data = data
+        self._data[self._size : end] = ids
+        self._size = end
+
+    def to_array(self) -> numpy.ndarray:
+        """格納済みのIDを取得する（余分に確保した領域は解放する）
+
+        コピーを作らずに縮小するため、以降このバッファには追記しないこと。
+        """
+        self._data.resize(self._size, refcheck=False)
+        return self._data
+
+
+def parse_id_page(content: bytes, buffer: IdBuffer):
+    """/followers/ids, /friends/idsのレスポンスからIDを直接バッファに追記する
+
+    JSON全体をPythonオブジェクトに変換せず、ids配列の範囲だけを数値配列として読み取る。
+
+    :param content: レスポンスボディ（bytes）
+    :param buffer: 追記先のバッファ
+    :return (このページのID件数, next_cursor)
+    """
+    start = content.index(b"[", content.index(_IDS_KEY)) + 1
+    end = content.index(b"]", start)
+    if content[start:end].strip():
+        ids = numpy.fromstring(content[start:end], dtype=numpy.int64, sep=",")
+    else:
+        ids = numpy.empty(0, dtype=numpy.int64)
+    buffer.extend(ids)
+
+    matched = _NEXT_CURSOR_PATTERN.search(content)
+    return len(ids), int(matched.group(1)) if matched else 0
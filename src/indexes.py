@@ -0,0 +1,258 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+import numpy
+import pandas
+
+from .metrics import timed
+
+_URL_PATTERN = re.compile(r"https?://\S+")
+_WORD_PATTERN = re.compile(r"\w+")
+_ASCII_WORD_PATTERN = re.compile(r"[0-9a-z_]+")
+_NON_ASCII_WORD_PATTERN = re.compile(r"[^0-9a-z_]+")
+
+HASHTAG_PREFIX = "#"
+MENTION_PREFIX = "@"
+
+
+def tokenize(text: str) -> List[str]:
+    """本文をインデックス用のトークンに分割する
+
+    英数字は単語単位、日本語などの分かち書きされない文字列は2文字単位（bi-gram）で分割する。
+    日本語に続けて書かれた英数字（「pythonを勉強中」のpython）は単語として追加し、bi-gramには含めない。
+    URLはノイズになるため除外する。
+
+    :param text: ツイート本文
+    :return トークンのリスト（重複あり）
+    """
+    tokens = []
+    for word in _WORD_PATTERN.findall(_URL_PATTERN.sub(" ", text.lower())):
+        if word.isascii():
+            tokens.append(word)
+            continue
+        for part in _NON_ASCII_WORD_PATTERN.findall(word):
+            if len(part) <= 2:
+                tokens.append(part)
+            else:
+                tokens.extend(part[i : i + 2] for i in range(len(part) - 1))
+        tokens.extend(_ASCII_WORD_PATTERN.findall(word))
+    return tokens
+
+
+def _gather(offsets: numpy.ndarray, values: numpy.ndarray, rows: numpy.ndarray):
+    """CSR形式の配列から指定行の値をまとめて取り出す
+
+    :param offsets: 各行の開始位置（行数+1の長さ）
+    :param values: 値の配列
+    :param rows: 取り出す行番号の配列
+    :return 指定行の値を連結した配列
+    """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return values[:0]
+    shifts = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+    return values[shifts + numpy.arange(total)]
+
+
+class TweetIndex:
+    """ツイートの本文・ハッシュタグ・メンションの転置インデックス
+
+    トークン→行番号の転置インデックスと、行番号→ハッシュタグの正引きインデックスを
+    どちらもCSR形式（開始位置配列＋値配列）で保持する。
+    行番号は構築に使用したDataFrameの先頭からの位置。
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        term_offsets: numpy.ndarray,
+        postings: numpy.ndarray,
+        hashtag_offsets: numpy.ndarray,
+        hashtag_ids: numpy.ndarray,
+    ):
+        self._vocabulary = vocabulary
+        self._terms = numpy.array(list(vocabulary), dtype=object)
+        self._term_offsets = term_offsets
+        self._postings = postings
+        self._hashtag_offsets = hashtag_offsets
+        self._hashtag_ids = hashtag_ids
+        self._char_terms = None
+
+    @classmethod
+    @timed("build_tweet_index")
+    def from_df(cls, df: pandas.DataFrame) -> "TweetIndex":
+        """ツイートのDataFrameからインデックスを構築する
+
+        :param df: full_text, hashtags, mention_screen_namesカラムを持つDataFrame
+        :return 構築したインデックス
+        """
+        vocabulary = {}
+        term_ids = []
+        row_ids = []
+        hashtag_ids = []
+        hashtag_counts = numpy.zeros(len(df), dtype=numpy.int64)
+
+        columns = zip(df["full_text"], df["hashtags"], df["mention_screen_names"])
+        for row, (text, hashtags, mentions) in enumerate(columns):
+            terms = set(tokenize(text or ""))
+            tags = {HASHTAG_PREFIX + h for h in hashtags}
+            terms.update(tags)
+            terms.update(MENTION_PREFIX + m for m in mentions)
+            for term in terms:
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            row_ids.extend([row] * len(terms))
+            hashtag_ids.extend(vocabulary[t] for t in tags)
+            hashtag_counts[row] = len(tags)
+
+        term_ids = numpy.array(term_ids, dtype=numpy.int32)
+        row_ids = numpy.array(row_ids, dtype=numpy.int32)
+
+        # 行番号昇順に追加しているため、安定ソートでトークン内の行番号も昇順に保たれる
+        order = numpy.argsort(term_ids, kind="stable")
+        term_offsets = numpy.zeros(len(vocabulary) + 1, dtype=numpy.int64)
+        numpy.cumsum(
+            numpy.bincount(term_ids, minlength=len(vocabulary)), out=term_offsets[1:]
+        )
+        hashtag_offsets = numpy.zeros(len(df) + 1, dtype=numpy.int64)
+        numpy.cumsum(hashtag_counts, out=hashtag_offsets[1:])
+
+        return cls(
+            vocabulary=vocabulary,
+            term_offsets=term_offsets,
+            postings=row_ids[order],
+            hashtag_offsets=hashtag_offsets,
+            hashtag_ids=numpy.array(hashtag_ids, dtype=numpy.int32),
+        )
+
+    def __len__(self):
+        return len(self._hashtag_offsets) - 1
+
+    def lookup(self, term: str) -> numpy.ndarray:
+        """トークンを含む行番号を取得する
+
+        :param term: トークン（ハッシュタグは#、メンションは@から始める）
+        :return 行番号の配列（昇順）
+        """
+        term_id = self._vocabulary.get(term.lower())
+        if term_id is None:
+            return self._postings[:0]
+        return self._postings[
+            self._term_offsets[term_id] : self._term_offsets[term_id + 1]
+        ]
+
+    def search(self, query: str) -> numpy.ndarray:
+        """サブクエリに一致する行番号を取得する
+
+        空白区切りの語はAND条件、-から始まる語は除外条件として扱う。
+        #から始まる語はハッシュタグ、@から始まる語はメンションに一致する。
+
+        :param query: サブクエリ
+        :return 行番号の配列（昇順）
+        """
+        rows = None
+        excluded = []
+        for word in query.split():
+            negative = word.startswith("-")
+            word_rows = self._search_word(word.lstrip("-"))
+            if word_rows is None:
+                continue
+            if negative:
+                excluded.append(word_rows)
+            else:
+                rows = (
+                    word_rows
+                    if rows is None
+                    else numpy.intersect1d(rows, word_rows, True)
+                )
+
+        if rows is None:
+            rows = numpy.arange(len(self), dtype=numpy.int32)
+        for r in excluded:
+            rows = numpy.setdiff1d(rows, r, True)
+        return rows
+
+    def _search_word(self, word: str):
+        """語に一致する行番号を取得する（語がトークンを含まない場合はNone）
+
+        語を分割したトークンをすべて含む行を一致とする（除外条件でも同じ）。
+        日本語などの1文字の語は、その文字を含むトークン（bi-gram）のいずれかを含む行を一致とする。
+        """
+        if word[:1] in (HASHTAG_PREFIX, MENTION_PREFIX):
+            return self.lookup(word)
+        tokens = tokenize(word)
+        if not tokens:
+            return None
+        if len(tokens) == 1 and len(tokens[0]) == 1 and not tokens[0].isascii():
+            return self._lookup_char(tokens[0])
+        rows = self.lookup(tokens[0])
+        for t in tokens[1:]:
+            rows = numpy.intersect1d(rows, self.lookup(t), True)
+        return rows
+
+    def _lookup_char(self, char: str) -> numpy.ndarray:
+        # 文字→その文字を含むトークンの対応は初回利用時に作成する
+        if self._char_terms is None:
+            char_terms = {}
+            for term, term_id in self._vocabulary.items():
+                prefixed = term[:1] in (HASHTAG_PREFIX, MENTION_PREFIX)
+                if len(term) > 2 or term.isascii() or prefixed:
+                    continue
+                for c in set(term):
+                    char_terms.setdefault(c, []).append(term_id)
+            self._char_terms = char_terms
+        term_ids = numpy.array(
+            self._char_terms.get(char.lower(), []), dtype=numpy.int64
+        )
+        rows = _gather(self._term_offsets, self._postings, term_ids)
+        return numpy.unique(rows)
+
+    def count_hashtags(self, rows: Iterable[int] = None, top: int = 10) -> List[Tuple]:
+        """ハッシュタグの出現数を集計する
+
+        :param rows: 集計対象の行番号、未指定の場合は全行
+        :param top: 上位から取得する件数
+        :return (ハッシュタグ, 出現数)のリスト
+        """
+        if rows is None:
+            ids = self._hashtag_ids
+        else:
+            ids = _gather(self._hashtag_offsets, self._hashtag_ids, numpy.asarray(rows))
+        return self._top_terms(ids, top=top)
+
+    def count_co_hashtags(
+        self, hashtag: str, rows: Iterable[int] = None, top: int = 10
+    ) -> List[Tuple]:
+        """指定ハッシュタグと同時に使われたハッシュタグを集計する
+
+        :param hashtag: 基準とするハッシュタグ（#は省略可）
+        :param rows: 集計対象の行番号、未指定の場合は全行
+        :param top: 上位から取得する件数
+        :return (ハッシュタグ, 共起数)のリスト
+        """
+        term = HASHTAG_PREFIX + hashtag.lstrip(HASHTAG_PREFIX).lower()
+        tag_rows = self.lookup(term)
+        if rows is not None:
+            tag_rows = numpy.intersect1d(tag_rows, numpy.asarray(rows))
+        ids = _gather(self._hashtag_offsets, self._hashtag_ids, tag_rows)
+        ids = ids[ids != self._vocabulary.get(term, -1)]
+        return self._top_terms(ids, top=top)
+
+    def _top_terms(self, ids: numpy.ndarray, top: int) -> List[Tuple]:
+        counts = numpy.bincount(ids, minlength=len(self._terms))
+        top_ids = numpy.argsort(-counts, kind="stable")[:top]
+        top_ids = top_ids[counts[top_ids] > 0]
+        return [(self._terms[i], int(counts[i])) for i in top_ids]
+
+    def memory_usage(self) -> int:
+        """インデックス配列の使用メモリ（バイト）を取得する"""
+        return sum(
+            a.nbytes
+            for a in (
+                self._term_offsets,
+                self._postings,
+                self._hashtag_offsets,
+                self._hashtag_ids,
+            )
+        )
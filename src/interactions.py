@@ -0,0 +1,220 @@
+from dataclasses import dataclass
+from itertools import chain
+from typing import Iterable
+
+import numpy
+import pandas
+
+from .metrics import timed
+from .processors import make_user_df
+
+RETWEET = "retweet"
+REPLY = "reply"
+QUOTE = "quote"
+MENTION = "mention"
+INTERACTION_KINDS = (RETWEET, REPLY, QUOTE, MENTION)
+
+_KIND_COLUMNS = {
+    RETWEET: "retweeted_user_id",
+    REPLY: "in_reply_to_user_id",
+    QUOTE: "quoted_user_id",
+}
+
+
+@dataclass
+class InteractionGraph:
+    """ユーザ間のやり取り（リツイート・返信・引用・メンション）の有向グラフ
+
+    ツイートしたユーザ→拡散・言及されたユーザの向きの辺をCSR形式で保持する。
+    ノード番号はuser_idsの添字。同じ向きの辺は重み（回数）としてまとめる。
+    """
+
+    user_ids: numpy.ndarray
+    indptr: numpy.ndarray
+    indices: numpy.ndarray
+    weights: numpy.ndarray
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    def sources(self) -> numpy.ndarray:
+        """辺ごとの始点ノード番号（CSRの行番号を展開したもの）"""
+        return numpy.repeat(
+            numpy.arange(self.n_nodes, dtype=self.indices.dtype),
+            numpy.diff(self.indptr),
+        )
+
+
+@timed("build_interaction_graph")
+def build_interaction_graph(
+    df: pandas.DataFrame, kinds: Iterable[str] = INTERACTION_KINDS
+) -> InteractionGraph:
+    """ツイートのDataFrameからやり取りのグラフを構築する
+
+    リツイートのメンションはリツイート元の投稿者によるものなので対象外とする。
+    自分自身への辺は除外する。
+
+    :param df: 対象のDataFrame
+    :param kinds: 対象とするやり取りの種類
+    :return 構築したグラフ
+    """
+    user_ids = df["user_id"].to_numpy(dtype=numpy.int64)
+    sources = []
+    targets = []
+    for kind in kinds:
+        if kind == MENTION:
+            _df = df[df["retweeted_user_id"] == 0]
+            lengths = _df["mention_user_ids"].map(len).to_numpy()
+            sources.append(
+                numpy.repeat(_df["user_id"].to_numpy(dtype=numpy.int64), lengths)
+            )
+            targets.append(
+                numpy.fromiter(
+                    chain.from_iterable(_df["mention_user_ids"]),
+                    dtype=numpy.int64,
+                    count=int(lengths.sum()),
+                )
+            )
+        else:
+            _targets = df[_KIND_COLUMNS[kind]].to_numpy(dtype=numpy.int64)
+            mask = _targets != 0
+            sources.append(user_ids[mask])
+            targets.append(_targets[mask])
+
+    sources = numpy.concatenate(sources) if sources else user_ids[:0]
+    targets = numpy.concatenate(targets) if targets else user_ids[:0]
+    mask = sources != targets
+    sources, targets = sources[mask], targets[mask]
+
+    # ツイートしたユーザは辺がなくてもノードとして含める
+    nodes = numpy.unique(numpy.concatenate([user_ids, sources, targets]))
+    n_nodes = len(nodes)
+    src = numpy.searchsorted(nodes, sources)
+    dst = numpy.searchsorted(nodes, targets)
+
+    # 始点・終点の組でユニークにすることで、始点順に並んだ重み付きの辺になる
+    keys, weights = numpy.unique(src * n_nodes + dst, return_counts=True)
+    src = keys // n_nodes
+    indptr = numpy.zeros(n_nodes + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(src, minlength=n_nodes), out=indptr[1:])
+
+    return InteractionGraph(
+        user_ids=nodes,
+        indptr=indptr,
+        indices=(keys % n_nodes).astype(numpy.int32),
+        weights=weights.astype(numpy.float64),
+    )
+
+
+@timed("compute_pagerank")
+def compute_pagerank(
+    graph: InteractionGraph,
+    damping: float = 0.85,
+    tol: float = 1.0e-8,
+    max_iter: int = 100,
+) -> numpy.ndarray:
+    """PageRankで拡散・言及される影響度を計算する
+
+    辺のない（誰も拡散・言及していない）ノードのスコアは全ノードに均等に分配する。
+
+    :param graph: 対象のグラフ
+    :param damping: ダンピング係数
+    :param tol: 収束判定の閾値（前回との差の合計）
+    :param max_iter: 最大反復回数
+    :return ノードごとのスコア（合計1）
+    """
+    n = graph.n_nodes
+    if n == 0:
+        return numpy.zeros(0)
+
+    sources = graph.sources()
+    out_weights = numpy.bincount(sources, weights=graph.weights, minlength=n)
+    dangling = out_weights == 0
+    edge_weights = graph.weights / out_weights[sources]
+
+    rank = numpy.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        flow = numpy.bincount(
+            graph.indices, weights=rank[sources] * edge_weights, minlength=n
+        )
+        _rank = damping * (flow + rank[dangling].sum() / n) + (1.0 - damping) / n
+        converged = numpy.abs(_rank - rank).sum() < tol
+        rank = _rank
+        if converged:
+            break
+    return rank
+
+
+@timed("compute_components")
+def compute_components(graph: InteractionGraph) -> numpy.ndarray:
+    """弱連結成分を計算する
+
+    ラベル伝播とポインタジャンプを辺全体に対してまとめて適用し、
+    各ノードに成分内の最小ノード番号をラベルとして付与する。
+
+    :param graph: 対象のグラフ
+    :return ノードごとの成分ラベル
+    """
+    labels = numpy.arange(graph.n_nodes)
+    sources = graph.sources()
+    targets = graph.indices
+    while True:
+        _labels = labels.copy()
+        smaller = numpy.minimum(labels[sources], labels[targets])
+        numpy.minimum.at(labels, sources, smaller)
+        numpy.minimum.at(labels, targets, smaller)
+        while True:
+            jumped = labels[labels]
+            if numpy.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if numpy.array_equal(_labels, labels):
+            return labels
+
+
+def compute_interaction_stats(
+    df: pandas.DataFrame, kinds: Iterable[str] = INTERACTION_KINDS
+) -> pandas.DataFrame:
+    """ユーザごとのやり取りの指標を計算する
+
+    :param df: 対象のDataFrame
+    :param kinds: 対象とするやり取りの種類
+    :return user_id, amplified_count, amplify_count, influence, component_size のDataFrame
+    """
+    graph = build_interaction_graph(df, kinds=kinds)
+    components = compute_components(graph)
+    return pandas.DataFrame(
+        {
+            "user_id": graph.user_ids,
+            "amplified_count": numpy.bincount(
+                graph.indices, weights=graph.weights, minlength=graph.n_nodes
+            ).astype(numpy.int64),
+            "amplify_count": numpy.bincount(
+                graph.sources(), weights=graph.weights, minlength=graph.n_nodes
+            ).astype(numpy.int64),
+            "influence": compute_pagerank(graph),
+            "component_size": numpy.bincount(components)[components],
+        }
+    )
+
+
+def make_interaction_user_df(
+    df: pandas.DataFrame,
+    users: pandas.DataFrame = None,
+    kinds: Iterable[str] = INTERACTION_KINDS,
+) -> pandas.DataFrame:
+    """ユーザをユニークにしたDataFrameにやり取りの指標を付与する
+
+    :param df: 計算対象のDataFrame
+    :param users: ユーザテーブル、dfがツイートテーブルの場合に指定する
+    :param kinds: 対象とするやり取りの種類
+    :return 計算後のDataFrame
+    """
+    return make_user_df(df, users=users).merge(
+        compute_interaction_stats(df, kinds=kinds), on="user_id", how="left"
+    )
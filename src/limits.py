@@ -1,8 +1,11 @@
 import time
+from typing import Dict
 
 import tweepy
 
 from .constants import API_TYPES
+from .metrics import timed
+from .transports import get_transport
 
 
 def get_rate_limit_reset_time(api: tweepy.API, api_path: str) -> int:
@@ -27,6 +30,20 @@ def is_rate_limit(api: tweepy.API, api_path: str) -> bool:
     return rate_limit["remaining"] == 0
 
 
+def get_rate_limit(api: tweepy.API, api_path: str) -> Dict:
+    """APIの残り回数とリセット時刻をまとめて取得する
+
+    is_rate_limit, get_rate_limit_reset_timeを続けて呼び出すと2回問い合わせるため、
+    ページングのループ内ではこちらを使用する。
+
+    :param api: Tweepy.API
+    :param api_path: APIのパス
+    :return remaining（残り回数）, reset（リセット時刻のUNIX時間）を含む辞書
+    """
+    return _get_api_rate_limit(api, api_path)
+
+
+@timed("rate_limit_status")
 def _get_api_rate_limit(api: tweepy.API, api_path) -> int:
     """リミット情報を取得する
 
@@ -35,4 +52,4 @@ def _get_api_rate_limit(api: tweepy.API, api_path) -> int:
     :return 検索APIの制約解除秒数
     """
     api_type = API_TYPES[api_path]
-    return api.rate_limit_status()["resources"][api_type][api_path]
+    return get_transport().rate_limit_status(api)["resources"][api_type][api_path]
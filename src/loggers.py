@@ -1,28 +1,50 @@
+import atexit
 import logging
+import queue
+import time
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 
 from pytz import timezone
 
 logging.basicConfig(level=logging.WARNING)
 _timezone = timezone("UTC")
 
+# UTC時刻（1時間単位）ごとのタイムゾーンのオフセット秒数のキャッシュ
+_utc_offset_cache = (None, 0.0)
+
+# 全ロガーで共有するハンドラ、コンソール出力は別スレッドで行い収集処理を待たせない
+_queue = queue.SimpleQueue()
+_queue_handler = QueueHandler(_queue)
+_listener = None
+
 
 def set_logger_timezone(tz: str):
-    global _timezone
+    global _timezone, _utc_offset_cache
     _timezone = timezone(tz)
+    _utc_offset_cache = (None, 0.0)
 
 
-def _convert_datetime(*args):
-    return datetime.now(_timezone).timetuple()
+def _convert_datetime(secs: float):
+    """ログの出力時刻を指定タイムゾーンに変換する
 
+    オフセットの切り替わり（夏時間）は正時に起きるため、1時間単位でオフセットを使い回す。
 
-def get_logger(name, loglevel):
-    logger = logging.getLogger(name)
+    :param secs: ログレコードの作成時刻（UNIX時間）
+    :return time.struct_time
+    """
+    global _utc_offset_cache
+    hour = int(secs // 3600)
+    if _utc_offset_cache[0] != hour:
+        offset = datetime.fromtimestamp(hour * 3600, _timezone).utcoffset()
+        _utc_offset_cache = (hour, offset.total_seconds())
+    return time.gmtime(secs + _utc_offset_cache[1])
 
-    # ログが複数回表示されるのを防止
-    logger.propagate = False
 
-    logger.setLevel(loglevel)
+def _start_listener():
+    global _listener
+    if _listener is not None:
+        return
 
     handler = logging.StreamHandler()
     formatter = logging.Formatter(
@@ -30,7 +52,89 @@ def get_logger(name, loglevel):
     )
     formatter.converter = _convert_datetime
     handler.setFormatter(formatter)
-    handler.setLevel(loglevel)
-    logger.addHandler(handler)
+    _listener = QueueListener(_queue, handler, respect_handler_level=True)
+    _listener.start()
+    # 終了時に未出力のログを出し切る
+    atexit.register(_listener.stop)
+
+
+def get_logger(name, loglevel):
+    logger = logging.getLogger(name)
+
+    # ログが複数回表示されるのを防止
+    logger.propagate = False
+
+    logger.setLevel(loglevel)
+
+    _start_listener()
+    if _queue_handler not in logger.handlers:
+        logger.addHandler(_queue_handler)
 
     return logger
+
+
+class ProgressReporter:
+    """長時間の収集処理の進捗を一定間隔でログ出力するクラス
+
+    ページごとにupdateを呼び出しても、ログ出力はinterval秒に1回に間引く。
+
+    :param logger: 出力先のロガー
+    :param label: ログに表示する処理名
+    :param total: 取得予定の件数（分かる場合のみ、完了までの残り時間を表示する）
+    :param interval: ログ出力の最小間隔（秒）
+    """
+
+    def __init__(self, logger, label: str, total: int = None, interval: float = 10.0):
+        self._logger = logger
+        self._label = label
+        self._total = total
+        self._interval = interval
+        self._start = time.monotonic()
+        self._last_report = self._start
+        self.pages = 0
+        self.items = 0
+
+    def update(
+        self, items: int, pages: int = 1, remaining: int = None, reset_at: int = None
+    ):
+        """進捗を加算し、前回の出力からinterval秒経過していればログ出力する
+
+        :param items: 今回取得した件数
+        :param pages: 今回取得したページ数
+        :param remaining: リクエスト上限までの残り回数
+        :param reset_at: リクエスト上限のリセット時刻（UNIX時間）
+        """
+        self.pages += pages
+        self.items += items
+        now = time.monotonic()
+        if now - self._last_report < self._interval:
+            return
+        self._last_report = now
+        self._logger.info(self._make_message(now, remaining, reset_at))
+
+    def _make_message(self, now: float, remaining: int, reset_at: int) -> str:
+        elapsed = max(now - self._start, 1.0e-9)
+        pages_per_sec = self.pages / elapsed
+        items_per_sec = self.items / elapsed
+        message = (
+            f"{self._label}: {'{:,}'.format(self.items)} 件取得"
+            f"（{pages_per_sec:.2f} ページ/秒, {'{:,.0f}'.format(items_per_sec)} 件/秒）"
+        )
+        if self._total and items_per_sec > 0:
+            eta = max(self._total - self.items, 0) / items_per_sec
+            message += f" 完了まで約{_format_seconds(eta)}"
+        if remaining is not None and reset_at is not None and pages_per_sec > 0:
+            until_reset = max(reset_at - time.time(), 0)
+            until_limit = remaining / pages_per_sec
+            if until_limit < until_reset:
+                message += (
+                    f" 約{_format_seconds(until_limit)}後に上限到達、"
+                    f"リセットまで{_format_seconds(until_reset)}"
+                )
+        return message
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
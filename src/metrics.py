@@ -0,0 +1,159 @@
+import threading
+import time
+from functools import wraps
+from typing import Dict
+
+# 計測はデフォルトで無効、無効時はフラグ判定のみで計測処理を行わない
+_enabled = False
+_lock = threading.Lock()
+_timers: Dict[str, list] = {}
+_counters: Dict[str, float] = {}
+
+# 処理件数/秒を算出する組み合わせ（件数カウンタ名: 処理時間の計測区間名）
+_THROUGHPUTS = {
+    "search_rows": "search_tweets",
+    "user_ids": "get_user_ids",
+    "http_bytes": "http_get",
+}
+
+
+def enable_metrics():
+    global _enabled
+    _enabled = True
+
+
+def disable_metrics():
+    global _enabled
+    _enabled = False
+
+
+def reset_metrics():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def increment(name: str, value: float = 1):
+    """カウンタを加算する
+
+    :param name: カウンタ名
+    :param value: 加算する値
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def _record(stage: str, seconds: float):
+    with _lock:
+        timer = _timers.setdefault(stage, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+
+class _Timer:
+    __slots__ = ("_stage", "_start")
+
+    def __init__(self, stage: str):
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        _record(self._stage, time.perf_counter() - self._start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def measure(stage: str):
+    """with文で囲んだ区間の処理時間を計測する
+
+    :param stage: 計測区間名
+    :return コンテキストマネージャ（無効時は何もしない共有オブジェクト）
+    """
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+
+def timed(stage: str):
+    """関数全体の処理時間を計測するデコレータ
+
+    :param stage: 計測区間名
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def get_metrics() -> Dict:
+    """計測結果のスナップショットを取得する
+
+    :return timers（区間ごとの回数・秒数）、counters、throughputs（件数/秒）の辞書
+    """
+    with _lock:
+        timers = {
+            stage: {"count": count, "seconds": seconds}
+            for stage, (count, seconds) in _timers.items()
+        }
+        counters = dict(_counters)
+
+    throughputs = {}
+    for counter, stage in _THROUGHPUTS.items():
+        seconds = timers.get(stage, {}).get("seconds")
+        if counter in counters and seconds:
+            throughputs[f"{counter}_per_sec"] = counters[counter] / seconds
+
+    return {"timers": timers, "counters": counters, "throughputs": throughputs}
+
+
+def get_prometheus_metrics(prefix: str = "twivis") -> str:
+    """計測結果のスナップショットをPrometheusのテキスト形式で取得する
+
+    :param prefix: メトリクス名の接頭辞
+    :return Prometheusテキスト形式の文字列
+    """
+    snapshot = get_metrics()
+    lines = [
+        f"# TYPE {prefix}_stage_seconds_total counter",
+        *(
+            f'{prefix}_stage_seconds_total{{stage="{stage}"}} {t["seconds"]:.6f}'
+            for stage, t in sorted(snapshot["timers"].items())
+        ),
+        f"# TYPE {prefix}_stage_calls_total counter",
+        *(
+            f'{prefix}_stage_calls_total{{stage="{stage}"}} {t["count"]}'
+            for stage, t in sorted(snapshot["timers"].items())
+        ),
+    ]
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value:g}")
+    for name, value in sorted(snapshot["throughputs"].items()):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value:.6f}")
+    return "\n".join(lines) + "\n"
@@ -1,12 +1,24 @@
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Optional, Tuple
 
+import numpy
 import pandas
 
-from .constants import JA_WEEKDAYS, WEEKDAYS
+from .aggregates import fill_labels, join_user_df, make_engagement_p95_df
+from .constants import (
+    CONFIDENCE_Z,
+    ENGAGEMENT_AGGREGATIONS,
+    JA_WEEKDAYS,
+    SAMPLE_STRATUM_HOURS_COL,
+    SAMPLE_WEIGHT_COL,
+    WEEKDAYS,
+)
+from .metrics import timed
+from .stores import split_user_dimension
 from .utils import count_users
 
 
+@timed("make_tweet_user_weekday_max_hour_df")
 def make_tweet_user_weekday_max_hour_df(df: pandas.DataFrame) -> pandas.DataFrame:
     """1日複数回ツイートしたユーザを1カウントとするDataFrameを生成する
 
@@ -18,7 +30,7 @@ def make_tweet_user_weekday_max_hour_df(df: pandas.DataFrame) -> pandas.DataFram
     """
     _cols = ["user_id", "tweeted_weekday", "tweeted_hour", "tweet_id"]
     _group_cols = ["user_id", "tweeted_weekday"]
-    return df[_cols].groupby(_group_cols).max().reset_index()
+    return df[_cols].groupby(_group_cols, observed=True).max().reset_index()
 
 
 def make_weekday(dt: datetime, timezone) -> str:
@@ -54,6 +66,7 @@ def make_tweeted_weekday_range(timezone) -> List[str]:
     return weekdays[::-1]
 
 
+@timed("make_count_tweeted_weekday_df")
 def make_count_tweeted_weekday_df(df: pandas.DataFrame, timezone) -> pandas.DataFrame:
     """日付別にツイート数をカウントしたDataFrameを生成する
 
@@ -61,15 +74,15 @@ def make_count_tweeted_weekday_df(df: pandas.DataFrame, timezone) -> pandas.Data
     :param timezone: timezoneオブジェクト
     :return 日付別ツイート数DataFrame
     """
-    _df = df.groupby("tweeted_weekday")["tweet_id"].agg(count="count")
-    for wd in make_tweeted_weekday_range(timezone=timezone):
-        if wd not in _df.index:
-            _zero_df = pandas.DataFrame([0], index=[wd], columns=["count"])
-            _zero_df.index.name = "tweeted_weekday"
-            _df = _df.append(_zero_df)
-    return _df.sort_index().reset_index()
+    _df = _count_tweets(df, group_col="tweeted_weekday")
+    return fill_labels(
+        _df,
+        group_col="tweeted_weekday",
+        labels=make_tweeted_weekday_range(timezone=timezone),
+    )
 
 
+@timed("make_count_tweeted_df")
 def make_count_tweeted_df(
     df: pandas.DataFrame, timezone, group_col
 ) -> pandas.DataFrame:
@@ -79,13 +92,12 @@ def make_count_tweeted_df(
     :param timezone: timezoneオブジェクト
     :return 日付別ツイート数DataFrame
     """
-    _df = df.groupby(group_col)["tweet_id"].agg(count="count")
-    for wd in make_tweeted_weekday_hour_label_range(timezone=timezone):
-        if wd not in _df.index:
-            _zero_df = pandas.DataFrame([0], index=[wd], columns=["count"])
-            _zero_df.index.name = group_col
-            _df = _df.append(_zero_df)
-    return _df.sort_index().reset_index()
+    _df = _count_tweets(df, group_col=group_col)
+    return fill_labels(
+        _df,
+        group_col=group_col,
+        labels=make_tweeted_weekday_hour_label_range(timezone=timezone),
+    )
 
 
 def make_tweeted_hour_label_range() -> List[str]:
@@ -109,71 +121,186 @@ def make_tweeted_weekday_hour_label_range(timezone) -> List[str]:
     return labels
 
 
+@timed("make_count_tweeted_hour_df")
 def make_count_tweeted_hour_df(df: pandas.DataFrame) -> pandas.DataFrame:
     """時間別にツイート数をカウントしたDataFrameを生成する
 
     :param df: 対象のDataFrame
     :return 時間別ツイート数DataFrame
     """
-    _df = df.groupby("tweeted_hour")["tweet_id"].agg(count="count")
-    for wd in make_tweeted_hour_label_range():
-        if wd not in _df.index:
-            _zero_df = pandas.DataFrame([0], index=[wd], columns=["count"])
-            _zero_df.index.name = "tweeted_hour"
-            _df = _df.append(_zero_df)
-    return _df.sort_index().reset_index()
+    _df = _count_tweets(df, group_col="tweeted_hour")
+    return fill_labels(
+        _df, group_col="tweeted_hour", labels=make_tweeted_hour_label_range()
+    )
 
 
+@timed("make_user_df")
 def make_user_df(
     df: pandas.DataFrame,
+    users: pandas.DataFrame = None,
 ) -> pandas.DataFrame:
     """ユーザをユニークにしたDataFrameを生成する
 
-    :param df: 計算対象のDataFrame
+    ツイートテーブルをuser_idxで集計し、ユーザテーブルの最新プロフィールを結合する。
+    エンゲージメント（いいね数・リツイート数）の集計も同じグループ化で行う。
+
+    :param df: 計算対象のDataFrame（ツイートテーブル）
+    :param users: ユーザテーブル、未指定の場合はdfのユーザ軸の項目から生成する
     :return 計算後のDataFrame
     """
-    _df = (
-        df.groupby(["user_screen_name", "user_name"])
-        .agg(
-            friends_count=("friends_count", "max"),
-            followers_count=("followers_count", "max"),
-            tweets_count=("tweet_id", "count"),
-            following=("following", "max"),
-            follower=("follower", "max"),
-        )
-        .reset_index()
+    if users is None:
+        df, users = split_user_dimension(df)
+
+    _grouped = df.groupby("user_idx")
+    _df = _grouped.agg(tweets_count=("tweet_id", "count"), **ENGAGEMENT_AGGREGATIONS)
+    _df = _df.join(make_engagement_p95_df(_grouped))
+    return join_user_df(users, _df)
+
+
+@timed("make_engagement_df")
+def make_engagement_df(
+    df: pandas.DataFrame, group_col: str, labels: List[str]
+) -> pandas.DataFrame:
+    """日付別・時間別などにエンゲージメントを集計したDataFrameを生成する
+
+    :param df: 対象のDataFrame
+    :param group_col: 集計単位のカラム
+    :param labels: 集計結果に必ず含めるラベル（ツイートがない場合は0とする）
+    :return エンゲージメント集計DataFrame
+    """
+    _grouped = df.groupby(group_col, observed=True)
+    _df = _grouped.agg(**ENGAGEMENT_AGGREGATIONS)
+    _df = _df.join(make_engagement_p95_df(_grouped))
+    return fill_labels(_df, group_col=group_col, labels=labels)
+
+
+def is_sampled(df: pandas.DataFrame) -> bool:
+    """サンプリング取得（sample_tweets）したツイートかどうか"""
+    return df is not None and SAMPLE_WEIGHT_COL in df.columns
+
+
+@timed("make_estimated_df")
+def make_estimated_df(
+    df: pandas.DataFrame,
+    group_col: str,
+    labels: List[str],
+    value_col: str = None,
+    name: str = "count",
+) -> pandas.DataFrame:
+    """サンプリングしたツイートから、group_col別の件数（または合計）の推定値と95%信頼区間の幅を求める
+
+    推定値は重み（sample_weight）付きの合計とする。
+    層のツイートを時間あたり一定の件数で投稿される（ポアソン過程）とみなすと、
+    取得できなかった時間幅の件数の推定誤差の分散はΣ w(w-1)x²になる。
+    取得し切れた層（重み1）のツイートは分散に寄与しない。
+    層の時間幅が1時間より広い場合は層の中の偏りが誤差の大半を占めるため、信頼区間の幅は欠損値とする。
+
+    :param df: sample_weightを含むDataFrame
+    :param group_col: 集計単位のカラム
+    :param labels: 集計結果に必ず含めるラベル（ツイートがない場合は0とする）
+    :param value_col: 合計するカラム、未指定の場合は件数を推定する
+    :param name: 推定値のカラム名（信頼区間の幅は<name>_error）
+    :return group_col, <name>, <name>_errorのDataFrame
+    """
+    _df = _make_estimated_terms(df, value_col=value_col, name=name)
+    _df[group_col] = df[group_col].to_numpy()
+    _df = _df.groupby(group_col, observed=True).sum()
+    _df[f"{name}_error"] = CONFIDENCE_Z * numpy.sqrt(_df.pop("_var"))
+    _df = fill_labels(_df, group_col=group_col, labels=labels)
+    if not _has_valid_intervals(df):
+        _df[f"{name}_error"] = numpy.nan
+    return _df
+
+
+def estimate_total(
+    df: pandas.DataFrame, value_col: str = None
+) -> Tuple[int, Optional[int]]:
+    """サンプリングしたツイート全体の件数（または合計）の推定値と95%信頼区間の幅を求める
+
+    :param df: sample_weightを含むDataFrame
+    :param value_col: 合計するカラム、未指定の場合は件数を推定する
+    :return (推定値, 信頼区間の幅)、層の時間幅が1時間より広い場合は信頼区間の幅をNoneとする
+    """
+    _df = _make_estimated_terms(df, value_col=value_col, name="total").sum()
+    if not _has_valid_intervals(df):
+        return round(_df["total"]), None
+    return round(_df["total"]), round(CONFIDENCE_Z * numpy.sqrt(_df["_var"]))
+
+
+def _has_valid_intervals(df: pandas.DataFrame) -> bool:
+    # 層の時間幅を記録していない（以前に保存した）場合は1時間とみなす
+    if SAMPLE_STRATUM_HOURS_COL not in df.columns:
+        return True
+    return bool((df[SAMPLE_STRATUM_HOURS_COL] <= 1).all())
+
+
+def _make_estimated_terms(
+    df: pandas.DataFrame, value_col: str, name: str
+) -> pandas.DataFrame:
+    w = df[SAMPLE_WEIGHT_COL].to_numpy(dtype=numpy.float64)
+    x = (
+        numpy.ones(len(df))
+        if value_col is None
+        else df[value_col].to_numpy(dtype=numpy.float64)
     )
+    return pandas.DataFrame({name: w * x, "_var": w * (w - 1) * x * x})
+
+
+@timed("make_followers_count_bucket_df")
+def make_followers_count_bucket_df(df: pandas.DataFrame) -> pandas.DataFrame:
+    """フォロワー数の桁（0, 1〜9, 10〜99, ...）ごとにユーザ数をカウントしたDataFrameを生成する
 
-    # フォロー数、フォロワー数どちらかが0は計算ができないので、1に変換して計算する
-    _df["_friends_count"] = _df["friends_count"].apply(lambda x: x if x > 0 else 1)
-    _df["_followers_count"] = _df["followers_count"].apply(lambda x: x if x > 0 else 1)
-    _df["ff_ratio"] = _df["_followers_count"] / _df["_friends_count"]
-    _df["ff_ratio_close_to_one"] = (1.0 - _df["ff_ratio"]).abs()
-    cols = [
-        "user_screen_name",
-        "user_name",
-        "tweets_count",
-        "followers_count",
-        "friends_count",
-        "ff_ratio",
-        "ff_ratio_close_to_one",
-        "following",
-        "follower",
+    :param df: ユーザをユニークにしたDataFrame（hydrate_usersの戻り値など）
+    :return followers_bucket, countのDataFrame
+    """
+    digits = numpy.floor(numpy.log10(df["followers_count"].clip(lower=1))).astype(int)
+    digits[df["followers_count"] < 1] = -1
+    max_digit = max(int(digits.max()) if len(digits) else 0, 0)
+    labels = ["0"] + [
+        f"{'{:,}'.format(10 ** d)}〜{'{:,}'.format(10 ** (d + 1) - 1)}"
+        for d in range(max_digit + 1)
     ]
-    return _df[cols]
+    counts = numpy.bincount(digits.to_numpy() + 1, minlength=len(labels))
+    return pandas.DataFrame({"followers_bucket": labels, "count": counts})
+
+
+def _count_tweets(df: pandas.DataFrame, group_col: str) -> pandas.DataFrame:
+    """group_col別にツイート数をカウントする
 
+    カテゴリ型のカラムでもツイートがあるラベルだけを集計する（observed=True）。
 
-def make_title(df: pandas.DataFrame, main_title: str, count: int, search_word: str):
+    :param df: 対象のDataFrame
+    :param group_col: 集計単位のカラム
+    :return ツイート数DataFrame
+    """
+    return df.groupby(group_col, observed=True)["tweet_id"].agg(count="count")
+
+
+def make_title(
+    df: pandas.DataFrame,
+    main_title: str,
+    count: int,
+    search_word: str,
+    users_count: int = None,
+    count_error: int = None,
+):
     """タイトルを生成する
 
     :param df: 計算対象のDataFrame
     :param main_title: メインとなるタイトル
     :param count: タイトルに表示する合計値
     :param search_word: タイトルに表示する検索ワード
+    :param users_count: 通算人数、集計済みの場合に指定する（未指定の場合はdfから数える）
+    :param count_error: 合計値が推定値の場合の95%信頼区間の幅
     :return 生成したタイトル
     """
+    if users_count is None:
+        users_count = count_users(df)
     _title = main_title
     _title += f" 【検索ワード:{search_word}】"
-    _title += f" 【合計: {'{:,}'.format(count)}】 "
-    _title += f" 【通算人数: {'{:,}'.format(count_users(df))}名】 "
+    if count_error is None:
+        _title += f" 【合計: {'{:,}'.format(count)}】 "
+    else:
+        _title += f" 【合計: {'{:,}'.format(count)} ± {'{:,}'.format(count_error)}】 "
+    _title += f" 【通算人数: {'{:,}'.format(users_count)}名】 "
     return _title
@@ -4,7 +4,9 @@ from typing import Dict, List
 import pandas as pd
 
 from .filters import filter_user
+from .indexes import TweetIndex
 from .processors import make_user_df
+from .sql import SQLStore
 
 
 def make_user_ranking(
@@ -13,6 +15,9 @@ def make_user_ranking(
     top: int = 10,
     ascending: bool = True,
     search_query: str = "",
+    users: pd.DataFrame = None,
+    user_df: pd.DataFrame = None,
+    sql: SQLStore = None,
     **kwargs,
 ):
     """ユーザを画面に出力する
@@ -22,8 +27,18 @@ def make_user_ranking(
     :param top: 上位から出力する件数を指定
     :param ascending: 並び順を指定、昇順はTrue、降順はFalse
     :param search_query: 検索に使用したクエリ、リンク生成時に使用する
+    :param users: ユーザテーブル、dfがツイートテーブルの場合に指定する
+    :param user_df: ユーザをユニークにしたDataFrame、未指定の場合はdfから生成する
+    :param sql: 指定した場合は絞り込み・並べ替えをSQLで行い、上位top件だけを取得する
     """
-    _df = make_user_df(df)
+    if sql is not None:
+        _df = sql.where(**kwargs).make_user_ranking_df(
+            col, top=top, ascending=ascending
+        )
+    elif user_df is None:
+        _df = make_user_df(df, users=users)
+    else:
+        _df = user_df
     _df = filter_user(_df, **kwargs)
     _df = _df.sort_values([col, "followers_count"], ascending=[ascending, False])
     rows = []
@@ -46,6 +61,52 @@ def make_user_ranking(
     return rows
 
 
+def make_hashtag_ranking(
+    index: TweetIndex, rows=None, top: int = 10, search_query: str = ""
+):
+    """ハッシュタグの出現数ランキングを生成する
+
+    :param index: 集計対象の転置インデックス
+    :param rows: 集計対象の行番号、未指定の場合は全行
+    :param top: 上位から出力する件数を指定
+    :param search_query: 検索に使用したクエリ、リンク生成時に使用する
+    """
+    counts = index.count_hashtags(rows=rows, top=top)
+    return _make_hashtag_rows(counts, search_query=search_query)
+
+
+def make_co_hashtag_ranking(
+    index: TweetIndex, hashtag: str, rows=None, top: int = 10, search_query: str = ""
+):
+    """指定ハッシュタグと同時に使われたハッシュタグのランキングを生成する
+
+    :param index: 集計対象の転置インデックス
+    :param hashtag: 基準とするハッシュタグ
+    :param rows: 集計対象の行番号、未指定の場合は全行
+    :param top: 上位から出力する件数を指定
+    :param search_query: 検索に使用したクエリ、リンク生成時に使用する
+    """
+    counts = index.count_co_hashtags(hashtag, rows=rows, top=top)
+    return _make_hashtag_rows(counts, search_query=search_query)
+
+
+def _make_hashtag_rows(counts, search_query: str):
+    rows = []
+    for hashtag, count in counts:
+        twitter_query = urllib.parse.quote(f"{hashtag} {search_query}")
+        twitter_url = (
+            f"https://twitter.com/search?src=typed_query&f=live&q={twitter_query}"
+        )
+        rows.append(
+            {
+                "value": count,
+                "hashtag": hashtag,
+                "twitter_search_url": twitter_url,
+            }
+        )
+    return rows
+
+
 def print_user_rankings(rankings: List[Dict], value_fmt="{:,}", ranking_name=""):
     """ユーザランキングをコンソールに表示する
 
@@ -62,3 +123,21 @@ def print_user_rankings(rankings: List[Dict], value_fmt="{:,}", ranking_name="")
         url = row["twitter_search_url"]
         print(f"{value}　\t　{user_name}\t\t{url}")
     print(f"▲▲▲▲▲ {ranking_name} ▲▲▲▲▲")
+
+
+def print_hashtag_rankings(rankings: List[Dict], value_fmt="{:,}", ranking_name=""):
+    """ハッシュタグランキングをコンソールに表示する
+
+    :param rankings:
+    :param value_fmt: Format of value. Default is 3-digit comma display.
+    """
+    if len(rankings) == 0:
+        return
+
+    print(f"▼▼▼▼▼ {ranking_name} ▼▼▼▼▼")
+    for row in rankings:
+        value = value_fmt.format(row["value"])
+        hashtag = row["hashtag"]
+        url = row["twitter_search_url"]
+        print(f"{value}　\t　{hashtag}\t\t{url}")
+    print(f"▲▲▲▲▲ {ranking_name} ▲▲▲▲▲")
@@ -0,0 +1,417 @@
+import sqlite3
+from typing import Iterable, List
+
+import numpy
+import pandas
+
+from .aggregates import fill_labels
+from .audiences import AudienceSet
+from .errors import ParameterError
+from .metrics import timed
+from .stores import TweetStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    user_idx INTEGER NOT NULL,
+    user_screen_name TEXT,
+    user_name TEXT,
+    user_profile_image_url TEXT,
+    followers_count INTEGER,
+    friends_count INTEGER,
+    following INTEGER,
+    follower INTEGER,
+    followed_by INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_followers_count ON users (followers_count);
+
+CREATE TABLE IF NOT EXISTS tweets (
+    tweet_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    tweeted_dt TEXT NOT NULL,
+    tweeted_date TEXT,
+    tweeted_weekday TEXT,
+    tweeted_hour TEXT,
+    tweeted_wh TEXT,
+    favorite_count INTEGER,
+    retweet_count INTEGER,
+    source TEXT,
+    lang TEXT,
+    full_text TEXT,
+    in_reply_to_user_id INTEGER,
+    retweeted_user_id INTEGER,
+    quoted_user_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS tweets_user_id ON tweets (user_id);
+CREATE INDEX IF NOT EXISTS tweets_tweeted_dt ON tweets (tweeted_dt);
+
+CREATE TABLE IF NOT EXISTS follower_sets (
+    account TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (account, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS follower_sets_user_id ON follower_sets (user_id);
+"""
+
+_USER_COLS = [
+    "user_id",
+    "user_idx",
+    "user_screen_name",
+    "user_name",
+    "user_profile_image_url",
+    "followers_count",
+    "friends_count",
+    "following",
+    "follower",
+    "followed_by",
+]
+
+_TWEET_COLS = [
+    "tweet_id",
+    "user_id",
+    "tweeted_dt",
+    "tweeted_date",
+    "tweeted_weekday",
+    "tweeted_hour",
+    "tweeted_wh",
+    "favorite_count",
+    "retweet_count",
+    "source",
+    "lang",
+    "full_text",
+    "in_reply_to_user_id",
+    "retweeted_user_id",
+    "quoted_user_id",
+]
+
+# 集計単位にできるツイートテーブルのカラム
+_GROUP_COLS = ["tweeted_date", "tweeted_weekday", "tweeted_hour", "tweeted_wh"]
+
+_USER_DF_COLS = [
+    "user_id",
+    "user_screen_name",
+    "user_name",
+    "tweets_count",
+    "followers_count",
+    "friends_count",
+    "ff_ratio",
+    "ff_ratio_close_to_one",
+    "following",
+    "follower",
+    "favorite_sum",
+    "favorite_max",
+    "favorite_p95",
+    "retweet_sum",
+    "retweet_max",
+    "retweet_p95",
+    "followed_by",
+]
+
+# processors.make_user_dfと同じ形式のユーザ別の集計（ff_ratioはフォロー数・フォロワー数の0を1として計算）
+_USER_SELECT = """
+SELECT
+    u.user_id,
+    u.user_screen_name,
+    u.user_name,
+    COUNT(*) AS tweets_count,
+    u.followers_count,
+    u.friends_count,
+    MAX(u.followers_count, 1) * 1.0 / MAX(u.friends_count, 1) AS ff_ratio,
+    ABS(1.0 - MAX(u.followers_count, 1) * 1.0 / MAX(u.friends_count, 1))
+        AS ff_ratio_close_to_one,
+    u.following,
+    u.follower,
+    SUM(t.favorite_count) AS favorite_sum,
+    MAX(t.favorite_count) AS favorite_max,
+    {favorite_p95} AS favorite_p95,
+    SUM(t.retweet_count) AS retweet_sum,
+    MAX(t.retweet_count) AS retweet_max,
+    {retweet_p95} AS retweet_p95,
+    u.followed_by
+FROM tweets t JOIN users u ON u.user_id = t.user_id
+{where}
+GROUP BY u.user_id
+"""
+
+# エンゲージメントの集計（processors.make_engagement_dfと同じ並び）
+_ENGAGEMENT_SELECT = {
+    "favorite_sum": "SUM(t.favorite_count)",
+    "favorite_max": "MAX(t.favorite_count)",
+    "retweet_sum": "SUM(t.retweet_count)",
+    "retweet_max": "MAX(t.retweet_count)",
+    "favorite_p95": "P95(t.favorite_count)",
+    "retweet_p95": "P95(t.retweet_count)",
+}
+
+
+class SQLStore:
+    """ツイートテーブル・ユーザテーブル・フォロワー集合を組み込みSQLエンジン（sqlite3）で保持するクラス
+
+    TwiVisAPIの固定の集計以外の問い合わせをSQLで書けるようにし、
+    グラフ・ランキングの集計もSQL側で行って小さな集計結果だけをDataFrameにする。
+
+        tweets(tweet_id, user_id, tweeted_dt, tweeted_weekday, ..., favorite_count, retweet_count)
+        users(user_id, user_screen_name, followers_count, ..., following, follower, followed_by)
+        follower_sets(account, user_id)
+
+    :param path: データベースファイル、未指定の場合はメモリ上に作成する
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path)
+        self._conn.create_aggregate("P95", 1, _Percentile95)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    @timed("load_sql_store")
+    def load_store(self, store: TweetStore, tweet_ids: Iterable[int] = None):
+        """ストアのツイートテーブル・ユーザテーブルを書き込む
+
+        :param store: 書き込むストア
+        :param tweet_ids: 指定した場合は、そのツイートと投稿したユーザだけを追加・更新する
+            （TweetStore.upsertで追加・更新した差分）。未指定の場合は全件を置き換える
+        """
+        tweets = store.tweets
+        users = store.users.assign(user_idx=numpy.arange(len(store.users)))
+        if tweet_ids is not None:
+            tweets = tweets[tweets["tweet_id"].isin(numpy.asarray(tweet_ids))]
+            users = users[users["user_id"].isin(tweets["user_id"])]
+        with self._conn:
+            if tweet_ids is None:
+                self._conn.execute("DELETE FROM tweets")
+                self._conn.execute("DELETE FROM users")
+            _insert(self._conn, "users", _to_user_rows(users))
+            _insert(self._conn, "tweets", _to_tweet_rows(tweets))
+
+    @timed("update_sql_users")
+    def update_users(self, users: pandas.DataFrame, cols: List[str]):
+        """書き込み済みのユーザの一部の項目だけを更新する（followed_byなど）
+
+        :param users: 更新するユーザ（user_idと更新する項目を含む）
+        :param cols: 更新する項目
+        """
+        for col in cols:
+            _validate_col(col, _USER_COLS)
+        assignments = ", ".join(f"{col} = ?" for col in cols)
+        with self._conn:
+            self._conn.executemany(
+                f"UPDATE users SET {assignments} WHERE user_id = ?",
+                zip(*[_to_sql_values(users[col]) for col in [*cols, "user_id"]]),
+            )
+
+    @timed("load_sql_audiences")
+    def load_audiences(self, audiences: AudienceSet):
+        """フォロワーの重なりを比較するアカウントのフォロワー集合を書き込む（全件を置き換える）"""
+        with self._conn:
+            self._conn.execute("DELETE FROM follower_sets")
+            for account in audiences.accounts:
+                self._conn.executemany(
+                    "INSERT INTO follower_sets (account, user_id) VALUES (?, ?)",
+                    ((account, int(i)) for i in audiences.get(account)),
+                )
+
+    @timed("sql_query")
+    def query(self, sql: str, params=()) -> pandas.DataFrame:
+        """SQLで問い合わせる
+
+        :param sql: SELECT文、P95(カラム)で95パーセンタイルを集計できる
+        :param params: プレースホルダ（?、:name）の値
+        :return 問い合わせ結果
+        """
+        return pandas.read_sql_query(sql, self._conn, params=params)
+
+    def where(
+        self,
+        min_followers_count: int = None,
+        max_followers_count: int = None,
+        following: bool = None,
+        follower: bool = None,
+        min_followed_by: int = None,
+    ) -> "SQLView":
+        """ユーザ軸の項目で絞り込んだ集計用のビューを生成する（引数はfilters.filter_userと同じ）"""
+        conditions = []
+        params = []
+        if min_followers_count:
+            conditions.append("u.followers_count >= ?")
+            params.append(min_followers_count)
+        if max_followers_count:
+            conditions.append("u.followers_count <= ?")
+            params.append(max_followers_count)
+        # 取得できなかったフラグ（NULL）は条件に一致しない
+        if following is not None:
+            conditions.append("u.following = ?")
+            params.append(int(following))
+        if follower is not None:
+            conditions.append("u.follower = ?")
+            params.append(int(follower))
+        if min_followed_by:
+            conditions.append("u.followed_by >= ?")
+            params.append(min_followed_by)
+        return SQLView(self, conditions, params)
+
+
+class SQLView:
+    """SQLStoreをユーザ軸の条件で絞り込んで集計するクラス
+
+    TweetAggregatesと同じ読み出し方法を持ち、graphsの集計済みの結果として使用できる。
+
+    :param store: 問い合わせ先
+    :param conditions: WHERE句の条件（ANDで結合する）
+    :param params: 条件のプレースホルダの値
+    """
+
+    def __init__(self, store: SQLStore, conditions: List[str], params: List):
+        self._store = store
+        self._conditions = conditions
+        self._params = params
+
+    def make_user_df(self, users: pandas.DataFrame = None) -> pandas.DataFrame:
+        """processors.make_user_dfと同じ形式のユーザ別の集計結果を生成する"""
+        return self._query_user_df("", p95_cols=["favorite_p95", "retweet_p95"])
+
+    @timed("sql_make_user_ranking_df")
+    def make_user_ranking_df(
+        self, col: str, top: int = 10, ascending: bool = True
+    ) -> pandas.DataFrame:
+        """ユーザ別の集計結果の上位top件だけを生成する（rankings.make_user_rankingと同じ並び順）
+
+        :param col: 順位の評価対象カラム
+        :param top: 取得する件数
+        :param ascending: 並び順を指定、昇順はTrue、降順はFalse
+        """
+        _validate_col(col, _USER_DF_COLS)
+        order = "ASC" if ascending else "DESC"
+        # 95パーセンタイルはPythonで集計するため、順位の評価対象の場合だけ集計する
+        return self._query_user_df(
+            f"ORDER BY {col} {order}, followers_count DESC, u.user_idx LIMIT ?",
+            params=[top],
+            p95_cols=[col],
+        )
+
+    def make_count_df(self, group_col: str, labels: List[str]) -> pandas.DataFrame:
+        """processors.make_count_tweeted_dfなどと同じ形式のツイート数を生成する"""
+        _validate_col(group_col, _GROUP_COLS)
+        _df = self._query(f"SELECT t.{group_col}, COUNT(*) AS count", group_col)
+        return fill_labels(_df, group_col=group_col, labels=labels)
+
+    def make_user_count_df(self, labels: List[str]) -> pandas.DataFrame:
+        """日別のツイート人数（1日複数回ツイートしたユーザを1人とする）を生成する"""
+        _df = self._query(
+            "SELECT t.tweeted_weekday, COUNT(DISTINCT t.user_id) AS count",
+            "tweeted_weekday",
+        )
+        return fill_labels(_df, group_col="tweeted_weekday", labels=labels)
+
+    def make_engagement_df(self, group_col: str, labels: List[str]) -> pandas.DataFrame:
+        """processors.make_engagement_dfと同じ形式のエンゲージメントを生成する"""
+        _validate_col(group_col, _GROUP_COLS)
+        _select = ", ".join(f"{v} AS {k}" for k, v in _ENGAGEMENT_SELECT.items())
+        _df = self._query(f"SELECT t.{group_col}, {_select}", group_col)
+        return fill_labels(_df, group_col=group_col, labels=labels)
+
+    def count_users(self) -> int:
+        """ツイートしたユーザ数"""
+        return int(self._query("SELECT COUNT(DISTINCT t.user_id) AS count").iloc[0, 0])
+
+    def sum(self, col: str) -> int:
+        """ツイート全体の件数・合計（tweets_count, favorite_sum, retweet_sum）"""
+        _select = {"tweets_count": "COUNT(*)", **_ENGAGEMENT_SELECT}
+        _validate_col(col, ["tweets_count", "favorite_sum", "retweet_sum"])
+        _df = self._query(f"SELECT COALESCE({_select[col]}, 0) AS {col}")
+        return int(_df.iloc[0, 0])
+
+    def _where(self) -> str:
+        if not self._conditions:
+            return ""
+        return "WHERE " + " AND ".join(self._conditions)
+
+    def _query(self, select: str, group_col: str = None) -> pandas.DataFrame:
+        # ユーザ軸の条件がない場合はユーザテーブルを結合しない
+        sql = f"{select} FROM tweets t"
+        if self._conditions:
+            sql += f" JOIN users u ON u.user_id = t.user_id {self._where()}"
+        if group_col is None:
+            return self._store.query(sql, self._params)
+        sql += f" GROUP BY t.{group_col}"
+        return self._store.query(sql, self._params).set_index(group_col)
+
+    def _query_user_df(
+        self, suffix: str, params: List = None, p95_cols: List[str] = ()
+    ) -> pandas.DataFrame:
+        # p95_cols以外の95パーセンタイルはNULL（欠損）とする
+        p95 = {
+            col: _ENGAGEMENT_SELECT[col] if col in p95_cols else "NULL"
+            for col in ["favorite_p95", "retweet_p95"]
+        }
+        sql = _USER_SELECT.format(where=self._where(), **p95) + suffix
+        _df = self._store.query(sql, [*self._params, *(params or [])])
+        for col in ["following", "follower"]:
+            _df[col] = _df[col].astype("boolean")
+        return _df
+
+
+class _Percentile95:
+    """P95(カラム)：pandasのquantile(0.95)と同じ線形補間の95パーセンタイルを集計する"""
+
+    def __init__(self):
+        self._values = []
+
+    def step(self, value):
+        if value is not None:
+            self._values.append(value)
+
+    def finalize(self):
+        if not self._values:
+            return None
+        # pandasのgroupby.quantileと同じ式で補間する（numpy.quantileとは端数が異なる）
+        values = sorted(self._values)
+        position = 0.95 * (len(values) - 1)
+        idx = int(position)
+        if idx + 1 >= len(values):
+            return float(values[idx])
+        return float(values[idx] + (values[idx + 1] - values[idx]) * (position - idx))
+
+
+def _insert(conn: sqlite3.Connection, table: str, df: pandas.DataFrame):
+    cols = ", ".join(df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({cols}) VALUES ({placeholders})",
+        zip(*[_to_sql_values(df[col]) for col in df.columns]),
+    )
+
+
+def _to_sql_values(series: pandas.Series) -> List:
+    # numpyの数値型・カテゴリ型・nullableなboolean型を、sqlite3で扱えるPythonの値（Noneは欠損）にする
+    if series.dtype == bool or series.dtype.name == "boolean":
+        series = series.astype("Int8")
+    if series.dtype == object or isinstance(
+        series.dtype, (pandas.CategoricalDtype, pandas.Int8Dtype)
+    ):
+        values = series.to_numpy(dtype=object)
+        values[series.isna().to_numpy()] = None
+        return values.tolist()
+    return series.tolist()
+
+
+def _to_user_rows(users: pandas.DataFrame) -> pandas.DataFrame:
+    _users = users.reindex(columns=_USER_COLS)
+    _users["followed_by"] = _users["followed_by"].fillna(0).astype(numpy.int64)
+    return _users
+
+
+def _to_tweet_rows(tweets: pandas.DataFrame) -> pandas.DataFrame:
+    _tweets = tweets.reindex(columns=_TWEET_COLS)
+    # 集計に使用したタイムゾーンの時刻を、文字列順が時刻順になる形式で保持する
+    _tweets["tweeted_dt"] = numpy.datetime_as_string(
+        tweets["tweeted_dt"].dt.tz_localize(None).to_numpy(), unit="s"
+    )
+    return _tweets
+
+
+def _validate_col(col: str, allowed: List[str]):
+    # カラム名はSQLに直接埋め込むため、既知のカラム以外は受け付けない
+    if col not in allowed:
+        raise ParameterError(f"{col}は指定できません（{', '.join(allowed)}）")
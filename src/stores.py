@@ -0,0 +1,391 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy
+import pandas
+
+from .aggregates import TweetAggregates
+from .dtypes import concat_optimized
+from .metrics import timed
+
+# ユーザ軸の項目（ツイートごとに持たずユーザテーブルで1件だけ保持する）
+USER_COLS = [
+    "user_id",
+    "user_screen_name",
+    "user_name",
+    "user_profile_image_url",
+    "followers_count",
+    "friends_count",
+    "following",
+    "follower",
+]
+
+# 最新のスナップショット名を記録するファイル
+_CURRENT_FILE = "CURRENT"
+# スナップショット形式にする前に、クエリ名のディレクトリ直下に保存していたファイル
+_LEGACY_FILES = ["tweets.pkl", "users.pkl", "meta.json"]
+
+
+class TweetStore:
+    """ツイートテーブルとユーザテーブルに分けて保持するストア（スタースキーマ）
+
+    ツイートテーブルはuser_idx（ユーザテーブルの行番号）でユーザを参照し、
+    ユーザテーブルはユーザごとに最新のプロフィールを1件だけ保持する。
+    集計結果（TweetAggregates）は初回利用時に作成し、以降は追加・更新の差分で更新する。
+    """
+
+    def __init__(
+        self,
+        tweets: pandas.DataFrame,
+        users: pandas.DataFrame,
+        aggregates: TweetAggregates = None,
+        positions: Tuple["IdPositions", "IdPositions"] = None,
+        user_flags: FrozenSet[str] = frozenset(),
+    ):
+        if "followed_by" not in users.columns:
+            # 比較するアカウントを追加していない場合も絞り込みに使えるよう0とする（SQLのDEFAULT 0と同じ）
+            users = users.assign(followed_by=numpy.zeros(len(users), dtype=numpy.uint8))
+        self.tweets = tweets
+        self.users = users
+        self._aggregates = aggregates
+        self._positions = positions
+        # set_user_flagで設定したフラグ（検索結果の値ではなく、設定済みの値を引き継ぐ）
+        self._user_flags = frozenset(user_flags)
+
+    @classmethod
+    def from_tweets(cls, tweets: List[Dict]) -> "TweetStore":
+        """search_tweetsの戻り値からストアを生成する
+
+        :param tweets: ツイートの辞書のリスト
+        :return 生成したストア
+        """
+        return cls.from_df(pandas.DataFrame(tweets))
+
+    @classmethod
+    @timed("build_tweet_store")
+    def from_df(cls, df: pandas.DataFrame) -> "TweetStore":
+        """ユーザ軸の項目を含むDataFrameからストアを生成する
+
+        :param df: search_tweetsの戻り値から生成したDataFrame
+        :return 生成したストア
+        """
+        empty = cls(
+            tweets=df.iloc[:0]
+            .drop(columns=USER_COLS[1:], errors="ignore")
+            .assign(user_idx=numpy.int32(0)),
+            users=pandas.DataFrame(columns=USER_COLS),
+        )
+        return empty.upsert(df)
+
+    @timed("upsert_tweet_store")
+    def upsert(self, df: pandas.DataFrame) -> "TweetStore":
+        """tweet_idをキーにツイートを追加・更新したストアを生成する
+
+        ツイートは新しく取得したいいね数・リツイート数で置き換える。
+        ユーザのプロフィールは取得時点のものが返るため、新しく取得した方で置き換える。
+        フォロワーかどうか（follower）など、検索結果に含まれない項目は取得済みの値を引き継ぐ。
+        set_user_flagで設定したフラグ（followingなど）も、検索結果の値で上書きせずに引き継ぐ。
+        取得済みのツイート・ユーザは行番号を変えずに置き換え、新しいツイート・ユーザは末尾に追加する。
+        取得済みかどうかはIDの昇順の配列（IdPositions）で引き当てるため、テーブル全体のハッシュ表は作らない。
+        追加後のテーブルは省メモリな型（dtypes.optimize_dtypes）を保つ。
+
+        :param df: ユーザ軸の項目を含むDataFrame
+        :return 追加・更新後のストア
+        """
+        if df.empty:
+            return self
+        tweet_positions, user_positions = self._get_positions()
+
+        new_users = df[USER_COLS].drop_duplicates(subset="user_id", keep="first")
+        new_users = new_users.reset_index(drop=True)
+        user_ids = new_users["user_id"].to_numpy(dtype=numpy.int64)
+        found = user_positions.lookup(user_ids)
+        # 検索結果から取得できない項目（follower, followed_byなど）・設定済みのフラグは取得済みの値を引き継ぐ
+        carried_cols = dict.fromkeys(
+            [
+                "follower",
+                *sorted(self._user_flags),
+                *self.users.columns.difference(USER_COLS),
+            ]
+        )
+        for col in carried_cols:
+            fill_value = False if self.users[col].dtype == bool else 0
+            if len(self.users) == 0:
+                new_users[col] = fill_value
+                continue
+            carried = self.users[col].take(numpy.maximum(found, 0))
+            carried = carried.reset_index(drop=True)
+            carried[found < 0] = fill_value
+            new_users[col] = carried
+        users = _replace_rows(self.users, new_users, found)
+        user_positions = user_positions.add(user_ids[found < 0], len(self.users))
+
+        # followed_byなど、ユーザテーブルにだけある項目もツイートテーブルには持たない
+        added = df.drop(
+            columns=users.columns.drop("user_id").union(USER_COLS[1:]), errors="ignore"
+        )
+        added = added.drop_duplicates(subset="tweet_id", keep="last")
+        added = added.reset_index(drop=True)
+        added["user_idx"] = user_positions.lookup(
+            added["user_id"].to_numpy(dtype=numpy.int64)
+        ).astype(numpy.int32)
+        tweet_ids = added["tweet_id"].to_numpy(dtype=numpy.int64)
+        found = tweet_positions.lookup(tweet_ids)
+        tweets = _replace_rows(self.tweets, added, found)
+        tweet_positions = tweet_positions.add(tweet_ids[found < 0], len(self.tweets))
+
+        aggregates = None
+        if self._aggregates is not None:
+            removed = self.tweets.take(found[found >= 0])
+            aggregates = self._aggregates.update(removed=removed, added=added)
+        return TweetStore(
+            tweets=tweets,
+            users=users,
+            aggregates=aggregates,
+            positions=(tweet_positions, user_positions),
+            user_flags=self._user_flags,
+        )
+
+    def _get_positions(self) -> Tuple["IdPositions", "IdPositions"]:
+        # 読み込んだストアなど、対応を持っていない場合は初回の追加時に作成する
+        if self._positions is None:
+            self._positions = (
+                IdPositions.from_ids(
+                    self.tweets["tweet_id"].to_numpy(dtype=numpy.int64)
+                ),
+                IdPositions.from_ids(self.users["user_id"].to_numpy(dtype=numpy.int64)),
+            )
+        return self._positions
+
+    def get_aggregates(self) -> TweetAggregates:
+        """ユーザ別・日付別・時間別の集計結果を取得する（初回のみツイートテーブル全体を集計する）"""
+        if self._aggregates is None:
+            self._aggregates = TweetAggregates.from_df(self.tweets)
+        return self._aggregates
+
+    def to_frame(self) -> pandas.DataFrame:
+        """ユーザ軸の項目を結合した（ツイートごとにプロフィールを持つ）DataFrameを生成する"""
+        _users = self.users.drop(columns="user_id")
+        _users = _users.take(self.tweets["user_idx"].to_numpy())
+        return pandas.concat(
+            [self.tweets.reset_index(drop=True), _users.reset_index(drop=True)], axis=1
+        )
+
+    def set_user_flag(self, col: str, user_ids) -> "TweetStore":
+        """ユーザテーブルのフラグ（follower, followingなど）を設定する
+
+        :param col: フラグのカラム名
+        :param user_ids: フラグをTrueにするユーザIDの配列または集合
+        """
+        if isinstance(user_ids, (set, frozenset)):
+            user_ids = numpy.fromiter(user_ids, dtype=numpy.int64, count=len(user_ids))
+        self.users[col] = self.users["user_id"].isin(user_ids)
+        self._user_flags = self._user_flags | {col}
+        return self
+
+    def memory_usage(self) -> Dict[str, int]:
+        """ストアと、ツイートごとにプロフィールを持つ場合の使用メモリ（バイト）を比較する
+
+        :return tweets, users, store（合計）, denormalized（比較対象）のバイト数
+        """
+        tweets = int(self.tweets.memory_usage(deep=True).sum())
+        users = int(self.users.memory_usage(deep=True).sum())
+        denormalized = int(self.to_frame().memory_usage(deep=True).sum())
+        return {
+            "tweets": tweets,
+            "users": users,
+            "store": tweets + users,
+            "denormalized": denormalized,
+        }
+
+
+class IdPositions:
+    """ID（tweet_id, user_id）と行番号の対応を、IDの昇順に並べた配列で保持するクラス
+
+    引き当ては二分探索、追加は配列への挿入で行うため、テーブル全体のハッシュ表を作り直さない。
+
+    :param ids: IDの配列（昇順）
+    :param positions: idsと同じ順の行番号
+    """
+
+    def __init__(self, ids: numpy.ndarray, positions: numpy.ndarray):
+        self.ids = ids
+        self.positions = positions
+
+    @classmethod
+    def from_ids(cls, ids: numpy.ndarray) -> "IdPositions":
+        """行番号順のIDの配列から生成する"""
+        order = numpy.argsort(ids, kind="stable")
+        return cls(ids[order], order.astype(numpy.int64))
+
+    def lookup(self, ids: numpy.ndarray) -> numpy.ndarray:
+        """IDの行番号を取得する（存在しないIDは-1）"""
+        if len(self.ids) == 0:
+            return numpy.full(len(ids), -1, dtype=numpy.int64)
+        idx = numpy.minimum(numpy.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return numpy.where(self.ids[idx] == ids, self.positions[idx], -1)
+
+    def add(self, ids: numpy.ndarray, start: int) -> "IdPositions":
+        """新しいIDを行番号start以降の連番で追加した対応を生成する"""
+        positions = numpy.arange(start, start + len(ids), dtype=numpy.int64)
+        order = numpy.argsort(ids, kind="stable")
+        idx = numpy.searchsorted(self.ids, ids[order])
+        return IdPositions(
+            numpy.insert(self.ids, idx, ids[order]),
+            numpy.insert(self.positions, idx, positions[order]),
+        )
+
+
+def _replace_rows(
+    base: pandas.DataFrame, df: pandas.DataFrame, found: numpy.ndarray
+) -> pandas.DataFrame:
+    """取得済みの行は同じ行番号のまま置き換え、新しい行は末尾に追加する
+
+    :param base: 取得済みのテーブル
+    :param df: 追加・更新する行
+    :param found: dfの各行のbaseでの行番号（新しい行は-1）
+    :return 置き換え後のテーブル
+    """
+    _df = concat_optimized(base, df)
+    if (found < 0).all():
+        return _df
+    indexer = numpy.arange(len(base))
+    indexer[found[found >= 0]] = len(base) + numpy.flatnonzero(found >= 0)
+    indexer = numpy.r_[indexer, len(base) + numpy.flatnonzero(found < 0)]
+    return _df.take(indexer).reset_index(drop=True)
+
+
+def split_user_dimension(df: pandas.DataFrame):
+    """ユーザ軸の項目を含むDataFrameをツイートテーブルとユーザテーブルに分ける
+
+    :param df: ユーザ軸の項目を含むDataFrame
+    :return (ツイートテーブル, ユーザテーブル)
+    """
+    store = TweetStore.from_df(df)
+    return store.tweets, store.users
+
+
+class LocalStore:
+    """収集結果をローカルディレクトリに保存・読み込みするクラス
+
+    常駐の収集処理（collector）が書き込み、TwiVisAPIなどの集計側が読み込む。
+    ツイートは保存のたびに新しいスナップショットのディレクトリに書き出し、
+    最新のスナップショット名（CURRENT）を一時ファイルからの置き換えで切り替える。
+    ツイートテーブル・ユーザテーブル・付加情報は同じスナップショットから読むため、
+    読み込み中に組み合わせの合わないファイルや壊れたファイルを読むことはない。
+
+        <path>/tweets/<name>/CURRENT
+        <path>/tweets/<name>/<snapshot>/tweets.pkl, users.pkl, meta.json
+        <path>/ids/<screen_name>.followers.npy, <screen_name>.following.npy
+
+    :param path: 保存先ディレクトリ
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+
+    def save_tweets(self, name: str, store: TweetStore, meta: Dict = None):
+        """ツイートテーブル・ユーザテーブルを保存する
+
+        :param name: クエリ名
+        :param store: 保存するストア
+        :param meta: 検索ワードなど、集計側で使用する付加情報
+        """
+        _dir = self._path / "tweets" / name
+        _dir.mkdir(parents=True, exist_ok=True)
+        previous = _read_current(_dir)
+        snapshot = Path(tempfile.mkdtemp(dir=_dir, prefix="snapshot-"))
+        try:
+            store.tweets.to_pickle(snapshot / "tweets.pkl")
+            store.users.to_pickle(snapshot / "users.pkl")
+            (snapshot / "meta.json").write_text(
+                json.dumps(meta or {}, ensure_ascii=False), encoding="utf-8"
+            )
+            _replace(_dir / _CURRENT_FILE, lambda f: f.write(snapshot.name.encode()))
+        except BaseException:
+            shutil.rmtree(snapshot, ignore_errors=True)
+            raise
+
+        # 切り替え前のスナップショットは読み込み中の場合があるため1世代だけ残す
+        for path in _dir.iterdir():
+            if path.is_dir() and path.name not in (snapshot.name, previous):
+                shutil.rmtree(path, ignore_errors=True)
+        for legacy in _LEGACY_FILES:
+            # Path.unlink(missing_ok=True)はPython 3.8以降のため使わない
+            try:
+                (_dir / legacy).unlink()
+            except FileNotFoundError:
+                pass
+
+    def load_tweets(self, name: str) -> Tuple[Optional[TweetStore], Dict]:
+        """保存済みのストアを読み込む
+
+        :param name: クエリ名
+        :return (ストア, 付加情報)、保存されていない場合はストアがNone
+        """
+        _dir = self._path / "tweets" / name
+        current = _read_current(_dir)
+        # スナップショット形式にする前に保存したファイルはディレクトリ直下にある
+        snapshot = _dir / current if current is not None else _dir
+        if not (snapshot / "tweets.pkl").exists():
+            return None, {}
+        store = TweetStore(
+            tweets=pandas.read_pickle(snapshot / "tweets.pkl"),
+            users=pandas.read_pickle(snapshot / "users.pkl"),
+        )
+        meta_file = snapshot / "meta.json"
+        meta = json.loads(meta_file.read_text()) if meta_file.exists() else {}
+        return store, meta
+
+    def save_ids(self, screen_name: str, kind: str, ids: numpy.ndarray):
+        """フォロワー・フォロー中ユーザのIDを保存する
+
+        :param screen_name: 対象ユーザ名
+        :param kind: followers or following
+        :param ids: ユーザIDの配列
+        """
+        _dir = self._path / "ids"
+        _dir.mkdir(parents=True, exist_ok=True)
+        _replace(
+            _dir / f"{screen_name}.{kind}.npy",
+            lambda f: numpy.save(f, numpy.asarray(ids, dtype=numpy.int64)),
+        )
+
+    def load_ids(self, screen_name: str, kind: str) -> Optional[numpy.ndarray]:
+        """保存済みのユーザIDを読み込む（保存されていない場合はNone）"""
+        file = self._path / "ids" / f"{screen_name}.{kind}.npy"
+        return numpy.load(file) if file.exists() else None
+
+    def save_state(self, state: Dict):
+        """収集処理の状態（ジョブごとの最終実行時刻など）を保存する"""
+        self._path.mkdir(parents=True, exist_ok=True)
+        _replace(
+            self._path / "state.json",
+            lambda f: f.write(json.dumps(state, ensure_ascii=False).encode()),
+        )
+
+    def load_state(self) -> Dict:
+        file = self._path / "state.json"
+        return json.loads(file.read_text()) if file.exists() else {}
+
+
+def _read_current(_dir: Path) -> Optional[str]:
+    file = _dir / _CURRENT_FILE
+    return file.read_text().strip() if file.exists() else None
+
+
+def _replace(file: Path, write):
+    # 同じディレクトリに書き出してからos.replaceで置き換える（同一ファイルシステム内ではアトミック）
+    fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f".{file.name}.")
+    os.close(fd)
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
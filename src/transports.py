@@ -0,0 +1,185 @@
+import gzip
+import hashlib
+import json
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+import tweepy
+from tweepy.models import Status
+
+from .constants import API_TYPES
+from .errors import ReplayNotFoundError
+from .metrics import increment
+
+# 実行日時から生成される検索期間の指定は、記録・再生のキーに含めない
+_PERIOD_QUERY_PATTERN = re.compile(r"\s*\b(since|until):\S+")
+
+
+class Response:
+    """HTTPレスポンスのうち、後続処理で使用する項目だけを持つクラス"""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+
+class Transport:
+    """Twitter APIへの通信と待機処理をまとめたクラス（実際に通信する）
+
+    :param wait: Falseの場合は待機処理（time.sleep）を行わない
+    """
+
+    def __init__(self, wait: bool = True):
+        self._wait = wait
+
+    def get(self, url: str, params: Dict, oauth) -> Response:
+        return oauth.get(url, params=params)
+
+    def search(self, api: tweepy.API, **params) -> List[Status]:
+        return api.search(**params)
+
+    def rate_limit_status(self, api: tweepy.API) -> Dict:
+        return api.rate_limit_status()
+
+    def sleep(self, seconds: float):
+        increment("sleep_seconds", seconds)
+        if self._wait:
+            time.sleep(seconds)
+
+
+class PageArchive:
+    """取得したページをエンドポイント＋パラメータをキーにgzip圧縮して保存するクラス
+
+    :param path: 保存先ディレクトリ
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict) -> str:
+        _params = {k: v for k, v in params.items() if v is not None}
+        if "q" in _params:
+            _params["q"] = _PERIOD_QUERY_PATTERN.sub("", _params["q"]).strip()
+        payload = json.dumps([endpoint, _params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def save(self, endpoint: str, params: Dict, content: bytes):
+        self._path.mkdir(parents=True, exist_ok=True)
+        key = self.make_key(endpoint, params)
+        with gzip.open(self._path / f"{key}.gz", "wb") as f:
+            f.write(content)
+        with open(self._path / "index.jsonl", "a") as f:
+            f.write(
+                json.dumps(
+                    {"key": key, "endpoint": endpoint, "params": params},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+    def load(self, endpoint: str, params: Dict) -> bytes:
+        file = self._path / f"{self.make_key(endpoint, params)}.gz"
+        if not file.exists():
+            raise ReplayNotFoundError(f"{endpoint} {params}")
+        with gzip.open(file, "rb") as f:
+            return f.read()
+
+
+class RecordingTransport(Transport):
+    """通信しながら、取得したページをアーカイブに記録するクラス
+
+    リクエスト上限などのエラー応答は記録しない。
+
+    :param path: 記録先ディレクトリ
+    :param transport: 実際に通信するTransport
+    """
+
+    def __init__(self, path, transport: Transport = None):
+        super().__init__()
+        self._archive = PageArchive(path)
+        self._transport = transport or Transport()
+
+    def get(self, url: str, params: Dict, oauth) -> Response:
+        res = self._transport.get(url, params=params, oauth=oauth)
+        if res.status_code < 300:
+            self._archive.save(url, params, res.content)
+        return res
+
+    def search(self, api: tweepy.API, **params) -> List[Status]:
+        statuses = self._transport.search(api, **params)
+        content = json.dumps([s._json for s in statuses], ensure_ascii=False)
+        self._archive.save("search", params, content.encode())
+        return statuses
+
+    def rate_limit_status(self, api: tweepy.API) -> Dict:
+        return self._transport.rate_limit_status(api)
+
+    def sleep(self, seconds: float):
+        self._transport.sleep(seconds)
+
+
+class ReplayTransport(Transport):
+    """記録済みのページを返すクラス（通信・待機は行わない）
+
+    :param path: 記録済みのディレクトリ
+    """
+
+    def __init__(self, path):
+        super().__init__(wait=False)
+        self._archive = PageArchive(path)
+        self._pages = {}
+
+    def _load(self, endpoint: str, params: Dict) -> bytes:
+        # 同じページを繰り返し再生する場合に備えて、展開済みのページをメモリに保持する
+        key = self._archive.make_key(endpoint, params)
+        if key not in self._pages:
+            self._pages[key] = self._archive.load(endpoint, params)
+        return self._pages[key]
+
+    def get(self, url: str, params: Dict, oauth) -> Response:
+        return Response(200, self._load(url, params))
+
+    def search(self, api: tweepy.API, **params) -> List[Status]:
+        content = self._load("search", params)
+        return [Status.parse(api, s) for s in json.loads(content)]
+
+    def rate_limit_status(self, api: tweepy.API) -> Dict:
+        # 再生時はリクエスト上限に達しないものとして扱う
+        reset = int(time.time())
+        return {
+            "resources": {
+                api_type: {api_path: {"remaining": 1, "reset": reset}}
+                for api_path, api_type in API_TYPES.items()
+            }
+        }
+
+
+_transport = Transport()
+
+
+def get_transport() -> Transport:
+    return _transport
+
+
+def set_transport(transport: Transport):
+    global _transport
+    _transport = transport
+
+
+@contextmanager
+def use_transport(transport: Transport):
+    """withブロック内だけ通信方法を切り替え、抜けるときに元に戻す
+
+    :param transport: ブロック内で使用するTransport
+    """
+    global _transport
+    previous = _transport
+    _transport = transport
+    try:
+        yield transport
+    finally:
+        _transport = previous
@@ -1,7 +1,7 @@
 import logging
-import time
-from datetime import date, datetime, timedelta
-from typing import Dict, List, Union
+import math
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Tuple, Union
 
 import pytz
 import tweepy
@@ -12,17 +12,24 @@ from .constants import (
     API_COUNTS,
     FULL_TEXT_TWEET_MODE,
     RETRY_COUNT,
+    SAMPLE_STRATUM_HOURS_COL,
+    SAMPLE_WEIGHT_COL,
     SEARCH_API_PATH,
     TODAY_EXCLUDED,
+    TWITTER_EPOCH_MS,
 )
-from .loggers import get_logger
+from .errors import ParameterError, ReplayNotFoundError
+from .loggers import ProgressReporter, get_logger
+from .metrics import increment, measure, timed
 from .processors import make_weekday, make_weekday_hour
+from .transports import get_transport
 
 logger = get_logger(__name__, loglevel=logging.INFO)
 
 
+@timed("search_tweets")
 def search_tweets(
-    api: tweepy.API, search_query: str, limit: int, timezone
+    api: tweepy.API, search_query: str, limit: int, timezone, since_id: int = None
 ) -> List[Dict]:
     """ツイートを検索する
 
@@ -30,6 +37,7 @@ def search_tweets(
     :param search_query: 検索クエリ
     :param timezone: timezoneオブジェクト
     :param limit: 検索件数の上限、この値に達したら結果を返す
+    :param since_id: 指定した場合は、このIDより新しいツイートだけを取得する（取得済みのページを再取得しない）
     """
 
     _now = datetime.now(timezone)
@@ -45,85 +53,279 @@ def search_tweets(
 
     tweets = []
     next_max_tweet_id = None
-    limited = False
 
     # リトライ用に退避
-    auth_keys = TwitterAuthKeys(
+    auth_keys = _get_auth_keys(api)
+
+    progress = ProgressReporter(logger, label="search_tweets", total=limit)
+    while True:
+        api, _tweets = _search_page(
+            api,
+            auth_keys,
+            search_query=search_query,
+            max_id=next_max_tweet_id,
+            since_id=since_id,
+        )
+
+        # 取得するツイートがなくなった場合に処理終了
+        if len(_tweets) == 0:
+            break
+
+        with measure("search_row_conversion"):
+            rows = [_to_tweet_row(t, timezone=timezone) for t in _tweets]
+        limited = bool(limit) and len(tweets) + len(rows) >= limit
+        if limited:
+            rows = rows[: limit - len(tweets)]
+        tweets.extend(rows)
+
+        increment("search_rows", len(_tweets))
+        progress.update(len(_tweets))
+        if limited:
+            break
+
+        next_max_tweet_id = _tweets[-1].id - 1
+        get_transport().sleep(1)
+
+    logger.info(f"{'{:,}'.format(len(tweets))} 件取得")
+    return tweets
+
+
+@timed("sample_tweets")
+def sample_tweets(
+    api: tweepy.API,
+    search_query: str,
+    max_requests: int,
+    timezone,
+    now: datetime = None,
+) -> List[Dict]:
+    """直近7日間を時間帯（層）に分け、リクエスト数の上限を各層に割り振ってツイートを抽出する
+
+    各層は終了時刻のsnowflake IDをmax_idに指定して新しい順に取得する。
+    層のツイートを取得し切れなかった場合は、取得できた時間幅の割合から層全体の件数を推定し、
+    ツイートごとに重み（sample_weight = 層の時間幅 / 取得できた時間幅）を付与する。取得し切れた層の重みは1。
+    層の時間幅は1時間（リクエスト数の上限が層の数より少ない場合は、上限に収まるよう広げる）。
+    層の時間幅が1時間より広い場合は層の中で件数が偏るため、信頼区間は求めない（sample_stratum_hoursに時間幅を付与する）。
+
+    :param api: tweepy.API
+    :param search_query: 検索クエリ
+    :param max_requests: リクエスト数の上限（1リクエスト100件）
+    :param timezone: timezoneオブジェクト
+    :param now: 層を分ける基準の日時、未指定の場合は現在日時
+    :return ツイートの辞書のリスト（sample_weightを含む）
+    """
+    if max_requests < 1:
+        raise ParameterError("max_requestsは1以上を指定してください")
+
+    _now = now or datetime.now(timezone)
+    _query = search_query
+    _query += " " + _make_search_from_query(timezone=timezone)
+    _end = _now
+    if TODAY_EXCLUDED:
+        _query += " " + _make_excluded_today_search_to_query(timezone=timezone)
+        _end = timezone.localize(datetime.combine(_now.date(), time()))
+
+    _start = timezone.localize(
+        datetime.combine((_now - timedelta(days=7)).date(), time())
+    )
+    strata = _make_strata(_start, _end, max_requests=max_requests)
+    pages = max_requests // len(strata)
+    # 最も古い層は時間幅を切り詰めていない
+    hours = (strata[-1][1] - strata[-1][0]) // timedelta(hours=1)
+    logger.info(f"{len(strata)} 区間 × {pages} リクエストで抽出（{hours}時間ごと）")
+    if hours > 1:
+        min_requests = math.ceil((_end - _start) / timedelta(hours=1))
+        logger.warning(
+            f"区間が1時間より広いため、推定値は区間内で偏り、信頼区間は求めません（{min_requests} リクエスト以上を指定してください）"
+        )
+
+    auth_keys = _get_auth_keys(api)
+    tweets = []
+    progress = ProgressReporter(logger, label="sample_tweets", total=len(strata))
+    for i, (stratum_start, stratum_end) in enumerate(strata):
+        rows = []
+        exhausted = False
+        max_id = to_snowflake_id(stratum_end) - 1
+        for _ in range(pages):
+            api, _tweets = _search_page(
+                api, auth_keys, search_query=_query, max_id=max_id
+            )
+            with measure("search_row_conversion"):
+                _rows = [_to_tweet_row(t, timezone=timezone) for t in _tweets]
+            _in_stratum = [r for r in _rows if r["tweeted_dt"] >= stratum_start]
+            rows.extend(_in_stratum)
+            increment("search_rows", len(_tweets))
+            # 検索APIは途中のページでも件数が1ページに満たないことがあるため、
+            # 結果が空・層の開始時刻より古いツイートが含まれる場合だけ層を取得し切ったとする
+            if len(_tweets) == 0 or len(_in_stratum) < len(_rows):
+                exhausted = True
+                break
+            max_id = _tweets[-1].id - 1
+            get_transport().sleep(1)
+
+        weight = 1.0
+        if not exhausted and len(rows) > 1:
+            # n件目のツイートまでの時間幅をcとすると、(n - 1) / cが時間あたりの件数の不偏推定値になる
+            covered = (stratum_end - rows[-1]["tweeted_dt"]).total_seconds()
+            weight = (stratum_end - stratum_start).total_seconds() / max(covered, 1)
+            weight = max(weight * (len(rows) - 1) / len(rows), 1.0)
+        for r in rows:
+            r[SAMPLE_WEIGHT_COL] = weight
+            r[SAMPLE_STRATUM_HOURS_COL] = hours
+        tweets.extend(rows)
+        increment("sample_strata_exhausted" if exhausted else "sample_strata_estimated")
+        progress.update(1)
+        if i + 1 < len(strata):
+            get_transport().sleep(1)
+
+    logger.info(
+        f"{'{:,}'.format(len(tweets))} 件取得"
+        f"（推定 {'{:,}'.format(round(sum(t[SAMPLE_WEIGHT_COL] for t in tweets)))} 件）"
+    )
+    return tweets
+
+
+def to_snowflake_id(dt: datetime) -> int:
+    """日時をその時刻のsnowflake形式のツイートIDの最小値に変換する
+
+    ツイートIDの上位ビットは投稿時刻（TWITTER_EPOCH_MSからのミリ秒）のため、
+    max_idに指定すると、その時刻より前のツイートから検索できる。
+
+    :param dt: タイムゾーン付きのdatetime
+    :return ツイートID
+    """
+    return (int(dt.timestamp() * 1000) - TWITTER_EPOCH_MS) << 22
+
+
+def _make_strata(start: datetime, end: datetime, max_requests: int) -> List:
+    """期間を層（時間帯）に分ける
+
+    層の時間幅は1時間単位とし、層の数がリクエスト数の上限を超えないように広げる。
+
+    :param start: 期間の開始日時
+    :param end: 期間の終了日時
+    :param max_requests: リクエスト数の上限
+    :return (開始日時, 終了日時)のリスト（新しい順）
+    """
+    hours = math.ceil((end - start) / timedelta(hours=1))
+    width = timedelta(hours=math.ceil(hours / max_requests))
+    strata = []
+    _start = start
+    while _start < end:
+        strata.append((_start, min(_start + width, end)))
+        _start += width
+    return strata[::-1]
+
+
+def _get_auth_keys(api: tweepy.API) -> TwitterAuthKeys:
+    return TwitterAuthKeys(
         api_key=api.auth.consumer_key,
         api_secret=api.auth.consumer_secret,
         access_token=api.auth.access_token,
         access_token_secret=api.auth.access_token_secret,
     )
 
+
+def _search_page(
+    api: tweepy.API,
+    auth_keys: TwitterAuthKeys,
+    search_query: str,
+    max_id: int,
+    since_id: int = None,
+) -> Tuple[tweepy.API, List]:
+    """検索結果を1ページ取得する（失敗した場合は再認証してリトライする）
+
+    :return (再認証後のtweepy.API, 取得したツイート)
+    """
+    params = dict(
+        q=search_query,
+        tweet_mode=FULL_TEXT_TWEET_MODE,
+        count=API_COUNTS[SEARCH_API_PATH],
+        max_id=max_id,
+    )
+    # 記録済みのページ（ReplayTransport）と同じパラメータになるよう、未指定の場合は渡さない
+    if since_id is not None:
+        params["since_id"] = since_id
     retry_count = 0
     while True:
-        _tweets = []
         try:
-            _tweets = api.search(
-                q=search_query,
-                tweet_mode=FULL_TEXT_TWEET_MODE,
-                count=API_COUNTS[SEARCH_API_PATH],
-                max_id=next_max_tweet_id,
-            )
-            retry_count = 0
+            with measure("search_http"):
+                _tweets = get_transport().search(api, **params)
+            increment("search_pages")
+            return api, _tweets
+
+        except ReplayNotFoundError:
+            # 記録されていないページは再認証しても取得できない
+            raise
 
         except Exception as e:
             if retry_count > RETRY_COUNT:
                 raise e
 
+            increment("search_retries")
             logger.info("ReadTimeout occurred and re-authenticated.")
             api = auth_twitter_api(auth_keys=auth_keys)
             retry_count += 1
-            continue
-
-        # 取得するツイートがなくなった場合に処理終了
-        if len(_tweets) == 0:
-            break
-
-        for t in _tweets:
-            if timezone == "UTC":
-                dt = t.created_at
-            else:
-                dt = _convert_timezone(t.created_at, timezone=timezone)
-
-            tweeted_weekday = make_weekday(dt, timezone=timezone)
-            tweeted_hour = dt.strftime("%H")
-            tweets.append(
-                {
-                    "tweeted_dt": dt,
-                    "tweeted_date": dt.date(),
-                    "tweeted_weekday": tweeted_weekday,
-                    "tweeted_hour": tweeted_hour,
-                    "tweeted_wh": make_weekday_hour(
-                        weekday=tweeted_weekday, hour=tweeted_hour
-                    ),
-                    "tweet_id": t.id,
-                    "favorite_count": t.favorite_count,
-                    "retweet_count": t.retweet_count,
-                    "source": t.source,
-                    "user_id": t.user.id,
-                    "user_screen_name": t.user.screen_name,
-                    "user_name": t.user.name,
-                    "user_profile_image_url": t.user.profile_image_url_https,
-                    "followers_count": t.user.followers_count,
-                    "friends_count": t.user.friends_count,
-                    "following": t.user.following,
-                    "follower": False,  # フォロワーかどうかはsearchから取得できない（別でセットする手段を用意する）
-                }
-            )
 
-            if limit and len(tweets) >= limit:
-                limited = True
-                break
-
-        logger.info(f"{'{:,}'.format(len(tweets))} 件取得")
-        if limited:
-            break
 
-        next_max_tweet_id = _tweets[-1].id - 1
-        time.sleep(1)
-
-    return tweets
+def _to_tweet_row(t: tweepy.models.Status, timezone) -> Dict:
+    if timezone == "UTC":
+        dt = t.created_at
+    else:
+        dt = _convert_timezone(t.created_at, timezone=timezone)
+
+    tweeted_weekday = make_weekday(dt, timezone=timezone)
+    tweeted_hour = dt.strftime("%H")
+    return {
+        "tweeted_dt": dt,
+        "tweeted_date": dt.date(),
+        "tweeted_weekday": tweeted_weekday,
+        "tweeted_hour": tweeted_hour,
+        "tweeted_wh": make_weekday_hour(weekday=tweeted_weekday, hour=tweeted_hour),
+        "tweet_id": t.id,
+        "favorite_count": t.favorite_count,
+        "retweet_count": t.retweet_count,
+        "source": t.source,
+        **_extract_tweet_entities(t),
+        "user_id": t.user.id,
+        "user_screen_name": t.user.screen_name,
+        "user_name": t.user.name,
+        "user_profile_image_url": t.user.profile_image_url_https,
+        "followers_count": t.user.followers_count,
+        "friends_count": t.user.friends_count,
+        "following": t.user.following,
+        "follower": False,  # フォロワーかどうかはsearchから取得できない（別でセットする手段を用意する）
+    }
+
+
+def _extract_tweet_entities(t: tweepy.models.Status) -> Dict:
+    """本文・ハッシュタグ・メンション・リツイート/引用/返信の関係を抽出する
+
+    リツイートの本文は省略されるため、リツイート元の本文・エンティティを使用する。
+    ハッシュタグとメンションは大文字小文字を区別せずに扱うため小文字に揃える。
+    関係先が存在しないIDは0とする（Noneが混在するとDataFrameでfloat64になり桁落ちするため）。
+
+    :param t: tweepy.models.Status
+    :return 抽出した項目の辞書
+    """
+    retweeted = getattr(t, "retweeted_status", None)
+    quoted = getattr(t, "quoted_status", None)
+    _t = retweeted or t
+    entities = _t.entities
+    return {
+        "full_text": _t.full_text,
+        "lang": t.lang,
+        "hashtags": tuple(h["text"].lower() for h in entities.get("hashtags", [])),
+        "mention_user_ids": tuple(m["id"] for m in entities.get("user_mentions", [])),
+        "mention_screen_names": tuple(
+            m["screen_name"].lower() for m in entities.get("user_mentions", [])
+        ),
+        "in_reply_to_tweet_id": t.in_reply_to_status_id or 0,
+        "in_reply_to_user_id": t.in_reply_to_user_id or 0,
+        "retweeted_tweet_id": retweeted.id if retweeted else 0,
+        "retweeted_user_id": retweeted.user.id if retweeted else 0,
+        "quoted_tweet_id": getattr(t, "quoted_status_id", None) or 0,
+        "quoted_user_id": quoted.user.id if quoted else 0,
+    }
 
 
 def _make_search_from_query(timezone) -> str:
@@ -1,7 +1,10 @@
 import json
-from typing import Dict
+from typing import Dict, Tuple
 
-from .errors import RateLimitError, TwitterApiError
+from .errors import NotFoundError, RateLimitError, TwitterApiError
+from .ids import IdBuffer, parse_id_page
+from .metrics import increment, measure
+from .transports import get_transport
 
 
 def execute_get_method(
@@ -9,14 +12,46 @@ def execute_get_method(
     params: Dict,
     oauth: str,
 ):
-    res = oauth.get(url, params=params)
+    res = _get(url, params=params, oauth=oauth)
+    return json.loads(res.content)
+
+
+def execute_get_ids_method(
+    url: str,
+    params: Dict,
+    oauth: str,
+    buffer: IdBuffer,
+) -> Tuple[int, int]:
+    """ID一覧を返すAPIを実行し、IDをバッファに追記する
+
+    :param url: APIのURL
+    :param params: リクエストパラメータ
+    :param oauth: OAuthセッション
+    :param buffer: IDの追記先
+    :return (このページのID件数, next_cursor)
+    """
+    res = _get(url, params=params, oauth=oauth)
+    with measure("parse_id_page"):
+        return parse_id_page(res.content, buffer)
+
+
+def _get(url: str, params: Dict, oauth):
+    with measure("http_get"):
+        res = get_transport().get(url, params=params, oauth=oauth)
+    increment("http_requests")
+    increment("http_bytes", len(res.content))
 
     # リクエスト上限エラー
     if res.status_code == 429:
+        increment("rate_limited")
         raise RateLimitError()
 
+    # 指定したユーザが1件も存在しない（users/lookupなど）
+    elif res.status_code == 404:
+        raise NotFoundError(f"HTTP status: {res.status_code}")
+
     # 異常終了
     elif res.status_code >= 300:  # NGの場合
         raise TwitterApiError(f"HTTP status: {res.status_code}")
 
-    return json.loads(res.text)
+    return res
@@ -1,55 +1,62 @@
 import logging
 import time
-from typing import List
 
+import numpy
 import tweepy
 
 from .constants import API_COUNTS, API_URLS, FOLLOWER_IDS_API_PATH, FRIEND_IDS_API_PATH
 from .errors import RateLimitError
-from .limits import get_rate_limit_reset_time, is_rate_limit
-from .loggers import get_logger
-from .twitters import execute_get_method
+from .ids import IdBuffer
+from .limits import get_rate_limit
+from .loggers import ProgressReporter, get_logger
+from .metrics import increment, measure, timed
+from .transports import get_transport
+from .twitters import execute_get_ids_method
 
 logger = get_logger(__name__, loglevel=logging.INFO)
 
 
-def get_follower_ids(api: tweepy.API, user_screen_name: str) -> List[int]:
+def get_follower_ids(api: tweepy.API, user_screen_name: str) -> numpy.ndarray:
     """フォロワーのユーザIDを取得する
 
     :param api: tweepy.API
     :param user_screen_name: 対象ユーザ名
-    :return フォロワーのユーザIDリスト
+    :return フォロワーのユーザIDの配列
     """
     return _get_user_ids(api, user_screen_name, api_path=FOLLOWER_IDS_API_PATH)
 
 
-def get_following_ids(api: tweepy.API, user_screen_name: str) -> List[int]:
+def get_following_ids(api: tweepy.API, user_screen_name: str) -> numpy.ndarray:
     """フォロー中ユーザのIDを取得する
 
     :param api: tweepy.API
     :param user_screen_name: 対象ユーザ名
-    :return フォロー中のユーザIDリスト
+    :return フォロー中のユーザIDの配列
     """
     return _get_user_ids(api, user_screen_name, api_path=FRIEND_IDS_API_PATH)
 
 
-def _get_user_ids(api: tweepy.API, user_screen_name: str, api_path: str) -> List[int]:
+@timed("get_user_ids")
+def _get_user_ids(
+    api: tweepy.API, user_screen_name: str, api_path: str
+) -> numpy.ndarray:
     """フォロワー or フォロー中ユーザのIDを取得する
 
     :param api: tweepy.API
     :param user_screen_name: 対象ユーザ名
     :param api_path: Twitter APIのパス
-    :return Twitter APIから取得したユーザIDリスト
+    :return Twitter APIから取得したユーザIDの配列（int64）
     """
-    ids = []
+    ids = IdBuffer(capacity=API_COUNTS[api_path])
+    progress = ProgressReporter(logger, label=f"{api_path} @{user_screen_name}")
     next_cursor = -1
     while True:
-        _tweets = []
-
-        if is_rate_limit(api, api_path=api_path):
-            reset_time = get_rate_limit_reset_time(api, api_path=api_path)
+        with measure("rate_limit_check"):
+            rate_limit = get_rate_limit(api, api_path=api_path)
+        if rate_limit["remaining"] == 0:
+            reset_time = rate_limit["reset"] - int(time.time())
             logger.info(f"アクセス上限のため処理休止中({reset_time}秒)..")
-            time.sleep(reset_time)
+            get_transport().sleep(reset_time)
 
         try:
             params = {
@@ -57,24 +64,31 @@ def _get_user_ids(api: tweepy.API, user_screen_name: str, api_path: str) -> List
                 "screen_name": user_screen_name,
                 "cursor": next_cursor,
             }
-            _results = execute_get_method(
+            count, next_cursor = execute_get_ids_method(
                 url=API_URLS[api_path],
                 params=params,
                 oauth=api.auth.oauth,
+                buffer=ids,
             )
 
         except RateLimitError:
             logger.info("アクセス上限のため処理休止中(15分)..")
-            time.sleep(15 * 60)
+            increment("user_ids_retries")
+            get_transport().sleep(15 * 60)
             continue
 
-        _ids = _results["ids"]
-        ids.extend(_ids)
-        if len(_ids) < API_COUNTS[api_path]:
+        increment("user_ids_pages")
+        increment("user_ids", count)
+        # next_cursorが0の場合は最終ページ
+        if count < API_COUNTS[api_path] or next_cursor == 0:
             break
 
-        logger.info(f"{'{:,}'.format(len(ids))} 件取得")
-        next_cursor = _results["next_cursor"]
-        time.sleep(1)
+        progress.update(
+            count,
+            remaining=max(rate_limit["remaining"] - 1, 0),
+            reset_at=rate_limit["reset"],
+        )
+        get_transport().sleep(1)
 
-    return ids
+    logger.info(f"{'{:,}'.format(len(ids))} 件取得")
+    return ids.to_array()
@@ -0,0 +1,9 @@
+"""テスト共通の設定
+
+合成データ（synthetic）とtweepy.APIのフェイク（fake_api）はベンチマークと共通のものを使用する。
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
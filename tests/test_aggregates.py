@@ -0,0 +1,206 @@
+"""差分更新した集計結果（TweetAggregates）が、全件を集計し直した結果と一致するかのテスト"""
+
+from datetime import datetime
+
+import numpy
+import pandas
+import pytest
+import pytz
+from synthetic import make_synthetic_tweet_df
+
+from twivis.aggregates import TweetAggregates
+from twivis.processors import (
+    make_count_tweeted_df,
+    make_count_tweeted_hour_df,
+    make_count_tweeted_weekday_df,
+    make_engagement_df,
+    make_tweet_user_weekday_max_hour_df,
+    make_tweeted_hour_label_range,
+    make_tweeted_weekday_hour_label_range,
+    make_tweeted_weekday_range,
+    make_user_df,
+)
+from twivis.stores import TweetStore
+
+TIMEZONE = pytz.timezone("Asia/Tokyo")
+NOW = TIMEZONE.localize(datetime(2021, 5, 1, 12))
+
+
+def assert_frame_equal(actual: pandas.DataFrame, expected: pandas.DataFrame):
+    pandas.testing.assert_frame_equal(
+        actual,
+        expected,
+        check_dtype=False,
+        check_index_type=False,
+        check_column_type=False,
+        check_categorical=False,
+    )
+
+
+def assert_matches_recompute(store: TweetStore):
+    """集計結果の全ての読み出しを、processorsで全件を集計した結果と比較する"""
+    aggregates = store.get_aggregates()
+    tweets, users = store.tweets, store.users
+    weekdays = make_tweeted_weekday_range(TIMEZONE)
+    weekday_hours = make_tweeted_weekday_hour_label_range(TIMEZONE)
+
+    assert_frame_equal(
+        aggregates.make_user_df(users), make_user_df(tweets, users=users)
+    )
+    assert_frame_equal(
+        aggregates.make_count_df("tweeted_weekday", weekdays),
+        make_count_tweeted_weekday_df(tweets, TIMEZONE),
+    )
+    assert_frame_equal(
+        aggregates.make_count_df("tweeted_wh", weekday_hours),
+        make_count_tweeted_df(tweets, TIMEZONE, group_col="tweeted_wh"),
+    )
+    assert_frame_equal(
+        aggregates.make_count_df("tweeted_hour", make_tweeted_hour_label_range()),
+        make_count_tweeted_hour_df(tweets),
+    )
+    assert_frame_equal(
+        aggregates.make_user_count_df(weekdays),
+        make_count_tweeted_weekday_df(
+            make_tweet_user_weekday_max_hour_df(tweets), TIMEZONE
+        ),
+    )
+    for group_col, labels in (
+        ("tweeted_weekday", weekdays),
+        ("tweeted_wh", weekday_hours),
+    ):
+        assert_frame_equal(
+            aggregates.make_engagement_df(group_col, labels),
+            make_engagement_df(tweets, group_col, labels),
+        )
+    assert aggregates.count_users() == tweets["user_id"].nunique()
+    assert aggregates.sum("tweets_count") == len(tweets)
+    assert aggregates.sum("favorite_sum") == tweets["favorite_count"].sum()
+    assert aggregates.sum("retweet_sum") == tweets["retweet_count"].sum()
+
+
+def refetch(store: TweetStore, n: int, seed: int) -> pandas.DataFrame:
+    """取得済みのツイートを、いいね数・リツイート数を変えて取得し直したDataFrameを生成する"""
+    rng = numpy.random.default_rng(seed)
+    df = store.to_frame().drop(columns=["user_idx", "followed_by"])
+    df = df.sample(n, random_state=seed)
+    # 検索結果のfollowerは常にFalse（set_followersで設定する）
+    df["follower"] = False
+    # 検索結果と同じく、カテゴリ型などに変換する前の値とする
+    df = df.astype(
+        {
+            col: object
+            for col in df.columns
+            if isinstance(df[col].dtype, pandas.CategoricalDtype)
+        }
+    )
+    df["favorite_count"] += rng.integers(0, 5, len(df))
+    df["retweet_count"] += rng.integers(0, 3, len(df))
+    return df
+
+
+@pytest.fixture(scope="module")
+def tweet_df() -> pandas.DataFrame:
+    return make_synthetic_tweet_df(5000, seed=0, timezone=TIMEZONE, now=NOW)
+
+
+@pytest.fixture
+def store(tweet_df) -> TweetStore:
+    _store = TweetStore.from_df(tweet_df.iloc[1000:].reset_index(drop=True))
+    _store.get_aggregates()
+    return _store
+
+
+def test_from_df(store):
+    assert_matches_recompute(store)
+
+
+def test_upsert_new_tweets(store, tweet_df):
+    for start in range(0, 1000, 250):
+        store = store.upsert(tweet_df.iloc[start : start + 250])
+        assert_matches_recompute(store)
+    assert len(store.tweets) == len(tweet_df)
+
+
+def test_upsert_refetched_tweets(store, tweet_df):
+    for seed in range(3):
+        store = store.upsert(refetch(store, 300, seed=seed))
+        assert_matches_recompute(store)
+    assert len(store.tweets) == len(tweet_df) - 1000
+
+
+def test_upsert_new_and_refetched_tweets(store, tweet_df):
+    for i, start in enumerate(range(0, 1000, 500)):
+        delta = pandas.concat(
+            [tweet_df.iloc[start : start + 500], refetch(store, 200, seed=i)]
+        )
+        store = store.upsert(delta)
+        assert_matches_recompute(store)
+    assert store.tweets["tweet_id"].is_unique
+    assert store.users["user_id"].is_unique
+
+
+def test_upsert_duplicated_tweets_in_delta(store):
+    delta = refetch(store, 100, seed=0)
+    # 同じツイートを2回取得した場合は後から取得した方で置き換える
+    later = delta.assign(favorite_count=delta["favorite_count"] + 10)
+    store = store.upsert(pandas.concat([delta, later]))
+    assert_matches_recompute(store)
+    actual = store.tweets.set_index("tweet_id").loc[later["tweet_id"]]
+    assert (actual["favorite_count"].to_numpy() == later["favorite_count"]).all()
+
+
+def test_upsert_removes_all_tweets_of_group(tweet_df):
+    # 更新で集計対象のグループ（曜日・時間帯）からツイートがなくなる場合
+    base = tweet_df[tweet_df["tweeted_hour"] == "03"]
+    store = TweetStore.from_df(base.reset_index(drop=True))
+    store.get_aggregates()
+    delta = refetch(store, len(store.tweets), seed=0)
+    delta["tweeted_hour"] = "04"
+    delta["tweeted_wh"] = delta["tweeted_weekday"].astype(str) + " 04"
+    store = store.upsert(delta)
+    assert_matches_recompute(store)
+
+
+def test_follower_flag_changes(store, tweet_df):
+    user_ids = store.users["user_id"].to_numpy()
+    store = store.set_user_flag("follower", user_ids[::3])
+    assert_matches_recompute(store)
+
+    store = store.upsert(tweet_df.iloc[:500])
+    # 取得済みのユーザのフラグは引き継ぎ、新しいユーザはFalseとする
+    follower = store.users.set_index("user_id")["follower"]
+    assert follower[user_ids[::3]].all()
+    assert not follower.drop(user_ids[::3]).any()
+    assert_matches_recompute(store)
+
+    store = store.set_user_flag("follower", user_ids[1::5])
+    store = store.upsert(refetch(store, 200, seed=0))
+    assert_matches_recompute(store)
+
+
+def test_following_flag_is_carried_over(store, tweet_df):
+    user_ids = store.users["user_id"].to_numpy()
+    store = store.set_user_flag("following", user_ids[::2])
+    # 検索結果のfollowingはログイン中のアカウントから見た値のため、設定済みのフラグを上書きしない
+    delta = refetch(store, 300, seed=0).assign(following=True)
+    store = store.upsert(pandas.concat([tweet_df.iloc[:500], delta]))
+    following = store.users.set_index("user_id")["following"]
+    assert following[user_ids[::2]].all()
+    assert not following.drop(user_ids[::2]).any()
+
+
+def test_update_does_not_change_previous_aggregates(store, tweet_df):
+    aggregates = store.get_aggregates()
+    expected = aggregates.make_user_df(store.users).copy()
+    store.upsert(pandas.concat([tweet_df.iloc[:500], refetch(store, 200, seed=0)]))
+    assert_frame_equal(aggregates.make_user_df(store.users), expected)
+
+
+def test_from_df_matches_incremental(store, tweet_df):
+    store = store.upsert(tweet_df.iloc[:1000])
+    aggregates = TweetAggregates.from_df(store.tweets)
+    assert_frame_equal(
+        aggregates.make_user_df(store.users),
+        store.get_aggregates().make_user_df(store.users),
+    )
@@ -0,0 +1,66 @@
+"""サンプリング取得（sample_tweets）の推定値と信頼区間のテスト"""
+
+from datetime import datetime
+
+import pandas
+import pytest
+import pytz
+from fake_api import FakeAPI
+from synthetic import make_synthetic_tweet_df
+
+from twivis.processors import estimate_total, make_estimated_df
+from twivis.transports import Transport, use_transport
+from twivis.tweets import sample_tweets
+
+TIMEZONE = pytz.timezone("Asia/Tokyo")
+# 合成データとsample_tweetsの層の基準日時をそろえ、結果を再現できるようにする
+NOW = TIMEZONE.localize(datetime(2021, 5, 1, 12))
+
+
+class ShortPageAPI(FakeAPI):
+    """途中のページでも1ページ（100件）に満たない件数を返す検索API"""
+
+    def search(self, q, tweet_mode=None, count=100, max_id=None, since_id=None):
+        return super().search(
+            q, tweet_mode=tweet_mode, count=60, max_id=max_id, since_id=since_id
+        )
+
+
+def sample(api: FakeAPI, max_requests: int) -> pandas.DataFrame:
+    with use_transport(Transport(wait=False)):
+        return pandas.DataFrame(
+            sample_tweets(
+                api, "word", max_requests=max_requests, timezone=TIMEZONE, now=NOW
+            )
+        )
+
+
+@pytest.fixture(scope="module")
+def tweet_df() -> pandas.DataFrame:
+    return make_synthetic_tweet_df(50000, seed=0, timezone=TIMEZONE, now=NOW)
+
+
+def test_short_pages_are_not_exhausted(tweet_df):
+    df = sample(ShortPageAPI(tweet_df=tweet_df), max_requests=400)
+    # 1ページに満たない件数でも層を取得し切ったとはみなさず、重みを付けて推定する
+    assert (df["sample_weight"] > 1).any()
+    total, error = estimate_total(df)
+    assert abs(total - len(tweet_df)) <= error
+
+
+def test_hourly_strata_cover_actual_count(tweet_df):
+    df = sample(FakeAPI(tweet_df=tweet_df), max_requests=200)
+    assert (df["sample_stratum_hours"] == 1).all()
+    total, error = estimate_total(df)
+    assert 0 < error
+    assert abs(total - len(tweet_df)) <= error
+
+
+def test_wide_strata_have_no_intervals(tweet_df):
+    df = sample(FakeAPI(tweet_df=tweet_df), max_requests=30)
+    assert (df["sample_stratum_hours"] > 1).all()
+    assert estimate_total(df)[1] is None
+    estimated = make_estimated_df(
+        df, group_col="tweeted_weekday", labels=df["tweeted_weekday"].unique()
+    )
+    assert estimated["count_error"].isna().all()